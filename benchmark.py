@@ -0,0 +1,311 @@
+#           Suez Plugin (toutsurmoneau)
+#
+#           Offline benchmarks of the plugin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Runs plugin.py inside the Domoticz emulator of fakeDomoticz.py, against the local
+# stand-in of the website of fakeSuez.py, and reports wall time, requests, bytes
+# transferred and device updates of a backfill (first start) and of a restart.
+#
+#   python benchmark.py [--days 30 365 1000] [--parallel 2] [--counters 1] [--options "years=5"] [--site-limit 2]
+#
+# Requests are spaced by the rate limiter of the plugin (1 per second after a burst of 5 by default),
+# the emulator waits for delayed requests, so wall time includes these delays.
+#
+# With --parse, it compares instead the parsing of statJData rows by parseStatJData()
+# with the previous strptime based parsing, for the given days of history.
+#
+#   python benchmark.py --parse [--days 1000] [--repeat 20]
+#
+# With --logging, it compares the handling of each month response of the given days of history
+# (dump, parsing and device writes) with debug off, debug messages on, and dumps on.
+#
+#   python benchmark.py --logging [--days 1000] [--repeat 20]
+#
+# With --bulk, it compares the first import written one day at a time in the device with the bulk import
+# written straight in the Domoticz database, both in an emulated Domoticz database (or in a copy of --domoticz-db).
+#
+#   python benchmark.py --bulk [--days 1000] [--domoticz-db domoticz.db] [--options "rate=600;burst=20"]
+#
+import argparse
+import importlib
+import json
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from datetime import date
+from datetime import timedelta
+
+import fakeDomoticz
+import fakeSuez
+
+SUEZ_USER = "user@example.com"
+SUEZ_PASSWORD = "password"
+SUEZ_COUNTERS = ["123456789", "223456789", "323456789", "423456789"]
+
+# Load a fresh copy of the plugin, as Domoticz does when the hardware is (re)started
+def loadPlugin():
+    import plugin
+    return importlib.reload(plugin)
+
+# Run the plugin until its first run is over and every day has been written
+def runPlugin(dParameters):
+    plugin = loadPlugin()
+    fakeDomoticz.resetStats()
+    emulator = fakeDomoticz.Emulator(plugin, dParameters)
+    fStart = time.perf_counter()
+    emulator.start()
+
+    def bDone():
+        p = plugin._plugin
+        return (p.sConnectionStep == "idle") and (not p.lWriteQueue) and (p.nextConnection > datetime.now()) and (not fakeDomoticz.lEvents)
+
+    bFinished = emulator.run(bDone)
+    emulator.stop()
+    fWallTime = time.perf_counter() - fStart
+    dResult = dict(fakeDomoticz.dStats)
+    dResult["wallTime"] = fWallTime
+    dResult["heartbeats"] = emulator.iHeartbeats
+    dResult["finished"] = bFinished
+    dResult["writeTime"] = sum(plugin._plugin.timings.dRunSamples.get("write", [])) / 1000.0
+    return dResult
+
+# Backfill of iDays days on a new install, then a restart of the plugin
+def benchmarkBackfill(server, iDays, iParallel, lCounters, sOptions=""):
+    sHomeFolder = tempfile.mkdtemp(prefix="suez-bench-") + "/"
+    dParameters = {
+        "Username": SUEZ_USER,
+        "Password": SUEZ_PASSWORD,
+        "Mode1": str(iDays),
+        "Mode2": str(iParallel),
+        "Mode3": "0",
+        "Mode5": sOptions,
+        "Mode6": ",".join(lCounters),
+        "HomeFolder": sHomeFolder,
+        "HardwareID": 1,
+        "Key": "suez",
+        "Name": "Suez",
+    }
+    lResults = []
+    try:
+        fakeDomoticz.Devices.clear()
+        for sScenario in ("backfill", "restart"):
+            server.state.resetStats()
+            dResult = runPlugin(dParameters)
+            dResult["scenario"] = sScenario
+            dResult["days"] = iDays
+            dResult["serverRequests"] = server.state.dStats["requests"]
+            dResult["logins"] = server.state.dStats["logins"]
+            dResult["throttled"] = server.state.dStats["throttled"]
+            lResults.append(dResult)
+    finally:
+        shutil.rmtree(sHomeFolder, ignore_errors=True)
+    return lResults
+
+# First import of iDays days written day by day in the devices, then with the bulk import, in a Domoticz database
+# created by the emulator or copied from sFixture
+def benchmarkBulk(server, iDays, iParallel, lCounters, sOptions="", sFixture=None):
+    lResults = []
+    dDays = {}
+    for sMode, sModeOptions in (("per row", ""), ("bulk", "bulkimport=1")):
+        sHomeFolder = tempfile.mkdtemp(prefix="suez-bench-") + "/"
+        sDatabase = sHomeFolder + "domoticz.db"
+        if sFixture:
+            shutil.copyfile(sFixture, sDatabase)
+        else:
+            fakeDomoticz.createDatabase(sDatabase)
+        dParameters = {
+            "Username": SUEZ_USER,
+            "Password": SUEZ_PASSWORD,
+            "Mode1": str(iDays),
+            "Mode2": str(iParallel),
+            "Mode3": "0",
+            "Mode5": ";".join(sOption for sOption in (sOptions, sModeOptions) if sOption),
+            "Mode6": ",".join(lCounters),
+            "HomeFolder": sHomeFolder,
+            "Database": sDatabase,
+            "HardwareID": 1,
+            "Key": "suez",
+            "Name": "Suez",
+        }
+        try:
+            fakeDomoticz.Devices.clear()
+            fakeDomoticz.openDatabase(sDatabase)
+            server.state.resetStats()
+            dResult = runPlugin(dParameters)
+            lDeviceIDs = [device.ID for device in fakeDomoticz.Devices.values()]
+            dDays[sMode] = fakeDomoticz.database.execute("SELECT DeviceRowID, Date, Value, Counter FROM Meter_Calendar WHERE DeviceRowID IN (" + ",".join("?" * len(lDeviceIDs)) + ") ORDER BY DeviceRowID, Date", lDeviceIDs).fetchall()
+            dResult["mode"] = sMode
+            dResult["days"] = iDays
+            dResult["calendarRows"] = len(dDays[sMode])
+            lResults.append(dResult)
+        finally:
+            fakeDomoticz.closeDatabase()
+            shutil.rmtree(sHomeFolder, ignore_errors=True)
+    if dDays["per row"] != dDays["bulk"]:
+        print("Bulk import doesn't give the same daily history as the per row path for " + str(iDays) + " days")
+    return lResults
+
+def printBulkResults(lResults):
+    print("%-8s %5s %9s %10s %8s %14s %7s" % ("mode", "days", "wall (s)", "writes (s)", "updates", "calendar rows", "errors"))
+    for dResult in lResults:
+        print("%-8s %5d %9.3f %10.3f %8d %14d %7d%s" % (dResult["mode"], dResult["days"], dResult["wallTime"], dResult["writeTime"], dResult["deviceUpdates"], dResult["calendarRows"], dResult["errors"], "" if dResult["finished"] else "  (not finished)"))
+
+# statJData payloads of each month of the last iDays days, as sent by the website
+def statJDataPayloads(iDays):
+    import plugin
+    state = fakeSuez.FakeSuezState(SUEZ_USER, SUEZ_PASSWORD, SUEZ_COUNTERS[:1])
+    dateLast = date.today() - timedelta(days=1)
+    return [json.dumps(state.monthRows(SUEZ_COUNTERS[0], iYear, iMonth)).encode() for iYear, iMonth, dateFirst, dateMonthLast in plugin.buildMonthPlan(dateLast - timedelta(days=iDays - 1), dateLast)]
+
+# Parsing of previous versions: strptime to datetime, then strftime back to a date string for each row
+def parseLegacy(lPayloads):
+    import plugin
+    lDays = []
+    for payload in lPayloads:
+        dJson = json.loads(payload.decode())
+        dJson.reverse()
+        for row in dJson:
+            for i, value in enumerate(row):
+                if i == 0:
+                    curDay = plugin.suezDateToDatetime(value)
+                if i == 1:
+                    curIndexDay = float(value) * 1000.0
+                if i == 2:
+                    curTotalIndexDay = float(value) * 1000.0
+            lDays.append((plugin.datetimeToSQLDateString(curDay), curIndexDay, curTotalIndexDay))
+    return lDays
+
+# Parsing of parseStatJData(), date strings are built from ordinals as exploreDataDays() does
+def parseFast(lPayloads):
+    import plugin
+    lDays = []
+    for payload in lPayloads:
+        aOrdinals, aUsages, aTotals = plugin.parseStatJData(json.loads(payload.decode()))
+        for iRow in range(len(aOrdinals) - 1, -1, -1):
+            lDays.append((plugin.ordinalToSQLDateString(aOrdinals[iRow]), aUsages[iRow], aTotals[iRow]))
+    return lDays
+
+def benchmarkParse(iDays, iRepeat):
+    import plugin
+    lPayloads = statJDataPayloads(iDays)
+    iRows = sum(len(json.loads(payload.decode())) for payload in lPayloads)
+    if parseLegacy(lPayloads) != parseFast(lPayloads):
+        print("Parsers don't give the same days")
+    lResults = []
+    for sName, parse, bColdCache in (("legacy", parseLegacy, False), ("fast (cold cache)", parseFast, True), ("fast (warm cache)", parseFast, False)):
+        fBest = None
+        for iRun in range(iRepeat):
+            if bColdCache:
+                plugin.suezDateToOrdinal.cache_clear()
+                plugin.ordinalToSQLDateString.cache_clear()
+            fStart = time.perf_counter()
+            parse(lPayloads)
+            fTime = time.perf_counter() - fStart
+            if (fBest is None) or (fTime < fBest):
+                fBest = fTime
+        lResults.append((sName, fBest))
+    print("%-18s %5s %6s %10s %12s" % ("parser", "days", "rows", "best (ms)", "per row (us)"))
+    for sName, fBest in lResults:
+        print("%-18s %5d %6d %10.3f %12.3f" % (sName, iDays, iRows, fBest * 1000.0, fBest * 1000000.0 / iRows))
+
+# Handle the responses of every month as the plugin does, at a debug level: dump, parsing, then device writes
+def handleResponses(plugin, lPayloads, iLevel):
+    p = plugin._plugin
+    p.logger = plugin.Logger(iLevel)
+    counter = plugin.CounterState(SUEZ_COUNTERS[0], 1)
+    counter.dateGrabFrom = date.today()
+    p.lCounters = [counter]
+    p.dateGrabTo = date.today() - timedelta(days=1)
+    dateLast = p.dateGrabTo
+    for iSeq, (iYear, iMonth, dateFirst, dateMonthLast) in enumerate(plugin.buildMonthPlan(dateLast - timedelta(days=len(lPayloads) * 31), dateLast)[-len(lPayloads):]):
+        Data = {"Status": "200", "Headers": {"Content-Type": "application/json", "Set-Cookie": ["eZSESSID=0123456789abcdef; path=/"]}, "Data": lPayloads[iSeq]}
+        p.logger.dump("Data response", Data)
+        p.exploreDataDays(Data, plugin.MonthJob(iSeq, counter, iYear, iMonth, dateFirst, dateMonthLast, iSeq == len(lPayloads) - 1))
+    p.drainWriteQueue(None, None)
+
+def benchmarkLogging(iDays, iRepeat):
+    plugin = loadPlugin()
+    plugin.Devices = fakeDomoticz.Devices
+    plugin.Parameters = {}
+    lPayloads = statJDataPayloads(iDays)
+    lResults = []
+    for sName, iLevel in (("debug off", 0), ("debug", plugin.LOG_DEBUG), ("debug + dumps", plugin.LOG_DUMP)):
+        fBest = None
+        for iRun in range(iRepeat):
+            fakeDomoticz.Devices.clear()
+            fakeDomoticz.resetStats()
+            fStart = time.perf_counter()
+            handleResponses(plugin, lPayloads, iLevel)
+            fTime = time.perf_counter() - fStart
+            if (fBest is None) or (fTime < fBest):
+                fBest = fTime
+        lResults.append((sName, fBest, fakeDomoticz.dStats["logs"], fakeDomoticz.dStats["deviceUpdates"]))
+    print("%-14s %5s %10s %11s %10s %8s" % ("logging", "days", "best (ms)", "per day (us)", "log lines", "updates"))
+    for sName, fBest, iLogs, iUpdates in lResults:
+        print("%-14s %5d %10.3f %11.3f %10d %8d" % (sName, iDays, fBest * 1000.0, fBest * 1000000.0 / iDays, iLogs, iUpdates))
+
+def printResults(lResults):
+    print("%-9s %5s %9s %9s %7s %12s %12s %8s %7s %10s %9s" % ("scenario", "days", "wall (s)", "requests", "logins", "bytes sent", "bytes recv", "updates", "errors", "delays (s)", "throttled"))
+    for dResult in lResults:
+        print("%-9s %5d %9.3f %9d %7d %12d %12d %8d %7d %10d %9d%s" % (dResult["scenario"], dResult["days"], dResult["wallTime"], dResult["requests"], dResult["logins"], dResult["bytesSent"], dResult["bytesReceived"], dResult["deviceUpdates"], dResult["errors"], dResult["delays"], dResult["throttled"], "" if dResult["finished"] else "  (not finished)"))
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the Suez plugin")
+    parser.add_argument("--days", type=int, nargs="+", default=[30, 365, 1000], help="days of history to grab")
+    parser.add_argument("--parallel", type=int, default=2, help="simultaneous requests for history")
+    parser.add_argument("--counters", type=int, default=1, choices=range(1, len(SUEZ_COUNTERS) + 1), help="counters of the account")
+    parser.add_argument("--options", default="", help="advanced options of the plugin, \"rate=600;burst=20\" to lift the rate limit")
+    parser.add_argument("--site-limit", type=int, default=0, help="data requests per second accepted by the stand-in before it answers 429 (0 for no limit)")
+    parser.add_argument("--verbose", action="store_true", help="show plugin log")
+    parser.add_argument("--parse", action="store_true", help="benchmark statJData parsing only")
+    parser.add_argument("--logging", action="store_true", help="benchmark responses handling with debug off and on")
+    parser.add_argument("--bulk", action="store_true", help="benchmark the first import with and without bulk import in the Domoticz database")
+    parser.add_argument("--domoticz-db", help="Domoticz database copied for each bulk benchmark run, instead of an emulated one")
+    parser.add_argument("--repeat", type=int, default=20, help="runs of parsing and logging benchmarks, best one is kept")
+    args = parser.parse_args()
+
+    fakeDomoticz.bPrint = args.verbose
+    if args.parse:
+        for iDays in args.days:
+            benchmarkParse(iDays, args.repeat)
+        return
+    if args.logging:
+        for iDays in args.days:
+            benchmarkLogging(iDays, args.repeat)
+        return
+    lCounters = SUEZ_COUNTERS[:args.counters]
+    server = fakeSuez.startServer(fakeSuez.FakeSuezState(SUEZ_USER, SUEZ_PASSWORD, lCounters))
+    server.state.iMaxRequestsPerSecond = args.site_limit
+    import plugin
+    fakeDomoticz.dAddressOverrides[plugin.LOGIN_BASE_URI] = ("127.0.0.1", server.server_port, False)
+    fakeDomoticz.dAddressOverrides[plugin.API_BASE_URI] = ("127.0.0.1", server.server_port, False)
+    try:
+        if args.bulk:
+            lResults = []
+            for iDays in args.days:
+                lResults.extend(benchmarkBulk(server, iDays, args.parallel, lCounters, args.options, args.domoticz_db))
+            printBulkResults(lResults)
+            return
+        lResults = []
+        for iDays in args.days:
+            lResults.extend(benchmarkBackfill(server, iDays, args.parallel, lCounters, args.options))
+        printResults(lResults)
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -7,15 +7,285 @@
 #   About the weather service:
 #   https://www.buienradar.nl/overbuienradar/gratis-weerdata
 #
-#   Very simple module to make local testing easier
-#   It "emulates" Domoticz.Log() and Domoticz.Debug()
+#   Module to make local testing easier
+#   It "emulates" Domoticz.Log() and Domoticz.Debug(), and also the connections,
+#   devices and heartbeats of the Domoticz plugin framework, so that plugin.py can
+#   run outside of Domoticz (see Emulator below and benchmark.py)
 #
 
+import http.client
+import sqlite3
+import ssl
+import time
+from collections import deque
+
+# bool: print log lines (benchmarks disable it)
+bPrint = True
+# int: debugging level set by the plugin
+iDebugging = 0
+# int: heartbeat set by the plugin, in seconds
+iHeartbeat = 10
+# dict: devices of the plugin, by unit
+Devices = {}
+# dict: (host, port, tls) to use instead of the address given to a connection, by address
+dAddressOverrides = {}
+# deque: events waiting to be sent to the plugin, as (callback name, arguments)
+lEvents = deque()
+# dict: statistics of the emulated Domoticz
+dStats = {}
+# string: path of the emulated Domoticz database, devices and their daily history are written in it when set
+# (see createDatabase(), a copy of a real Domoticz database can be used as well)
+sDatabase = None
+# object: connection to the emulated Domoticz database
+database = None
+# int: hardware ID of the plugin, set by the emulator
+iHardwareID = 0
+# int: schema version written by createDatabase()
+DATABASE_VERSION = 165
+
+# Create the tables of the Domoticz database used for devices and their daily history
+def createDatabase(sPath, iVersion=DATABASE_VERSION):
+    connection = sqlite3.connect(sPath)
+    with connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS Preferences ([Key] VARCHAR(50) NOT NULL, [nValue] INTEGER DEFAULT 0, [sValue] VARCHAR(200))")
+        connection.execute("CREATE TABLE IF NOT EXISTS DeviceStatus ([ID] INTEGER PRIMARY KEY, [HardwareID] INTEGER NOT NULL, [DeviceID] VARCHAR(25) NOT NULL, [Unit] INTEGER DEFAULT 0, [Name] VARCHAR(100) DEFAULT Unknown, [Used] INTEGER DEFAULT 0, [Type] INTEGER NOT NULL, [SubType] INTEGER NOT NULL, [SwitchType] INTEGER DEFAULT 0, [nValue] INTEGER DEFAULT 0, [sValue] VARCHAR(200) DEFAULT '', [LastUpdate] DATETIME DEFAULT (datetime('now','localtime')))")
+        connection.execute("CREATE TABLE IF NOT EXISTS Meter ([DeviceRowID] BIGINT NOT NULL, [Value] BIGINT NOT NULL, [Usage] INTEGER DEFAULT 0, [Date] DATETIME DEFAULT (datetime('now','localtime')))")
+        connection.execute("CREATE TABLE IF NOT EXISTS Meter_Calendar ([DeviceRowID] BIGINT NOT NULL, [Value] BIGINT NOT NULL, [Counter] BIGINT DEFAULT 0, [Date] DATETIME DEFAULT (datetime('now','localtime')))")
+        connection.execute("CREATE INDEX IF NOT EXISTS m_calendar_idx ON Meter_Calendar(DeviceRowID, Date)")
+        connection.execute("DELETE FROM Preferences WHERE Key = 'DB_Version'")
+        connection.execute("INSERT INTO Preferences (Key, nValue) VALUES ('DB_Version', ?)", (iVersion,))
+    connection.close()
+
+def openDatabase(sPath):
+    global sDatabase, database
+    closeDatabase()
+    sDatabase = sPath
+    if sPath:
+        database = sqlite3.connect(sPath, timeout=30)
+
+def closeDatabase():
+    global sDatabase, database
+    if database:
+        database.close()
+    sDatabase = None
+    database = None
+
+def resetStats():
+    dStats.clear()
+    dStats.update({
+        "connections": 0,
+        "requests": 0,
+        "bytesSent": 0,
+        "bytesReceived": 0,
+        "deviceUpdates": 0,
+        "logs": 0,
+        "errors": 0,
+        "delays": 0,
+    })
+
+resetStats()
+
 def Log(s):
-    print(s)
+    dStats["logs"] = dStats["logs"] + 1
+    if bPrint:
+        print(s)
 
 def Debug(s):
-    print(s)
+    if bPrint and iDebugging:
+        print(s)
 
 def Error(s):
-    print(s)
+    dStats["errors"] = dStats["errors"] + 1
+    if bPrint:
+        print(s)
+
+def Debugging(level):
+    global iDebugging
+    iDebugging = level
+
+def Heartbeat(seconds):
+    global iHeartbeat
+    iHeartbeat = seconds
+
+# Emulated Domoticz connection, HTTP and HTTPS protocols only
+# Messages are sent synchronously, answers are queued as events for the plugin
+class Connection:
+    def __init__(self, Name, Transport, Protocol, Address, Port="", Baud=-1):
+        self.Name = Name
+        self.Transport = Transport
+        self.Protocol = Protocol
+        self.Address = Address
+        self.Port = Port
+        self.httpConn = None
+        self.bConnected = False
+
+    def __str__(self):
+        return "Connection " + self.Name + " to " + self.Address + ":" + str(self.Port)
+
+    def Connect(self):
+        dStats["connections"] = dStats["connections"] + 1
+        sHost, iPort, bTls = dAddressOverrides.get(self.Address, (self.Address, int(self.Port), self.Protocol == "HTTPS"))
+        if bTls:
+            context = ssl.create_default_context()
+            # Local stand-in of the website uses a self-signed certificate
+            if self.Address in dAddressOverrides:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            self.httpConn = http.client.HTTPSConnection(sHost, iPort, timeout=30, context=context)
+        else:
+            self.httpConn = http.client.HTTPConnection(sHost, iPort, timeout=30)
+        try:
+            self.httpConn.connect()
+        except OSError as err:
+            self.bConnected = False
+            lEvents.append(("onConnect", (self, 1, str(err))))
+            return
+        self.bConnected = True
+        lEvents.append(("onConnect", (self, 0, "Connected")))
+
+    def Connected(self):
+        return self.bConnected
+
+    def Disconnect(self):
+        if self.bConnected:
+            self.bConnected = False
+            self.httpConn.close()
+            lEvents.append(("onDisconnect", (self,)))
+
+    def Send(self, Message, Delay=0):
+        if not self.bConnected:
+            Error("Send on closed connection " + str(self))
+            return
+        # Domoticz sends delayed messages later, the emulator waits for them
+        if Delay:
+            dStats["delays"] = dStats["delays"] + Delay
+            time.sleep(Delay)
+        dHeaders = Message.get("Headers", {})
+        body = Message.get("Data")
+        if isinstance(body, str):
+            body = body.encode()
+        try:
+            self.httpConn.putrequest(Message.get("Verb", "GET"), Message.get("URL", "/"), skip_host=("Host" in dHeaders), skip_accept_encoding=True)
+            for sKey, sValue in dHeaders.items():
+                self.httpConn.putheader(sKey, sValue)
+            if body is not None:
+                self.httpConn.putheader("Content-Length", str(len(body)))
+            self.httpConn.endheaders(body)
+            response = self.httpConn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            # Website closed the connection
+            self.bConnected = False
+            self.httpConn.close()
+            lEvents.append(("onDisconnect", (self,)))
+            return
+        dStats["requests"] = dStats["requests"] + 1
+        dStats["bytesSent"] = dStats["bytesSent"] + len(body or b"") + sum(len(sKey) + len(sValue) + 4 for sKey, sValue in dHeaders.items())
+        dStats["bytesReceived"] = dStats["bytesReceived"] + len(data) + sum(len(sKey) + len(sValue) + 4 for sKey, sValue in response.getheaders())
+        dResponseHeaders = {}
+        for sKey, sValue in response.getheaders():
+            if sKey.lower() != "set-cookie":
+                dResponseHeaders[sKey] = sValue
+        lCookies = response.msg.get_all("Set-Cookie")
+        if lCookies:
+            dResponseHeaders["Set-Cookie"] = lCookies
+        lEvents.append(("onMessage", (self, {"Status": str(response.status), "Headers": dResponseHeaders, "Data": data})))
+        if response.will_close:
+            self.bConnected = False
+            self.httpConn.close()
+            lEvents.append(("onDisconnect", (self,)))
+
+# Emulated Domoticz device
+class Device:
+    def __init__(self, Name="", Unit=0, TypeName="", Type=0, Subtype=0, Switchtype=0, Image=0, Options=None, Used=0, DeviceID="", Description=""):
+        self.Name = Name
+        self.Unit = Unit
+        self.TypeName = TypeName
+        self.Type = Type
+        self.SubType = Subtype
+        self.SwitchType = Switchtype
+        self.Image = Image
+        self.Options = Options or {}
+        self.Used = Used
+        self.DeviceID = DeviceID
+        self.Description = Description
+        self.ID = 0
+        self.nValue = 0
+        self.sValue = ""
+        self.LastLevel = 0
+        # list: (nValue, sValue) of each update
+        self.lUpdates = []
+
+    def __str__(self):
+        return "Device " + str(self.Unit) + " " + self.Name
+
+    def Create(self):
+        self.ID = len(Devices) + 1
+        if database:
+            with database:
+                self.ID = database.execute("INSERT INTO DeviceStatus (HardwareID, DeviceID, Unit, Name, Used, Type, SubType, SwitchType) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (iHardwareID, self.DeviceID, self.Unit, self.Name, self.Used, self.Type, self.SubType, self.SwitchType)).lastrowid
+        Devices[self.Unit] = self
+
+    def Update(self, nValue, sValue, **kwargs):
+        dStats["deviceUpdates"] = dStats["deviceUpdates"] + 1
+        self.nValue = nValue
+        self.sValue = sValue
+        self.lUpdates.append((nValue, sValue))
+        if database:
+            self.writeDatabase(nValue, sValue)
+
+    # Write the update as Domoticz does for a managed counter, each update in its own transaction:
+    # "counter;usage;date" is a day of history, "counter;usage" is the dashboard value
+    def writeDatabase(self, nValue, sValue):
+        lValues = sValue.split(";")
+        with database:
+            if (len(lValues) == 3) and (len(lValues[2]) == 10):
+                row = database.execute("SELECT ROWID FROM Meter_Calendar WHERE DeviceRowID = ? AND Date = ?", (self.ID, lValues[2])).fetchone()
+                if row:
+                    database.execute("UPDATE Meter_Calendar SET Value = ?, Counter = ? WHERE ROWID = ?", (lValues[1], lValues[0], row[0]))
+                else:
+                    database.execute("INSERT INTO Meter_Calendar (DeviceRowID, Value, Counter, Date) VALUES (?, ?, ?, ?)", (self.ID, lValues[1], lValues[0], lValues[2]))
+            else:
+                database.execute("UPDATE DeviceStatus SET nValue = ?, sValue = ?, LastUpdate = datetime('now', 'localtime') WHERE ID = ?", (nValue, sValue, self.ID))
+
+    def Delete(self):
+        Devices.pop(self.Unit, None)
+
+# Run a plugin module the way Domoticz does: Parameters and Devices are set in the module,
+# then callbacks are called for each event, and onHeartbeat when there is no event
+# Heartbeats are not real time, they are sent as soon as the plugin has nothing else to do
+class Emulator:
+    def __init__(self, module, dParameters):
+        self.module = module
+        self.dParameters = dParameters
+        self.iHeartbeats = 0
+
+    # Start the plugin, devices created by a previous start are kept as Domoticz does
+    def start(self):
+        global iHardwareID
+        lEvents.clear()
+        iHardwareID = self.dParameters.get("HardwareID", 0)
+        self.module.Parameters = self.dParameters
+        self.module.Devices = Devices
+        self.module.onStart()
+
+    def stop(self):
+        self.module.onStop()
+        self.processEvents()
+
+    # Send waiting events to the plugin
+    def processEvents(self):
+        while lEvents:
+            sCallback, args = lEvents.popleft()
+            getattr(self.module, sCallback)(*args)
+
+    # Run until bDone() returns true, or until iMaxHeartbeats heartbeats, returns bDone() result
+    def run(self, bDone, iMaxHeartbeats=10000):
+        for iHeartbeat in range(iMaxHeartbeats):
+            self.processEvents()
+            if bDone():
+                return True
+            self.iHeartbeats = self.iHeartbeats + 1
+            self.module.onHeartbeat()
+        self.processEvents()
+        return bDone()
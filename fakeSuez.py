@@ -0,0 +1,307 @@
+#           Suez Plugin (toutsurmoneau)
+#
+#           Local stand-in of the toutsurmoneau website, for offline tests and benchmarks
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# It replays what the website sends to the plugin: login page with its CSRF token,
+# session cookies, statJData JSON for daily history, and "429 Too Many Requests"
+# when data requests come too fast (see iMaxRequestsPerSecond). Responses are compressed
+# when the request accepts it, and data responses can be revalidated with their ETag. Consumption is generated
+# from the counter ID, so that two runs give the same data.
+#
+#   python fakeSuez.py --port 8080 [--certfile cert.pem --keyfile key.pem]
+#
+import argparse
+import gzip
+import hashlib
+import json
+import secrets
+import ssl
+import threading
+import time
+import zlib
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+API_ENDPOINT_LOGIN = '/mon-compte-en-ligne/je-me-connecte'
+API_ENDPOINT_DATA = '/mon-compte-en-ligne/statJData'
+API_ENDPOINT_MONTHS = '/mon-compte-en-ligne/statMData'
+
+# Month labels of monthly history
+MONTH_LABELS = ("janv.", "févr.", "mars", "avr.", "mai", "juin", "juil.", "août", "sept.", "oct.", "nov.", "déc.")
+
+# Login page as sent by the website, trimmed to what the plugin looks for
+LOGIN_PAGE = """<!DOCTYPE html>
+<html lang="fr">
+<head><meta charset="utf-8"><title>Je me connecte - Tout sur mon eau</title></head>
+<body>
+<form action="/mon-compte-en-ligne/je-me-connecte" method="post" id="login-form">
+<input type="text" id="username" name="tsme_user_login[_username]" value="">
+<input type="password" id="password" name="tsme_user_login[_password]">
+<input type="hidden" name="_csrf_token" value="{token}">
+<button type="submit">Je me connecte</button>
+</form>
+</body>
+</html>
+"""
+
+# First day of history known by the stand-in
+HISTORY_START = date(2015, 1, 1)
+
+# Consumption of a day in liters, generated from the counter ID
+def dayUsage(sCounter, dateDay):
+    iSeed = sum(ord(c) for c in sCounter)
+    iUsage = 80 + ((dateDay.toordinal() * 7919 + iSeed * 104729) % 240)
+    # Some days without consumption (holidays)
+    if (dateDay.toordinal() + iSeed) % 97 == 0:
+        return 0
+    return iUsage
+
+# Shared state of the stand-in: accounts, sessions and statistics
+class FakeSuezState:
+    def __init__(self, sUser="user@example.com", sPassword="password", lCounters=None):
+        self.sUser = sUser
+        self.sPassword = sPassword
+        # dict: password of each account, by user
+        self.dAccounts = {sUser: sPassword}
+        self.lCounters = lCounters or ["123456789"]
+        self.lock = threading.Lock()
+        # set: valid CSRF tokens
+        self.sTokens = set()
+        # set: valid eZSESSID cookies
+        self.sSessions = set()
+        # dict: cumulated index in liters at the end of each day, by counter
+        self.dTotals = {}
+        # bool: answer "Connection: close" to every request
+        self.bCloseConnections = False
+        # integer: data requests accepted each second, more are answered "429 Too Many Requests" (0 for no limit)
+        self.iMaxRequestsPerSecond = 0
+        # integer: next data requests answered "429 Too Many Requests", whatever their rate
+        self.iThrottleNext = 0
+        # list: [second, data requests received during this second]
+        self.lCurrentSecond = [0, 0]
+        self.resetStats()
+
+    # Add an account, counters are shared by every account
+    def addAccount(self, sUser, sPassword):
+        with self.lock:
+            self.dAccounts[sUser] = sPassword
+
+    def resetStats(self):
+        with self.lock:
+            self.dStats = {"requests": 0, "logins": 0, "dataRequests": 0, "bytesSent": 0, "throttled": 0, "notModified": 0}
+
+    def count(self, sKey, iValue=1):
+        with self.lock:
+            self.dStats[sKey] = self.dStats[sKey] + iValue
+
+    # True if a data request received now shall be answered "429 Too Many Requests"
+    def isThrottled(self):
+        with self.lock:
+            if self.iThrottleNext:
+                self.iThrottleNext = self.iThrottleNext - 1
+                self.dStats["throttled"] = self.dStats["throttled"] + 1
+                return True
+            iSecond = int(time.monotonic())
+            if self.lCurrentSecond[0] != iSecond:
+                self.lCurrentSecond = [iSecond, 0]
+            self.lCurrentSecond[1] = self.lCurrentSecond[1] + 1
+            if self.iMaxRequestsPerSecond and (self.lCurrentSecond[1] > self.iMaxRequestsPerSecond):
+                self.dStats["throttled"] = self.dStats["throttled"] + 1
+                return True
+            return False
+
+    # Forget every session, next data requests will be redirected to login page
+    def expireSessions(self):
+        with self.lock:
+            self.sSessions.clear()
+
+    # Cumulated index in liters at the end of each day until yesterday, by day
+    def totals(self, sCounter):
+        with self.lock:
+            if sCounter not in self.dTotals:
+                dTotals = {}
+                iTotal = 100000
+                dateDay = HISTORY_START
+                dateEnd = date.today()
+                while dateDay < dateEnd:
+                    iTotal = iTotal + dayUsage(sCounter, dateDay)
+                    dTotals[dateDay] = iTotal
+                    dateDay = dateDay + timedelta(days=1)
+                self.dTotals[sCounter] = dTotals
+            return self.dTotals[sCounter]
+
+    # Daily rows of a month, as the website sends them: [day, usage in m3, index in m3], until yesterday
+    def monthRows(self, sCounter, iYear, iMonth):
+        dTotals = self.totals(sCounter)
+        lRows = []
+        dateDay = date(iYear, iMonth, 1)
+        while (dateDay.month == iMonth) and (dateDay in dTotals):
+            lRows.append([dateDay.strftime("%d/%m/%Y"), dayUsage(sCounter, dateDay) / 1000.0, dTotals[dateDay] / 1000.0])
+            dateDay = dateDay + timedelta(days=1)
+        return lRows
+
+    # Monthly rows of the whole history, as the website sends them: [label, usage in m3, index in m3, "YYYYMM"]
+    def monthlyRows(self, sCounter):
+        dTotals = self.totals(sCounter)
+        dMonths = {}
+        for dateDay, iTotal in dTotals.items():
+            iUsage, iLastTotal = dMonths.get((dateDay.year, dateDay.month), (0, 0))
+            dMonths[(dateDay.year, dateDay.month)] = (iUsage + dayUsage(sCounter, dateDay), max(iLastTotal, iTotal))
+        return [[MONTH_LABELS[iMonth - 1] + " " + str(iYear), iUsage / 1000.0, iTotal / 1000.0, "%04d%02d" % (iYear, iMonth)] for (iYear, iMonth), (iUsage, iTotal) in sorted(dMonths.items())]
+
+class FakeSuezHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def getCookies(self):
+        dCookies = {}
+        for sCookie in self.headers.get("Cookie", "").split(";"):
+            sKey, _, sValue = sCookie.strip().partition("=")
+            if sKey:
+                dCookies[sKey] = sValue
+        return dCookies
+
+    # Send a response, compressed when the request accepts it, data responses (bRevalidate) have an ETag and are answered "304 Not Modified" when it matches
+    def answer(self, iStatus, body, sContentType="text/html; charset=UTF-8", lCookies=(), dHeaders=None, bRevalidate=False):
+        state = self.server.state
+        dHeaders = dict(dHeaders or {})
+        if bRevalidate:
+            sETag = '"' + hashlib.md5(body).hexdigest() + '"'
+            dHeaders["ETag"] = sETag
+            if self.headers.get("If-None-Match") == sETag:
+                iStatus = 304
+                body = b""
+                state.count("notModified")
+        sAcceptEncoding = self.headers.get("Accept-Encoding", "")
+        if body and ("gzip" in sAcceptEncoding):
+            body = gzip.compress(body)
+            dHeaders["Content-Encoding"] = "gzip"
+        elif body and ("deflate" in sAcceptEncoding):
+            body = zlib.compress(body)
+            dHeaders["Content-Encoding"] = "deflate"
+        self.send_response(iStatus)
+        self.send_header("Content-Type", sContentType)
+        self.send_header("Content-Length", str(len(body)))
+        for sCookie in lCookies:
+            self.send_header("Set-Cookie", sCookie)
+        for sKey, sValue in dHeaders.items():
+            self.send_header(sKey, sValue)
+        if state.bCloseConnections:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+        state.count("bytesSent", len(body))
+
+    def sendLoginPage(self):
+        state = self.server.state
+        sToken = secrets.token_hex(16)
+        with state.lock:
+            state.sTokens.add(sToken)
+        self.answer(200, LOGIN_PAGE.format(token=sToken).encode(), lCookies=["PHPSESSID=" + secrets.token_hex(8) + "; path=/; HttpOnly"])
+
+    def do_GET(self):
+        state = self.server.state
+        state.count("requests")
+        sPath = self.path.split("?")[0]
+        if sPath == API_ENDPOINT_LOGIN:
+            self.sendLoginPage()
+        elif sPath.startswith(API_ENDPOINT_DATA + "/"):
+            state.count("dataRequests")
+            if state.isThrottled():
+                self.answer(429, b"Too Many Requests", sContentType="text/plain", dHeaders={"Retry-After": "1"})
+                return
+            if self.getCookies().get("eZSESSID") not in state.sSessions:
+                self.answer(302, b"", dHeaders={"Location": API_ENDPOINT_LOGIN})
+                return
+            try:
+                sYear, sMonth, sCounter = sPath[len(API_ENDPOINT_DATA) + 1:].split("/")
+                lRows = state.monthRows(sCounter, int(sYear), int(sMonth)) if sCounter in state.lCounters else []
+            except ValueError:
+                self.answer(404, b"Not found")
+                return
+            self.answer(200, json.dumps(lRows).encode(), sContentType="application/json", bRevalidate=True)
+        elif sPath.startswith(API_ENDPOINT_MONTHS + "/"):
+            state.count("dataRequests")
+            if self.getCookies().get("eZSESSID") not in state.sSessions:
+                self.answer(302, b"", dHeaders={"Location": API_ENDPOINT_LOGIN})
+                return
+            sCounter = sPath[len(API_ENDPOINT_MONTHS) + 1:]
+            if sCounter not in state.lCounters:
+                self.answer(404, b"Not found")
+                return
+            self.answer(200, json.dumps(state.monthlyRows(sCounter)).encode(), sContentType="application/json", bRevalidate=True)
+        else:
+            self.answer(404, b"Not found")
+
+    def do_POST(self):
+        state = self.server.state
+        state.count("requests")
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.split("?")[0] != API_ENDPOINT_LOGIN:
+            self.answer(404, b"Not found")
+            return
+        dForm = parse_qs(body.decode(), keep_blank_values=True)
+        sToken = dForm.get("_csrf_token", [""])[0]
+        sUser = dForm.get("tsme_user_login[_username]", [""])[0]
+        sPassword = dForm.get("tsme_user_login[_password]", [""])[0]
+        with state.lock:
+            bTokenOk = sToken in state.sTokens
+            state.sTokens.discard(sToken)
+        if bTokenOk and (sUser in state.dAccounts) and (sPassword == state.dAccounts[sUser]):
+            state.count("logins")
+            sSession = secrets.token_hex(16)
+            with state.lock:
+                state.sSessions.add(sSession)
+            self.answer(302, b"", lCookies=["eZSESSID=" + sSession + "; path=/; HttpOnly"], dHeaders={"Location": "/mon-compte-en-ligne/tableau-de-bord"})
+        else:
+            self.sendLoginPage()
+
+# Start the stand-in in a thread, port 0 gives a free port, returns the server (server.server_port is the port)
+def startServer(state=None, sHost="127.0.0.1", iPort=0, sCertFile=None, sKeyFile=None):
+    server = ThreadingHTTPServer((sHost, iPort), FakeSuezHandler)
+    server.daemon_threads = True
+    server.state = state or FakeSuezState()
+    if sCertFile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(sCertFile, sKeyFile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in of toutsurmoneau website")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--certfile", help="certificate for HTTPS, plain HTTP if not set")
+    parser.add_argument("--keyfile")
+    parser.add_argument("--user", default="user@example.com")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--counter", action="append", help="counter ID, can be repeated")
+    args = parser.parse_args()
+    server = startServer(FakeSuezState(args.user, args.password, args.counter), args.host, args.port, args.certfile, args.keyfile)
+    print("Listening on " + args.host + ":" + str(server.server_port) + " since " + datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
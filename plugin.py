@@ -21,8 +21,16 @@
     <params>
         <param field="Username" label="Username" width="200px" required="true" default=""/>
         <param field="Password" label="Password" width="200px" required="true" default="" password="true"/>
-        <param field="Mode6" label="Counter ID" width="200px" required="true" default="" />
+        <param field="Mode6" label="Counter ID (several IDs separated by commas)" width="200px" required="true" default="" />
         <param field="Mode1" label="Number of days to grab for daily view (30 min, 1000 max)" width="50px" required="false" default="365"/>
+        <param field="Mode2" label="Simultaneous requests for history (1 min, 4 max)" width="50px" required="false" default="2"/>
+        <param field="Mode5" label="Advanced options (key=value separated by semicolons)" width="300px" required="false" default=""/>
+        <param field="Mode4" label="Timings device" width="75px">
+            <options>
+                <option label="False" value="0"  default="true" />
+                <option label="True" value="1"/>
+            </options>
+        </param>
         <param field="Mode3" label="Debug" width="75px">
             <options>
                 <option label="False" value="0"  default="true" />
@@ -41,13 +49,29 @@ except ImportError:
     import fakeDomoticz as Domoticz
 from base64 import b64encode
 import json
+import sys
 from urllib.parse import quote
 import re
 from datetime import datetime
+from datetime import date
 from datetime import timedelta
 import time
+import math
+import random
 import html
 from pprint import pprint
+import calendar
+import sqlite3
+import zlib
+import os
+import queue
+import threading
+import urllib.parse
+import urllib.request
+from collections import deque
+from array import array
+from functools import lru_cache
+from email.utils import parsedate_to_datetime
 
 LOGIN_BASE_URI = 'www.toutsurmoneau.fr'
 API_BASE_URI = 'www.toutsurmoneau.fr'
@@ -55,6 +79,7 @@ BASE_PORT = '443'
 
 API_ENDPOINT_LOGIN = '/mon-compte-en-ligne/je-me-connecte'
 API_ENDPOINT_DATA = '/mon-compte-en-ligne/statJData'
+API_ENDPOINT_MONTHS = '/mon-compte-en-ligne/statMData'
 
 HEADERS = {
     "Accept" : "application/json, text/javascript, */*; q=0.01",
@@ -64,14 +89,1137 @@ HEADERS = {
     "Connection": "keep-alive",
 }
 
+# Windows of rolling means of daily consumption (days), the longest one is the size of the ring buffer of each counter
+ANALYTICS_SHORT_DAYS = 7
+ANALYTICS_LONG_DAYS = 30
+# Days of the exponential moving average used as baseline of consumption
+ANALYTICS_BASELINE_DAYS = 90
+# Days of local history used once to start statistics of a counter that has none
+ANALYTICS_SEED_DAYS = 365
+# Consumption devices use 4 units for each counter from this unit: 7 days mean, 30 days mean, deviation from baseline, leak alert
+ANALYTICS_FIRST_UNIT = 100
+ANALYTICS_UNITS_PER_COUNTER = 4
+# Days without dropping to the leak floor after which a leak is suspected (option "leakdays"), and leak floor in liters per day (option "leakliters")
+# Leak detection is off until the leak floor is set: with daily data, most homes never drop to zero
+DEFAULT_LEAK_DAYS = 30
+MAX_LEAK_DAYS = 365
+MAX_LEAK_LITERS = 1000
+# Alert levels of leak device: leak detection off, no leak suspected, and possible leak
+ALERT_LEVEL_OFF = 0
+ALERT_LEVEL_OK = 1
+ALERT_LEVEL_LEAK = 3
+
+# Export of parsed days (option "export"): measurement of InfluxDB line protocol, files in the plugin folder when no target is given ("exportto"), and spool files
+EXPORT_MEASUREMENT = "water"
+EXPORT_FILES = {"influx": "suez_export.lp", "csv": "suez_export.csv"}
+EXPORT_SPOOL_FILES = {"influx": "suez_export_spool.lp", "csv": "suez_export_spool.csv"}
+EXPORT_CSV_HEADER = "counter,day,usage,total"
+# Days sent at once, and longest wait of a day before being sent (seconds) (options "exportbatch" and "exportdelay")
+DEFAULT_EXPORT_BATCH_ROWS = 500
+MAX_EXPORT_BATCH_ROWS = 10000
+DEFAULT_EXPORT_DELAY_SECONDS = 60
+MAX_EXPORT_DELAY_SECONDS = 3600
+# Timeout of HTTP export requests, and time given to the export thread to finish when the plugin stops (seconds)
+# A request must time out before the plugin stops waiting for it
+EXPORT_HTTP_TIMEOUT = 4
+EXPORT_STOP_TIMEOUT = 5
+
+# Encodings asked to the website in compressed mode (option "compress")
+ACCEPT_ENCODING = "gzip, deflate"
+# Number of data responses kept to revalidate them with their ETag or Last-Modified header
+HTTP_CACHE_MAX_ENTRIES = 64
+
+# Debug levels: debug messages, and dumps of requests and responses too
+LOG_DEBUG = 1
+LOG_DUMP = 2
+# Debug mask of the Domoticz framework for Advanced debug: Python messages (Domoticz.Debug) only, other categories such as
+# connections data dumps would write the login form and session cookie without redaction
+DOMOTICZ_DEBUG_PYTHON = 2
+# Longest dump written in the log (characters), and number of dumps written each minute
+LOG_DUMP_MAX_CHARS = 2000
+LOG_DUMPS_PER_MINUTE = 20
+# Secrets replaced by "***" in debug log: passwords, CSRF token and session cookies, as form field, dict item or cookie, and token of login page
+SECRET_PATTERNS = (
+    re.compile("((?:password|token|sessid)[^=:\\s'\"]{0,8}['\"]?\\s*[=:]\\s*['\"]?)[^&;,\\s'\"]+", re.I),
+    re.compile("(_csrf_token\\\\?\"\\s+value=\\\\?\")[^\"\\\\]*", re.I),
+)
+
+# Patterns searched in responses, compiled once: token in raw bytes of login page
+TOKEN_PATTERN = re.compile(b'"_csrf_token" value="([^"]*)"', re.I)
+# Monthly history keys: "201902" or "2019-02", "02/2019", "févr. 2019"
+MONTH_KEY_PATTERN = re.compile("(\\d{4})-?(\\d{2})")
+MONTH_SLASH_PATTERN = re.compile("(\\d{1,2})/(\\d{4})")
+MONTH_LABEL_PATTERN = re.compile("(\\w+)\\.?\\s+(\\d{4})")
+
+# Name of the local history database, stored in the plugin home folder
+HISTORY_DB_NAME = "suez_history.db"
+
+# Schema versions of the Domoticz database (DB_Version preference) known by the bulk import (option "bulkimport"),
+# and the columns it needs: days of a managed counter are rows of Meter_Calendar (Value is the usage, Counter the total)
+DOMOTICZ_DB_MIN_VERSION = 150
+DOMOTICZ_DB_MAX_VERSION = 170
+DOMOTICZ_DB_COLUMNS = {"DeviceStatus": ("ID", "HardwareID", "Unit", "Type", "SubType"), "Meter_Calendar": ("DeviceRowID", "Value", "Counter", "Date")}
+# Time to wait while Domoticz is writing in its database (seconds)
+DOMOTICZ_DB_TIMEOUT = 30
+
+# Number of times a data request is sent again when website closes connection before answering
+MAX_DATA_RECONNECTIONS = 3
+
+# Maximum number of days written in the device at each heartbeat, and maximum time spent doing it (milliseconds)
+WRITE_QUEUE_ROWS_PER_TICK = 50
+WRITE_QUEUE_MS_PER_TICK = 250
+
+# Heartbeat (seconds) while days are waiting to be written, and otherwise
+HEARTBEAT_WRITING = 2
+HEARTBEAT_IDLE = 20
+
+# Timed steps, in the order they are shown in the summary of each run
+TIMED_STEPS = ("connecting", "tokenconnected", "logconnected", "dataconnecting", "getdatadays", "parse", "write")
+# Number of durations kept for each step to compute percentiles across runs
+TIMINGS_MAX_SAMPLES = 500
+# Unit of the text device showing timings
+TIMINGS_DEVICE_UNIT = 250
+
+# Time of day (minutes) of the daily connection until the publication time of the website has been learned
+SCHEDULE_DEFAULT_MINUTE = 8 * 60
+# Number of observed publication times kept to target the daily connection
+SCHEDULE_MAX_SAMPLES = 14
+# When yesterday is already there at the daily connection, it is tried this many minutes earlier next time (minutes)
+SCHEDULE_PROBE_MINUTES = 30
+# Earliest daily connection (minutes)
+SCHEDULE_EARLIEST_MINUTE = 5 * 60
+# Random delay added to each connection to lower load on toutsurmoneau website (minutes)
+SCHEDULE_JITTER_MINUTES = 20
+# Delay between follow-up connections while yesterday is not published, and hour after which we wait for the next day
+SCHEDULE_FOLLOWUP_MINUTES = 60
+SCHEDULE_LAST_FOLLOWUP_HOUR = 22
+# First delay after a failure, doubled after each consecutive failure up to the maximum (minutes)
+SCHEDULE_RETRY_MINUTES = 15
+SCHEDULE_MAX_RETRY_MINUTES = 6 * 60
+
+# Years of monthly history imported before the daily history (option "years", 0 to disable)
+MAX_MONTHLY_YEARS = 20
+# Number of failed runs after which monthly history import is abandoned
+MAX_MONTHLY_IMPORT_FAILURES = 3
+
+# Requests to the website per minute, and requests that can be sent at once before being delayed (options "rate" and "burst")
+DEFAULT_REQUESTS_PER_MINUTE = 60
+MAX_REQUESTS_PER_MINUTE = 600
+DEFAULT_REQUESTS_BURST = 5
+MAX_REQUESTS_BURST = 20
+# Pause of every request when the website throttles them, doubled at each new throttling up to the maximum (seconds)
+THROTTLE_PAUSE_SECONDS = 30
+THROTTLE_MAX_PAUSE_SECONDS = 600
+# Number of times a month is throttled before the run is abandoned
+MAX_THROTTLED_ATTEMPTS = 3
+
+# A run without any event from the website for this long is abandoned, longer than the longest pause of throttled requests (minutes)
+RUN_STALL_MINUTES = 20
+
+# Delay after a run before grabbing again months with missing days, and minimum time left before next connection to do it (minutes)
+GAP_REPAIR_DELAY_MINUTES = 30
+GAP_REPAIR_MARGIN_MINUTES = 60
+# Number of times a month with missing days is grabbed again before giving up
+MAX_GAP_REPAIR_ATTEMPTS = 3
+
+# Number of history months grabbed at the same time (default, and max to stay polite with the website)
+DEFAULT_PARALLEL_REQUESTS = 2
+MAX_PARALLEL_REQUESTS = 4
+
+# Water counter of the account, with its own device and progress
+class CounterState:
+    # string: counter ID
+    sCounter = None
+    # integer: unit of the counter device
+    iIndexUnit = None
+    # date: first day to grab during next run
+    dateGrabFrom = None
+    # dict: (usage, total) last written in the device, by day
+    dWrittenDays = None
+    # dict: (usage, total) last exported, by day
+    dExportedDays = None
+    # integer: number of months to grab during this run
+    iMonthsPlanned = None
+    # integer: number of months parsed during this run
+    iMonthsParsed = None
+    # date: most recent day published by the website
+    dateLastDay = None
+    # object: rolling statistics of daily consumption
+    stats = None
+
+    def __init__(self, sCounter, iIndexUnit):
+        self.sCounter = sCounter
+        self.iIndexUnit = iIndexUnit
+        self.dateLastDay = None
+        self.stats = ConsumptionStats()
+        self.dWrittenDays = {}
+        self.dExportedDays = {}
+        self.iMonthsPlanned = 0
+        self.iMonthsParsed = 0
+
+# Export of parsed days to a time-series sink: InfluxDB line protocol or CSV, appended to a file or posted to an HTTP endpoint
+# Days are sent in batches by a background thread, so that a slow sink never blocks the plugin; a batch that can't be sent
+# is appended to a spool file on disk, and the spool is sent again with the next batch
+class Exporter:
+    # string: "influx" or "csv"
+    sFormat = None
+    # string: file path or http(s) URL
+    sTarget = None
+    # string: path of the spool file
+    sSpoolPath = None
+    # string: authorization token of the HTTP endpoint, None if not needed
+    sToken = None
+    # integers: days sent at once, and longest wait of a day before being sent (seconds)
+    iBatchRows = None
+    iBatchSeconds = None
+    # list: lines waiting to be sent
+    lLines = None
+    # float: time (seconds, monotonic) of the oldest line waiting
+    fFirstLine = None
+    # object: queue of batches given to the export thread, None marks the end
+    batches = None
+    # object: export thread
+    thread = None
+    # object: lock of the spool file
+    spoolLock = None
+    # object: set when the plugin stops, batches are then spooled instead of sent
+    stopping = None
+    # deque: results of the export thread, read by the plugin: (lines sent, lines spooled, error or None)
+    lResults = None
+
+    def __init__(self, sFormat, sTarget, sSpoolPath, sToken, iBatchRows, iBatchSeconds):
+        self.sFormat = sFormat
+        self.sTarget = sTarget
+        self.sSpoolPath = sSpoolPath
+        self.sToken = sToken
+        self.iBatchRows = iBatchRows
+        self.iBatchSeconds = iBatchSeconds
+        self.lLines = []
+        self.fFirstLine = None
+        self.batches = queue.Queue()
+        self.spoolLock = threading.Lock()
+        self.stopping = threading.Event()
+        self.lResults = deque()
+        self.thread = threading.Thread(target=self.run, name="SuezExport", daemon=True)
+        self.thread.start()
+
+    # Add (day, usage, total) rows of a counter, oldest first, a batch is sent when it is full
+    def add(self, sCounter, lDays):
+        if not lDays:
+            return
+        if not self.lLines:
+            self.fFirstLine = time.monotonic()
+        for sDay, fUsage, fTotal in lDays:
+            self.lLines.append(exportLine(self.sFormat, sCounter, sDay, fUsage, fTotal))
+        if len(self.lLines) >= self.iBatchRows:
+            self.flush()
+
+    # Send the batch if its oldest day has waited long enough
+    def tick(self):
+        if self.lLines and (time.monotonic() - self.fFirstLine >= self.iBatchSeconds):
+            self.flush()
+
+    def flush(self):
+        if self.lLines:
+            self.batches.put(self.lLines)
+            self.lLines = []
+            self.fFirstLine = None
+
+    # Send what is waiting and stop the thread; batches it couldn't take in time are kept in the spool
+    # The thread still sending when time is over ends as soon as its request times out
+    def stop(self):
+        self.flush()
+        self.batches.put(None)
+        self.thread.join(EXPORT_STOP_TIMEOUT)
+        self.stopping.set()
+        # Only batches before the end marker are taken, the marker is left for the thread
+        while True:
+            try:
+                lLines = self.batches.get_nowait()
+            except queue.Empty:
+                break
+            if lLines is None:
+                self.batches.put(None)
+                break
+            with self.spoolLock:
+                self.spool(lLines)
+
+    # Export thread: send each batch after the spool, or add it to the spool
+    # Spool is read and trimmed under the lock, but sent without it, so that stop() never waits for the sink
+    def run(self):
+        while True:
+            lLines = self.batches.get()
+            if lLines is None:
+                return
+            if self.stopping.is_set():
+                with self.spoolLock:
+                    self.spool(lLines)
+                continue
+            with self.spoolLock:
+                lSpooled = self.readSpool()
+            try:
+                self.send(lSpooled + lLines)
+            except (OSError, ValueError) as err:
+                with self.spoolLock:
+                    self.spool(lLines)
+                self.lResults.append((0, len(lSpooled) + len(lLines), str(err)))
+            else:
+                if lSpooled:
+                    with self.spoolLock:
+                        self.trimSpool(len(lSpooled))
+                self.lResults.append((len(lSpooled) + len(lLines), 0, None))
+
+    def readSpool(self):
+        try:
+            with open(self.sSpoolPath, "r", encoding="utf-8") as spoolFile:
+                return [sLine for sLine in spoolFile.read().split("\n") if sLine]
+        except FileNotFoundError:
+            return []
+
+    # Remove the first lines of the spool once they have been sent, lines spooled meanwhile are kept
+    def trimSpool(self, iLines):
+        lLeft = self.readSpool()[iLines:]
+        try:
+            if lLeft:
+                with open(self.sSpoolPath, "w", encoding="utf-8") as spoolFile:
+                    spoolFile.write("\n".join(lLeft) + "\n")
+            else:
+                os.remove(self.sSpoolPath)
+        except OSError as err:
+            self.lResults.append((0, 0, "cannot trim spool, " + str(iLines) + " days may be sent again: " + str(err)))
+
+    def spool(self, lLines):
+        try:
+            with open(self.sSpoolPath, "a", encoding="utf-8") as spoolFile:
+                spoolFile.write("\n".join(lLines) + "\n")
+        except OSError as err:
+            self.lResults.append((0, 0, "cannot write spool, " + str(len(lLines)) + " days lost: " + str(err)))
+
+    # Append lines to the file, or post them to the HTTP endpoint
+    def send(self, lLines):
+        sPayload = "\n".join(lLines) + "\n"
+        if self.sTarget.startswith(("http://", "https://")):
+            dHeaders = {"Content-Type": "text/csv; charset=utf-8" if self.sFormat == "csv" else "text/plain; charset=utf-8"}
+            if self.sToken:
+                dHeaders["Authorization"] = "Token " + self.sToken
+            request = urllib.request.Request(self.sTarget, data=sPayload.encode("utf-8"), headers=dHeaders, method="POST")
+            with urllib.request.urlopen(request, timeout=EXPORT_HTTP_TIMEOUT) as response:
+                response.read()
+        else:
+            bNewFile = not os.path.exists(self.sTarget)
+            with open(self.sTarget, "a", encoding="utf-8") as exportFile:
+                if bNewFile and (self.sFormat == "csv"):
+                    exportFile.write(EXPORT_CSV_HEADER + "\n")
+                exportFile.write(sPayload)
+
+# Rolling statistics of the daily consumption of a counter, updated in constant time for each new day
+# Last days are kept in a ring buffer with the running sums of both windows, baseline is an exponential moving average
+class ConsumptionStats:
+    # array: consumption of the last days received (liters), ring buffer of ANALYTICS_LONG_DAYS days
+    aDays = None
+    # integer: position of the next day in the ring buffer
+    iNext = None
+    # integer: days in the ring buffer
+    iCount = None
+    # floats: consumption of the last ANALYTICS_SHORT_DAYS and ANALYTICS_LONG_DAYS days
+    fSumShort = None
+    fSumLong = None
+    # float: baseline of daily consumption (liters), None until the first day
+    fBaseline = None
+    # integer: ordinal of the most recent day received, older days are ignored
+    iLastOrdinal = None
+    # float: leak floor the flow days are counted with (liters), None when leak detection is off
+    fLeakFloor = None
+    # integer: consecutive days whose consumption stayed above the leak floor
+    iFlowDays = None
+    # integer: alert level last published
+    iAlertLevel = None
+    # boolean: statistics have changed since they were published
+    bChanged = None
+
+    def __init__(self, state=None):
+        state = state or {}
+        lDays = state.get("days", [])[-ANALYTICS_LONG_DAYS:]
+        self.aDays = array("d", [0.0] * ANALYTICS_LONG_DAYS)
+        for iDay, fUsage in enumerate(lDays):
+            self.aDays[iDay] = fUsage
+        self.iCount = len(lDays)
+        self.iNext = self.iCount % ANALYTICS_LONG_DAYS
+        self.fSumLong = sum(lDays)
+        self.fSumShort = sum(lDays[-ANALYTICS_SHORT_DAYS:])
+        self.fBaseline = state.get("baseline")
+        self.iLastOrdinal = state.get("lastOrdinal")
+        self.fLeakFloor = state.get("leakFloor")
+        self.iFlowDays = state.get("flowDays", 0)
+        self.iAlertLevel = state.get("alertLevel", 0)
+        self.bChanged = False
+
+    # Add the consumption of a day more recent than the last one, returns false if it is ignored
+    def addDay(self, iOrdinal, fUsage):
+        if (self.iLastOrdinal is not None) and (iOrdinal <= self.iLastOrdinal):
+            return False
+        # Days leaving the windows
+        if self.iCount >= ANALYTICS_SHORT_DAYS:
+            self.fSumShort = self.fSumShort - self.aDays[(self.iNext - ANALYTICS_SHORT_DAYS) % ANALYTICS_LONG_DAYS]
+        if self.iCount >= ANALYTICS_LONG_DAYS:
+            self.fSumLong = self.fSumLong - self.aDays[self.iNext]
+        self.aDays[self.iNext] = fUsage
+        self.iNext = (self.iNext + 1) % ANALYTICS_LONG_DAYS
+        self.iCount = min(self.iCount + 1, ANALYTICS_LONG_DAYS)
+        self.fSumShort = self.fSumShort + fUsage
+        self.fSumLong = self.fSumLong + fUsage
+        if self.fBaseline is None:
+            self.fBaseline = fUsage
+        else:
+            self.fBaseline = self.fBaseline + (fUsage - self.fBaseline) * 2.0 / (ANALYTICS_BASELINE_DAYS + 1)
+        # A continuous flow never lets consumption drop to the floor
+        if (self.fLeakFloor is not None) and (fUsage > self.fLeakFloor):
+            self.iFlowDays = self.iFlowDays + 1
+        else:
+            self.iFlowDays = 0
+        self.iLastOrdinal = iOrdinal
+        self.bChanged = True
+        return True
+
+    # Count flow days again from the days kept when the leak floor has changed, None turns leak detection off
+    def setLeakFloor(self, fLeakFloor):
+        if fLeakFloor == self.fLeakFloor:
+            return
+        self.fLeakFloor = fLeakFloor
+        self.iFlowDays = 0
+        if fLeakFloor is not None:
+            for fUsage in reversed(self.lastDays(ANALYTICS_LONG_DAYS)):
+                if fUsage <= fLeakFloor:
+                    break
+                self.iFlowDays = self.iFlowDays + 1
+        self.bChanged = True
+
+    # Consumption of the last iDays days, most recent last
+    def lastDays(self, iDays):
+        iDays = min(iDays, self.iCount)
+        return [self.aDays[(self.iNext - iDays + iDay) % ANALYTICS_LONG_DAYS] for iDay in range(iDays)]
+
+    # Mean of the last ANALYTICS_SHORT_DAYS days (liters per day), None without days
+    def meanShort(self):
+        iDays = min(self.iCount, ANALYTICS_SHORT_DAYS)
+        return (self.fSumShort / iDays) if iDays else None
+
+    # Mean of the last ANALYTICS_LONG_DAYS days (liters per day), None without days
+    def meanLong(self):
+        return (self.fSumLong / self.iCount) if self.iCount else None
+
+    # Deviation of the short mean from the baseline (percent), None without baseline
+    def deviation(self):
+        if not self.fBaseline:
+            return None
+        return (self.meanShort() - self.fBaseline) * 100.0 / self.fBaseline
+
+    def toState(self):
+        return {"days": self.lastDays(ANALYTICS_LONG_DAYS), "baseline": self.fBaseline, "lastOrdinal": self.iLastOrdinal, "leakFloor": self.fLeakFloor, "flowDays": self.iFlowDays, "alertLevel": self.iAlertLevel}
+
+# Month of history to grab
+class MonthJob:
+    # integer: sequence number, months are parsed in this order
+    iSeq = None
+    # object: counter
+    counter = None
+    # string: year
+    sYear = None
+    # string: month
+    sMonth = None
+    # date: first day to grab
+    dateFirst = None
+    # date: last day to grab
+    dateLast = None
+    # boolean: true for the most recent month, which gives the value shown on dashboard
+    bMostRecent = None
+    # string: "days" for daily history of the month, "months" for monthly history from dateFirst to dateLast
+    sKind = None
+    # integer: number of times the website throttled the request of this month
+    iThrottled = None
+
+    def __init__(self, iSeq, counter, iYear, iMonth, dateFirst, dateLast, bMostRecent, sKind="days"):
+        self.iSeq = iSeq
+        self.sKind = sKind
+        self.counter = counter
+        self.sYear = str(iYear)
+        self.sMonth = str(iMonth)
+        self.dateFirst = dateFirst
+        self.dateLast = dateLast
+        self.bMostRecent = bMostRecent
+        self.iThrottled = 0
+
+# Connection grabbing history months one after the other, several workers run at the same time
+class DataWorker:
+    # object: http connection
+    httpConn = None
+    # object: month being grabbed
+    job = None
+    # string: step of the worker ("dataconnecting", "getdatadays" or "idle")
+    sStep = None
+    # integer: number of reconnections for the current month
+    iReconnections = None
+    # float: start time of the current step
+    fStepStart = None
+    # string: URL of the last request
+    sURL = None
+
+    def __init__(self):
+        self.httpConn = None
+        self.job = None
+        self.sURL = None
+        self.sStep = "idle"
+        self.iReconnections = 0
+        self.fStepStart = None
+
+# Debug log of the plugin: messages are formatted only when their level is enabled, and secrets are never written
+# Dumps of requests and responses are truncated, and only a few are written each minute
+class Logger:
+    # integer: debug level, 0 for none, LOG_DEBUG for debug messages, LOG_DUMP for dumps too
+    iLevel = None
+    # deque: times (seconds, monotonic) of the dumps written during the last minute
+    lDumpTimes = None
+    # integer: dumps skipped since last written one
+    iDumpsSkipped = None
+
+    def __init__(self, iLevel=0):
+        self.iLevel = iLevel
+        self.lDumpTimes = deque()
+        self.iDumpsSkipped = 0
+
+    # Debug message, formatted with its arguments only when debug is enabled: logger.debug("Wrote %d values", iRows)
+    def debug(self, sFormat, *args):
+        if self.iLevel >= LOG_DEBUG:
+            Domoticz.Log(redactSecrets((sFormat % args) if args else sFormat))
+
+    # Dump of a request or a response (dict, bytes, string...)
+    def dump(self, sTitle, value):
+        if self.iLevel < LOG_DUMP:
+            return
+        fNow = time.monotonic()
+        while self.lDumpTimes and (fNow - self.lDumpTimes[0] > 60.0):
+            self.lDumpTimes.popleft()
+        if len(self.lDumpTimes) >= LOG_DUMPS_PER_MINUTE:
+            self.iDumpsSkipped = self.iDumpsSkipped + 1
+            return
+        self.lDumpTimes.append(fNow)
+        if self.iDumpsSkipped:
+            Domoticz.Log(str(self.iDumpsSkipped) + " dumps skipped, at most " + str(LOG_DUMPS_PER_MINUTE) + " are written each minute")
+            self.iDumpsSkipped = 0
+        sDump = redactSecrets(dumpToString(value))
+        if len(sDump) > LOG_DUMP_MAX_CHARS:
+            sDump = sDump[:LOG_DUMP_MAX_CHARS] + "... (" + str(len(sDump) - LOG_DUMP_MAX_CHARS) + " more characters)"
+        Domoticz.Log(sTitle + ": " + sDump)
+
+# Durations of each step in milliseconds, for this run and for the last runs to get percentiles
+class Timings:
+    # dict: durations of the last runs, by step
+    dSamples = None
+    # dict: durations of this run, by step
+    dRunSamples = None
+
+    def __init__(self, dSamples=None):
+        self.dSamples = {}
+        for sStep, lSamples in (dSamples or {}).items():
+            self.dSamples[sStep] = deque(lSamples, maxlen=TIMINGS_MAX_SAMPLES)
+        self.dRunSamples = {}
+
+    # Add duration of a step started at fStart (time.perf_counter())
+    def add(self, sStep, fStart):
+        fDuration = (time.perf_counter() - fStart) * 1000.0
+        if sStep not in self.dSamples:
+            self.dSamples[sStep] = deque(maxlen=TIMINGS_MAX_SAMPLES)
+        self.dSamples[sStep].append(fDuration)
+        self.dRunSamples.setdefault(sStep, []).append(fDuration)
+
+    def resetRun(self):
+        self.dRunSamples = {}
+
+    # Summary of timed steps of this run, with percentiles of the last runs: "step: count x total ms (p50/p90 ms)"
+    def summary(self):
+        lSteps = []
+        for sStep in TIMED_STEPS:
+            if sStep in self.dRunSamples:
+                lRun = self.dRunSamples[sStep]
+                lSteps.append(sStep + ": " + str(len(lRun)) + "x " + str(round(sum(lRun))) + " ms (p50 " + str(round(percentile(self.dSamples[sStep], 50), 1)) + " / p90 " + str(round(percentile(self.dSamples[sStep], 90), 1)) + ")")
+        return ", ".join(lSteps)
+
+    # Samples to save between runs
+    def toState(self):
+        return {sStep: [round(fDuration, 3) for fDuration in lSamples] for sStep, lSamples in self.dSamples.items()}
+
+# Choose the time of next connection: daily connection when yesterday is usually published (learned from previous days),
+# follow-ups until yesterday is published, and exponential backoff with jitter after failures
+# Each choice comes with the reason, to be logged
+class Scheduler:
+    # deque: minutes of the day when yesterday was published on the last days
+    lPublishMinutes = None
+    # integer: number of consecutive failed runs
+    iFailures = None
+    # date: day that was not published yet at the last connection, None if it was
+    dateMissing = None
+    # datetime: last connection that didn't get dateMissing
+    dateMissingAt = None
+    # string: kind of the next connection ("start", "daily", "followup" or "retry")
+    sNextKind = None
+
+    def __init__(self, dState=None):
+        dState = dState or {}
+        self.lPublishMinutes = deque(dState.get("publish", []), maxlen=SCHEDULE_MAX_SAMPLES)
+        self.iFailures = dState.get("failures", 0)
+        self.dateMissing = None
+        self.dateMissingAt = None
+        try:
+            if dState.get("missing"):
+                self.dateMissing = datetime.strptime(dState["missing"], "%Y-%m-%d").date()
+                self.dateMissingAt = datetime.fromtimestamp(dState["missingAt"])
+        except (KeyError, TypeError, ValueError):
+            self.dateMissing = None
+            self.dateMissingAt = None
+        self.sNextKind = "start"
+
+    # State to save between runs
+    def toState(self):
+        dState = {"publish": list(self.lPublishMinutes), "failures": self.iFailures}
+        if self.dateMissing:
+            dState["missing"] = datetimeToSQLDateString(self.dateMissing)
+            dState["missingAt"] = self.dateMissingAt.timestamp()
+        return dState
+
+    # Minute of the day of the daily connection: median of publication times, or default if nothing learned yet
+    def targetMinute(self):
+        if not self.lPublishMinutes:
+            return SCHEDULE_DEFAULT_MINUTE
+        return max(int(percentile(self.lPublishMinutes, 50)), SCHEDULE_EARLIEST_MINUTE)
+
+    # Daily connection of the given day, with jitter
+    def dailyConnection(self, dateDay):
+        return datetime.combine(dateDay, datetime.min.time()) + timedelta(minutes=self.targetMinute() + random.uniform(0, SCHEDULE_JITTER_MINUTES))
+
+    # Next connection after a successful run, bGotYesterday is true if yesterday was published for every counter
+    def afterSuccess(self, now, dateYesterday, bGotYesterday):
+        sKind = self.sNextKind
+        self.iFailures = 0
+        if bGotYesterday:
+            sReason = "yesterday is published"
+            if (self.dateMissing == dateYesterday) and self.dateMissingAt:
+                # Published between the last connection without it and now, middle is kept
+                iMinute = minuteOfDay(self.dateMissingAt + (now - self.dateMissingAt) / 2)
+                self.lPublishMinutes.append(iMinute)
+                sReason = sReason + ", it appeared between " + self.dateMissingAt.strftime("%H:%M") + " and " + now.strftime("%H:%M") + ", learned " + minuteToString(iMinute)
+            elif sKind == "daily":
+                # It may be published earlier than we think, try a little earlier
+                iMinute = max(minuteOfDay(now) - SCHEDULE_PROBE_MINUTES, SCHEDULE_EARLIEST_MINUTE)
+                self.lPublishMinutes.append(iMinute)
+                sReason = sReason + " at daily connection, trying earlier (" + minuteToString(iMinute) + ") in next targets"
+            self.dateMissing = None
+            self.dateMissingAt = None
+            self.sNextKind = "daily"
+            return self.dailyConnection(now.date() + timedelta(days=1)), sReason + ", daily connection around " + minuteToString(self.targetMinute())
+        self.dateMissing = dateYesterday
+        self.dateMissingAt = now
+        dateToday = self.dailyConnection(now.date())
+        if now < dateToday:
+            self.sNextKind = "daily"
+            return dateToday, "yesterday is not published yet, usually published around " + minuteToString(self.targetMinute())
+        if now.hour < SCHEDULE_LAST_FOLLOWUP_HOUR:
+            self.sNextKind = "followup"
+            return now + timedelta(minutes=SCHEDULE_FOLLOWUP_MINUTES + random.uniform(0, SCHEDULE_JITTER_MINUTES)), "yesterday is not published yet, follow-up connection"
+        self.sNextKind = "daily"
+        return self.dailyConnection(now.date() + timedelta(days=1)), "yesterday is not published yet, too late for a follow-up, daily connection around " + minuteToString(self.targetMinute())
+
+    # Next connection after a failed run, delay is doubled after each failure, with jitter (half of the delay is random)
+    def afterFailure(self, now):
+        self.iFailures = self.iFailures + 1
+        fDelay = min(SCHEDULE_RETRY_MINUTES * (2 ** min(self.iFailures - 1, 16)), SCHEDULE_MAX_RETRY_MINUTES)
+        fDelay = fDelay / 2 + random.uniform(0, fDelay / 2)
+        self.sNextKind = "retry"
+        return now + timedelta(minutes=fDelay), "failure " + str(self.iFailures) + " in a row, retry in " + str(round(fDelay)) + " minutes"
+
+# Cookies received from the website, with their domain, path and expiry as RFC 6265 describes them
+# Cookie header is cached for each host and path, and built again only when the jar changes or a cookie expires
+class CookieJar:
+    # dict: [value, expiry timestamp or None for session cookies], by (domain, path, name)
+    dCookies = None
+    # dict: (Cookie header, timestamp when one of its cookies expires or None), by (host, path)
+    dHeaders = None
+
+    def __init__(self):
+        self.dCookies = {}
+        self.dHeaders = {}
+
+    def clear(self):
+        self.dCookies = {}
+        self.dHeaders = {}
+
+    def set(self, sDomain, sPath, sName, sValue, fExpiry):
+        self.dCookies[(sDomain, sPath, sName)] = [sValue, fExpiry]
+        self.dHeaders = {}
+
+    # Remove every cookie with this name, whatever its domain and path
+    def remove(self, sName):
+        lKeys = [key for key in self.dCookies if key[2] == sName]
+        for key in lKeys:
+            del self.dCookies[key]
+        if lKeys:
+            self.dHeaders = {}
+
+    # Remove expired cookies
+    def purge(self):
+        fNow = time.time()
+        lKeys = [key for key, lCookie in self.dCookies.items() if (lCookie[1] is not None) and (lCookie[1] <= fNow)]
+        for key in lKeys:
+            del self.dCookies[key]
+        if lKeys:
+            self.dHeaders = {}
+
+    # Save cookies of Set-Cookie headers of a response to a request of sPath on sHost
+    def addFromResponse(self, Data, sHost, sPath):
+        if not (Data and ("Headers" in Data) and ("Set-Cookie" in Data["Headers"])):
+            return
+        cookiesLines = Data["Headers"]["Set-Cookie"]
+        # on old version of Domoticz, cookies is a multiline string
+        if isinstance(cookiesLines, str):
+            cookiesLines = cookiesLines.splitlines()
+        for sCookiesLine in cookiesLines:
+            lParts = sCookiesLine.split(";")
+            sName, sSep, sValue = lParts[0].partition("=")
+            sName = sName.strip()
+            if not (sSep and sName):
+                continue
+            sDomain = sHost.lower()
+            sCookiePath = defaultCookiePath(sPath)
+            bRejected = False
+            for sAttribute in lParts[1:]:
+                sKey, _, sAttributeValue = sAttribute.strip().partition("=")
+                sKey = sKey.lower()
+                if (sKey == "domain") and sAttributeValue:
+                    sDomain = sAttributeValue.strip().lstrip(".").lower()
+                    # A website cannot set cookies for another domain
+                    bRejected = not domainMatch(sHost.lower(), sDomain)
+                elif (sKey == "path") and sAttributeValue.startswith("/"):
+                    sCookiePath = sAttributeValue.strip()
+            if bRejected:
+                continue
+            fExpiry = cookieExpiry(sCookiesLine)
+            # Cookie deleted by the website
+            if (fExpiry is not None) and (fExpiry <= time.time()):
+                if self.dCookies.pop((sDomain, sCookiePath, sName), None) is not None:
+                    self.dHeaders = {}
+            else:
+                self.set(sDomain, sCookiePath, sName, sValue.strip(), fExpiry)
+
+    # [value, expiry] of a cookie sent to sPath on sHost, None if there is none or if it is empty
+    def find(self, sName, sHost, sPath):
+        self.purge()
+        for (sDomain, sCookiePath, sCookieName), lCookie in self.dCookies.items():
+            if (sCookieName == sName) and lCookie[0] and domainMatch(sHost, sDomain) and pathMatch(sPath, sCookiePath):
+                return lCookie
+        return None
+
+    # Cookie header of a request of sPath on sHost, empty if no cookie is sent
+    def header(self, sHost, sPath):
+        cached = self.dHeaders.get((sHost, sPath))
+        if cached and ((cached[1] is None) or (cached[1] > time.time())):
+            return cached[0]
+        self.purge()
+        lCookies = []
+        fExpiry = None
+        # Longest paths first, as browsers do
+        for (sDomain, sCookiePath, sName), lCookie in sorted(self.dCookies.items(), key=lambda item: -len(item[0][1])):
+            if domainMatch(sHost, sDomain) and pathMatch(sPath, sCookiePath):
+                lCookies.append(sName + "=" + lCookie[0])
+                if (lCookie[1] is not None) and ((fExpiry is None) or (lCookie[1] < fExpiry)):
+                    fExpiry = lCookie[1]
+        sHeader = "; ".join(lCookies)
+        self.dHeaders[(sHost, sPath)] = (sHeader, fExpiry)
+        return sHeader
+
+    # Cookies to save between runs, as [domain, path, name, value, expiry] lists
+    def toState(self):
+        return [[sDomain, sPath, sName, lCookie[0], lCookie[1]] for (sDomain, sPath, sName), lCookie in self.dCookies.items()]
+
+    # Load cookies saved by toState(), or by previous versions as {name: [value, expiry]}
+    def load(self, state):
+        self.clear()
+        if isinstance(state, dict):
+            state = [[LOGIN_BASE_URI, "/", sName, lCookie[0], lCookie[1]] for sName, lCookie in state.items()]
+        for sDomain, sPath, sName, sValue, fExpiry in state:
+            self.set(sDomain, sPath, sName, sValue, fExpiry)
+        self.purge()
+
+# Token bucket shared by every request to the website: a burst of requests can be sent at once, then requests are spaced by the rate
+# A request without token is not refused, it is delayed until its token comes
+class RateLimiter:
+    # float: tokens added per second
+    fRate = None
+    # integer: maximum number of tokens
+    iBurst = None
+    # float: tokens left, negative when requests are waiting for their token
+    fTokens = None
+    # float: time (seconds, monotonic) of last refill, in the future while requests are paused
+    fLast = None
+    # float: next pause after a throttling (seconds)
+    fPause = None
+    # integers: requests made, delayed by the limiter, and rejected by the website since last reset
+    iMade = None
+    iDelayed = None
+    iRejected = None
+
+    def __init__(self, fRate, iBurst):
+        self.fRate = fRate
+        self.iBurst = iBurst
+        self.fTokens = float(iBurst)
+        self.fLast = time.monotonic()
+        self.fPause = THROTTLE_PAUSE_SECONDS
+        self.resetStats()
+
+    def resetStats(self):
+        self.iMade = 0
+        self.iDelayed = 0
+        self.iRejected = 0
+
+    # Take a token for a request at fNow (seconds, monotonic), returns how long it shall wait before being sent (seconds)
+    def reserve(self, fNow):
+        if fNow > self.fLast:
+            self.fTokens = min(float(self.iBurst), self.fTokens + (fNow - self.fLast) * self.fRate)
+            self.fLast = fNow
+        self.fTokens = self.fTokens - 1.0
+        fDelay = (self.fLast - fNow) + max(0.0, -self.fTokens) / self.fRate
+        self.iMade = self.iMade + 1
+        if fDelay > 0.0:
+            self.iDelayed = self.iDelayed + 1
+        return fDelay
+
+    # Website rejected a request: no token is given during the pause asked by the website, or during a pause doubled at each new throttling
+    # Returns the pause (seconds)
+    def throttle(self, fNow, fRetryAfter=None):
+        self.iRejected = self.iRejected + 1
+        if fRetryAfter is None:
+            fPause = self.fPause
+            self.fPause = min(self.fPause * 2.0, THROTTLE_MAX_PAUSE_SECONDS)
+        else:
+            fPause = min(fRetryAfter, THROTTLE_MAX_PAUSE_SECONDS)
+        self.fTokens = min(self.fTokens, 0.0)
+        self.fLast = max(self.fLast, fNow + fPause)
+        return fPause
+
+    # Website answered normally, next throttling starts again with the shortest pause
+    def success(self):
+        self.fPause = THROTTLE_PAUSE_SECONDS
+
+# Requests to the website and their responses: headers prepared once for each endpoint, cookies, redirections and statistics
+# In compressed mode, responses are asked compressed, and data already received is revalidated instead of being downloaded again
+class HttpClient:
+    # object: cookies
+    jar = None
+    # boolean: compressed mode
+    bCompress = None
+    # dict: (ETag, Last-Modified, body) of the last data responses, by URL
+    dCache = None
+    # dict: (host, path of the endpoint, headers of every request), by endpoint ("login", "days" or "months")
+    dEndpoints = None
+    # string: location given by the last redirection, None if it had none
+    sLocation = None
+    # integer: number of responses received during this run
+    iResponses = None
+    # integer: bytes of responses bodies processed during this run, after decompression
+    iResponseBytes = None
+    # integer: bytes of responses bodies received during this run, as sent on the wire
+    iWireBytes = None
+    # integer: bytes of the largest response body of this run
+    iLargestResponse = None
+    # integer: responses of this run revalidated by the website ("304 Not Modified")
+    iRevalidated = None
+    # list: (URL, bytes on the wire, bytes after decompression, encoding or "304") of each response of this run
+    lTransfers = None
+
+    def __init__(self, bCompress=False):
+        self.jar = CookieJar()
+        self.bCompress = bCompress
+        dHeaders = dict(HEADERS, **{"Accept-Encoding": ACCEPT_ENCODING}) if bCompress else HEADERS
+        self.dEndpoints = {
+            "login": (LOGIN_BASE_URI, API_ENDPOINT_LOGIN, dict(dHeaders, Host=LOGIN_BASE_URI + ":" + BASE_PORT)),
+            "days": (API_BASE_URI, API_ENDPOINT_DATA + "/", dict(dHeaders, Host=API_BASE_URI + ":" + BASE_PORT)),
+            "months": (API_BASE_URI, API_ENDPOINT_MONTHS + "/", dict(dHeaders, Host=API_BASE_URI + ":" + BASE_PORT)),
+        }
+        self.dCache = {}
+        self.sLocation = None
+        self.resetStats()
+
+    def resetStats(self):
+        self.iResponses = 0
+        self.iResponseBytes = 0
+        self.iWireBytes = 0
+        self.iLargestResponse = 0
+        self.iRevalidated = 0
+        self.lTransfers = []
+
+    # Message to send to an endpoint, with the cookies of the jar matching the path of the URL
+    def request(self, sEndpoint, sVerb, sURL, data=None):
+        sHost, sPath, dTemplate = self.dEndpoints[sEndpoint]
+        headers = dict(dTemplate)
+        sCookie = self.jar.header(sHost, sURL.split("?")[0])
+        if sCookie:
+            headers["Cookie"] = sCookie
+        # Data already received is sent again by the website only if it has changed
+        if (sVerb == "GET") and (sURL in self.dCache):
+            sETag, sLastModified, body = self.dCache[sURL]
+            if sETag:
+                headers["If-None-Match"] = sETag
+            if sLastModified:
+                headers["If-Modified-Since"] = sLastModified
+        sendData = {"Verb": sVerb, "URL": sURL, "Headers": headers}
+        if data is not None:
+            sendData["Data"] = data
+        return sendData
+
+    # Handle a response of an endpoint: save its cookies, decompress it, count its bytes, and tell what it is:
+    # "redirect" (to the login page), "moved" (redirected elsewhere, see sLocation), "throttled" (too many requests or service unavailable), "page" (HTML page, usually login page), "data" (other successful response), "error" or None without response
+    # Data of a compressed or revalidated response is replaced by the body it stands for
+    def receive(self, Data, sEndpoint, sURL):
+        if not Data:
+            return None
+        sHost = self.dEndpoints[sEndpoint][0]
+        self.jar.addFromResponse(Data, sHost, sURL.split("?")[0])
+        body = Data.get("Data") or b""
+        iWireBytes = len(body)
+        sEncoding = (headerValue(Data, "Content-Encoding") or "").strip().lower()
+        if body and (sEncoding in ("gzip", "deflate")):
+            body = decompressBody(body, sEncoding)
+            Data["Data"] = body
+        sStatus = str(Data.get("Status"))
+        # Website tells that data hasn't changed since it was received, it is handled as if it was received again
+        if (sStatus == "304") and (sURL in self.dCache):
+            body = self.dCache[sURL][2]
+            Data["Data"] = body
+            sEncoding = "304"
+            self.iRevalidated = self.iRevalidated + 1
+        elif (sStatus == "200") and (sEndpoint != "login") and self.bCompress:
+            self.cacheResponse(Data, sURL, body)
+        if body or iWireBytes:
+            iBytes = len(body)
+            self.iResponses = self.iResponses + 1
+            self.iResponseBytes = self.iResponseBytes + iBytes
+            self.iWireBytes = self.iWireBytes + iWireBytes
+            if iBytes > self.iLargestResponse:
+                self.iLargestResponse = iBytes
+            self.lTransfers.append((sURL, iWireBytes, iBytes, sEncoding or "identity"))
+        if sEncoding == "304":
+            return "data"
+        if isRedirect(Data):
+            self.sLocation = headerValue(Data, "Location")
+            # Website redirects to its login page when the session has expired, redirections without location are handled the same way
+            if (not self.sLocation) or (urllib.parse.urlsplit(self.sLocation).path == API_ENDPOINT_LOGIN):
+                return "redirect"
+            return "moved"
+        if str(Data.get("Status")) in ("429", "503"):
+            return "throttled"
+        if body and (body.lstrip()[:1] == b"<"):
+            return "page"
+        if str(Data.get("Status")) == "200":
+            return "data"
+        return "error"
+
+    # Keep a data response with its validators, to ask next time only if it has changed
+    def cacheResponse(self, Data, sURL, body):
+        sETag = headerValue(Data, "ETag")
+        sLastModified = headerValue(Data, "Last-Modified")
+        self.dCache.pop(sURL, None)
+        if not (sETag or sLastModified):
+            return
+        if len(self.dCache) >= HTTP_CACHE_MAX_ENTRIES:
+            del self.dCache[next(iter(self.dCache))]
+        self.dCache[sURL] = (sETag, sLastModified, body)
+
+# Local history of the days already grabbed, so that a restart doesn't download everything again
+class HistoryStore:
+    # object: sqlite connection
+    dbConn = None
+
+    def __init__(self, sPath):
+        self.dbConn = sqlite3.connect(sPath)
+        self.dbConn.execute("CREATE TABLE IF NOT EXISTS days (counter TEXT NOT NULL, day TEXT NOT NULL, usage REAL NOT NULL, total REAL NOT NULL, PRIMARY KEY (counter, day))")
+        self.dbConn.execute("CREATE TABLE IF NOT EXISTS written_days (counter TEXT NOT NULL, day TEXT NOT NULL, usage REAL NOT NULL, total REAL NOT NULL, PRIMARY KEY (counter, day))")
+        self.dbConn.execute("CREATE TABLE IF NOT EXISTS exported_days (counter TEXT NOT NULL, day TEXT NOT NULL, usage REAL NOT NULL, total REAL NOT NULL, PRIMARY KEY (counter, day))")
+        self.dbConn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT NOT NULL PRIMARY KEY, value TEXT NOT NULL)")
+        self.dbConn.execute("CREATE TABLE IF NOT EXISTS final_months (counter TEXT NOT NULL, month TEXT NOT NULL, PRIMARY KEY (counter, month))")
+        self.dbConn.commit()
+
+    # Get a JSON value saved between runs, default if not found
+    def getState(self, sKey, default=None):
+        row = self.dbConn.execute("SELECT value FROM state WHERE key = ?", (sKey,)).fetchone()
+        if row is None:
+            return default
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            return default
+
+    # Save a JSON value between runs
+    def setState(self, sKey, value):
+        with self.dbConn:
+            self.dbConn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (sKey, json.dumps(value)))
+
+    # Remove a value saved between runs
+    def deleteState(self, sKey):
+        with self.dbConn:
+            self.dbConn.execute("DELETE FROM state WHERE key = ?", (sKey,))
+
+    # Save a list of (day, usage, total) rows for a counter, day being a Domoticz date string
+    def addDays(self, sCounter, lDays):
+        with self.dbConn:
+            self.dbConn.executemany("INSERT OR REPLACE INTO days (counter, day, usage, total) VALUES (?, ?, ?, ?)", [(sCounter, sDay, fUsage, fTotal) for sDay, fUsage, fTotal in lDays])
+
+    # Save a list of (day, usage, total) rows written in the Domoticz device
+    def addWrittenDays(self, sCounter, lDays):
+        with self.dbConn:
+            self.dbConn.executemany("INSERT OR REPLACE INTO written_days (counter, day, usage, total) VALUES (?, ?, ?, ?)", [(sCounter, sDay, fUsage, fTotal) for sDay, fUsage, fTotal in lDays])
+
+    # Get days written in the Domoticz device, as a dict of (usage, total) by day
+    def getWrittenDays(self, sCounter):
+        return {sDay: (fUsage, fTotal) for sDay, fUsage, fTotal in self.dbConn.execute("SELECT day, usage, total FROM written_days WHERE counter = ?", (sCounter,))}
+
+    # Get days grabbed but not written in the Domoticz device yet (plugin stopped before writing them), as (day, usage, total) rows
+    def getUnwrittenDays(self, sCounter):
+        return self.dbConn.execute("SELECT d.day, d.usage, d.total FROM days d LEFT JOIN written_days w ON w.counter = d.counter AND w.day = d.day WHERE d.counter = ? AND d.usage > 0 AND (w.day IS NULL OR w.usage != d.usage OR w.total != d.total) ORDER BY d.day", (sCounter,)).fetchall()
+
+    # Save a list of (day, usage, total) rows given to the export
+    def addExportedDays(self, sCounter, lDays):
+        with self.dbConn:
+            self.dbConn.executemany("INSERT OR REPLACE INTO exported_days (counter, day, usage, total) VALUES (?, ?, ?, ?)", [(sCounter, sDay, fUsage, fTotal) for sDay, fUsage, fTotal in lDays])
+
+    # Get days given to the export, as a dict of (usage, total) by day
+    def getExportedDays(self, sCounter):
+        return {sDay: (fUsage, fTotal) for sDay, fUsage, fTotal in self.dbConn.execute("SELECT day, usage, total FROM exported_days WHERE counter = ?", (sCounter,))}
+
+    # Get days saved but not exported yet, or changed since they were exported (export enabled on an existing install), as (day, usage, total) rows
+    def getUnexportedDays(self, sCounter):
+        return self.dbConn.execute("SELECT d.day, d.usage, d.total FROM days d LEFT JOIN exported_days e ON e.counter = d.counter AND e.day = d.day WHERE d.counter = ? AND d.total > 0 AND (e.day IS NULL OR e.usage != d.usage OR e.total != d.total) ORDER BY d.day", (sCounter,)).fetchall()
+
+    # Number of days saved for a counter in a given month
+    def countDaysInMonth(self, sCounter, iYear, iMonth):
+        sFirstDay = "%04d-%02d-01" % (iYear, iMonth)
+        sLastDay = "%04d-%02d-%02d" % (iYear, iMonth, calendar.monthrange(iYear, iMonth)[1])
+        cursor = self.dbConn.execute("SELECT COUNT(*) FROM days WHERE counter = ? AND day BETWEEN ? AND ?", (sCounter, sFirstDay, sLastDay))
+        return cursor.fetchone()[0]
+
+    # Most recent day saved for a counter, None if there is none
+    def getLastDay(self, sCounter):
+        row = self.dbConn.execute("SELECT MAX(day) FROM days WHERE counter = ?", (sCounter,)).fetchone()
+        if (row is None) or (row[0] is None):
+            return None
+        return datetime.strptime(row[0], "%Y-%m-%d").date()
+
+    # Days saved for a counter between two Domoticz date strings, as a dict of (usage, total) by day
+    def getDays(self, sCounter, sFirstDay, sLastDay):
+        return {sDay: (fUsage, fTotal) for sDay, fUsage, fTotal in self.dbConn.execute("SELECT day, usage, total FROM days WHERE counter = ? AND day BETWEEN ? AND ?", (sCounter, sFirstDay, sLastDay))}
+
+    # Oldest (day, usage, total) row saved for a counter, None if there is none
+    def getFirstDay(self, sCounter):
+        return self.dbConn.execute("SELECT day, usage, total FROM days WHERE counter = ? ORDER BY day LIMIT 1", (sCounter,)).fetchone()
+
+    # Save days of a month grabbed for a counter, mark the month as final if needed, and save the progress of the run, all in one transaction
+    # so that a restart never finds a progress ahead of the days saved
+    def addMonth(self, sCounter, lDays, iYear, iMonth, bFinal, checkpoint=None):
+        with self.dbConn:
+            self.dbConn.executemany("INSERT OR REPLACE INTO days (counter, day, usage, total) VALUES (?, ?, ?, ?)", [(sCounter, sDay, fUsage, fTotal) for sDay, fUsage, fTotal in lDays])
+            if bFinal:
+                self.dbConn.execute("INSERT OR IGNORE INTO final_months (counter, month) VALUES (?, ?)", (sCounter, "%04d-%02d" % (iYear, iMonth)))
+            if checkpoint is not None:
+                self.dbConn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", ("checkpoint", json.dumps(checkpoint)))
+
+    # Mark a month as final, it won't be grabbed again
+    def markMonthFinal(self, sCounter, iYear, iMonth):
+        with self.dbConn:
+            self.dbConn.execute("INSERT OR IGNORE INTO final_months (counter, month) VALUES (?, ?)", (sCounter, "%04d-%02d" % (iYear, iMonth)))
+
+    # A month is final when it is over and all its days have been received, it won't change anymore on the website
+    # Months saved before final months were marked are final when all their days are saved
+    def isMonthFinal(self, sCounter, iYear, iMonth):
+        if self.dbConn.execute("SELECT 1 FROM final_months WHERE counter = ? AND month = ?", (sCounter, "%04d-%02d" % (iYear, iMonth))).fetchone():
+            return True
+        iDaysInMonth = calendar.monthrange(iYear, iMonth)[1]
+        if datetime(iYear, iMonth, iDaysInMonth).date() >= datetime.now().date():
+            return False
+        return self.countDaysInMonth(sCounter, iYear, iMonth) >= iDaysInMonth
+
+    # Forget days written in the device of a counter (when the device has been recreated for instance)
+    def clearWrittenDays(self, sCounter):
+        with self.dbConn:
+            self.dbConn.execute("DELETE FROM written_days WHERE counter = ?", (sCounter,))
+
+    # Forget history of a counter
+    def clearCounter(self, sCounter):
+        with self.dbConn:
+            self.dbConn.execute("DELETE FROM days WHERE counter = ?", (sCounter,))
+            self.dbConn.execute("DELETE FROM written_days WHERE counter = ?", (sCounter,))
+            self.dbConn.execute("DELETE FROM exported_days WHERE counter = ?", (sCounter,))
+            self.dbConn.execute("DELETE FROM final_months WHERE counter = ?", (sCounter,))
+
+    def close(self):
+        if self.dbConn:
+            self.dbConn.close()
+            self.dbConn = None
+
+# Domoticz database, the first import of a counter is written straight in its daily history instead of one device update per day
+# Only schema versions known by the plugin are accepted, the database is never created nor altered
+class DomoticzDatabase:
+    # string: path of the Domoticz database
+    sPath = None
+    # integer: schema version, None until checked
+    iVersion = None
+
+    def __init__(self, sPath):
+        self.sPath = sPath
+
+    def connect(self):
+        return sqlite3.connect("file:" + quote(self.sPath) + "?mode=rw", uri=True, timeout=DOMOTICZ_DB_TIMEOUT)
+
+    # Read the schema version, raise ValueError if it isn't known or if a table lacks a column
+    def checkSchema(self):
+        dbConn = self.connect()
+        try:
+            row = dbConn.execute("SELECT nValue FROM Preferences WHERE Key = 'DB_Version'").fetchone()
+            if row is None:
+                raise ValueError("schema version not found in " + self.sPath)
+            self.iVersion = int(row[0])
+            if not (DOMOTICZ_DB_MIN_VERSION <= self.iVersion <= DOMOTICZ_DB_MAX_VERSION):
+                raise ValueError("schema version " + str(self.iVersion) + " of " + self.sPath + " is not known (known versions are " + str(DOMOTICZ_DB_MIN_VERSION) + " to " + str(DOMOTICZ_DB_MAX_VERSION) + ")")
+            for sTable, tColumns in DOMOTICZ_DB_COLUMNS.items():
+                setColumns = {row[1] for row in dbConn.execute("PRAGMA table_info(" + sTable + ")")}
+                lMissing = [sColumn for sColumn in tColumns if sColumn not in setColumns]
+                if lMissing:
+                    raise ValueError("table " + sTable + " of schema version " + str(self.iVersion) + " has no column " + ", ".join(lMissing))
+        finally:
+            dbConn.close()
+
+    # Write (day, usage, total) rows of devices in one transaction, as Domoticz does for each "total;usage;day" update of a managed counter
+    # lDevices is a list of (device ID, unit, rows), each device must be a counter of unit of the hardware, otherwise nothing is written
+    def importDays(self, iHardwareID, iType, iSubType, lDevices):
+        dbConn = self.connect()
+        try:
+            with dbConn:
+                dbConn.execute("BEGIN IMMEDIATE")
+                for iDeviceID, iUnit, lDays in lDevices:
+                    row = dbConn.execute("SELECT HardwareID, Unit, Type, SubType FROM DeviceStatus WHERE ID = ?", (iDeviceID,)).fetchone()
+                    if (row is None) or (tuple(row) != (iHardwareID, iUnit, iType, iSubType)):
+                        raise ValueError("device " + str(iDeviceID) + " is not the counter of unit " + str(iUnit) + " of this hardware")
+                    dbConn.executemany("DELETE FROM Meter_Calendar WHERE DeviceRowID = ? AND Date = ?", [(iDeviceID, sDay) for sDay, fUsage, fTotal in lDays])
+                    dbConn.executemany("INSERT INTO Meter_Calendar (DeviceRowID, Value, Counter, Date) VALUES (?, ?, ?, ?)", [(iDeviceID, fUsage, fTotal, sDay) for sDay, fUsage, fTotal in lDays])
+        finally:
+            dbConn.close()
+
 class BasePlugin:
     # int: debug mode
     iDebugLevel = None
+    # object: debug log
+    logger = None
     # boolean: to check that we are started, to prevent error messages when disabling or restarting the plugin
     isStarted = None
     # object: http connection
     httpConn = None
-    # integer: index of the Suez device
+    # integer: index of the Suez device of the first counter
     iIndexUnit = 1
     # string: name of the Suez device
     sDeviceName = "Suez"
@@ -87,300 +1235,988 @@ class BasePlugin:
     sConnectionStep = None
     # boolean: true if a step failed
     bHasAFail = None
-    # dict: cookies
-    dCookies = None
+    # object: requests to the website, cookies and responses statistics
+    client = None
+    # boolean: true if the current run uses the session saved from a previous run
+    bSessionReused = None
+    # integer: number of history months grabbed at the same time
+    iParallelRequests = None
+    # list: data workers
+    lWorkers = None
+    # list: months to grab again (after a new login for instance), before next ones
+    lPendingJobs = None
+    # dict: months being grabbed or waiting to be parsed, by sequence number
+    dJobs = None
+    # dict: received data waiting for older months to be parsed, by sequence number
+    dResults = None
+    # integer: number of months given to workers during this run
+    iJobsCount = None
+    # integer: sequence number of the next month to parse
+    iNextJobToParse = None
     # string: website token
     sToken = None
-    # string: counter ID for history
-    sCounter = None
-    # string: current year for history
-    sYear = None
-    # string: current month for history
-    sMonth = None
-    # date : current date for history
-    dateCurrentData = None
-    # string: end year for history
-    sEndYear = None
-    # string: end month for history
-    sEndMonth = None
+    # list: counters of the account
+    lCounters = None
     # integer: number of days of data to grab for history
     iHistoryDaysForDaysView = None
-    # integer: number of days left for next batch of data
-    iDaysLeft = None
-    # boolean: is this the batch of the most recent history
-    bFirstMonths = None
+    # date: last day grabbed during this run
+    dateGrabTo = None
+    # list: months to grab during this run, counter after counter, from the oldest to the most recent
+    lMonthPlan = None
     # string: username for Suez website
     sUser = None
     # string: password for Suez website
     sPassword = None
+    # object: local history of days already grabbed
+    historyStore = None
+    # integer: number of days parsed during this run
+    iRowsParsed = None
+    # integer: number of days not written during this run because their value didn't change
+    iRowsSkipped = None
+    # integer: number of days queued for writing during this run
+    iRowsQueued = None
+    # integer: number of days written during this run
+    iRowsWritten = None
+    # deque: (counter, day, usage, total) rows waiting to be written in the device, day is None for dashboard value
+    lWriteQueue = None
+    # integer: current heartbeat in seconds
+    iHeartbeat = None
+    # object: durations of steps
+    timings = None
+    # float: start time of the current step of the login connection
+    fStepStart = None
+    # boolean: show timings in a text device
+    bTimingsDevice = None
+    # boolean: run is over, timings will be reported when every day has been written
+    bTimingsPending = None
+    # object: choice of the time of next connection
+    scheduler = None
+    # dict: advanced options, by key
+    dOptions = None
+    # integer: years of monthly history to import before daily history, 0 if disabled
+    iMonthlyYears = None
+    # list: (counter, year, month) to grab again because days are missing in the device
+    lRepairMonths = None
+    # datetime: time of the run grabbing months with missing days
+    dateRepairAt = None
+    # boolean: true during a run grabbing months with missing days
+    bRepairRun = None
+    # dict: missing days found by last scan, by counter
+    dGapsFound = None
+    # dict: number of times each month with missing days has been grabbed again ("YYYY-MM"), by counter
+    dRepairAttempts = None
+    # boolean: responses are asked compressed, and revalidated when they have already been received
+    bCompress = None
+    # object: export of parsed days, None if disabled
+    exporter = None
+    # object: Domoticz database receiving the first import of new counters, None if disabled
+    domoticzDatabase = None
+    # dict: (day, usage, total) rows of the first import waiting to be written in the Domoticz database, by counter
+    dBulkDays = None
+    # boolean: consumption statistics are computed and shown in devices
+    bAnalytics = None
+    # integer: days without dropping to the leak floor after which a leak is suspected
+    iLeakDays = None
+    # float: leak floor (liters per day), None when leak detection is off
+    fLeakLiters = None
+    # integers: requests to the website per minute, and sent at once before being delayed
+    iRequestsPerMinute = None
+    iRequestsBurst = None
+    # object: rate limiter of requests to the website
+    limiter = None
+    # dict: state of monthly history import ({"years": years imported} or {"failedYears": years, "failures": count}), by counter
+    dMonthlyImport = None
+    # datetime: next connection
+    nextConnection = None
+    # datetime: last event of the current run (connection, answer or disconnection)
+    dateLastEvent = None
     # string: consumption to show = current week ("week"), the previous week ("lweek", the current month ("month"), the previous month ("lmonth"), or year ("year")
 
     def __init__(self):
         self.isStarted = False
+        self.logger = Logger(self.iDebugLevel or 0)
+        self.exporter = None
+        self.domoticzDatabase = None
+        self.dBulkDays = {}
         self.httpConn = None
         self.sConnectionStep = "idle"
+        self.dateLastEvent = datetime.now()
         self.bHasAFail = False
-        self.iDaysLeft = False
-
-    def myDebug(self, message):
-        if self.iDebugLevel:
-            Domoticz.Log(message)
-
-    # Reset saved cookies
-    def resetCookies(self):
-        self.dCookies = {}
-
-    # Grab cookies found in Data["Headers"] and saves them for later user
-    def getCookies(self, Data):
-        if Data and ("Headers" in Data) and ("Set-Cookie" in Data["Headers"]):
-            # lCookies = re.findall("^(.*?)=(.*?)[;$]", Data["Headers"]["Set-Cookie"], re.MULTILINE)
-            cookiesLines = Data["Headers"]["Set-Cookie"]
-            # on old version of Domoticz, cookies is a multiline string
-            if isinstance(cookiesLines, str):
-                cookiesLines = cookiesLines.splitlines()
-            # for match in re.finditer("^(.*?)=(.*?)[;$]", Data["Headers"]["Set-Cookie"], re.MULTILINE):
-            for sCookiesLine in cookiesLines:
-                for match in re.finditer("^(.*?)=(.*?)[;$]", sCookiesLine):
-                    self.dCookies[match.group(1)] = match.group(2)
-
-    # Write saved cookies in headers["Cookie"]
-    def setCookies(self, headers):
-        headers["Cookie"] = ""
-        for sKey, sValue in self.dCookies.items():
-            # Concatenate cookies
-            if headers["Cookie"]:
-                headers["Cookie"] += "; "
-            headers["Cookie"] += sKey + "=" + sValue
+        self.historyStore = None
+        self.lMonthPlan = []
+        self.lCounters = []
+        self.timings = Timings()
+        self.fStepStart = None
+        self.bTimingsPending = False
+        self.scheduler = Scheduler()
+        self.dMonthlyImport = {}
+        self.lRepairMonths = []
+        self.dateRepairAt = None
+        self.bRepairRun = False
+        self.dGapsFound = {}
+        self.dRepairAttempts = {}
+        self.lWriteQueue = deque()
+        self.client = HttpClient(bool(self.bCompress))
+        self.limiter = RateLimiter((self.iRequestsPerMinute or DEFAULT_REQUESTS_PER_MINUTE) / 60.0, self.iRequestsBurst or DEFAULT_REQUESTS_BURST)
+        self.resetRowsCounters()
+        self.bSessionReused = False
+        self.lWorkers = []
+        self.lPendingJobs = []
+        self.dJobs = {}
+        self.dResults = {}
+        self.iJobsCount = 0
+        self.iNextJobToParse = 0
+
+    # Integer advanced option between iMin and iMax, default if not set or not a number
+    def getIntOption(self, sKey, iDefault, iMin, iMax):
+        try:
+            iValue = int(self.dOptions[sKey])
+        except (KeyError, ValueError):
+            return iDefault
+        return min(max(iValue, iMin), iMax)
+
+    # Check that we have an authentication cookie that has not expired, sent with data requests
+    def hasValidSession(self):
+        return self.client.jar.find("eZSESSID", API_BASE_URI, API_ENDPOINT_DATA + "/") is not None
+
+    # Save cookies in local history so that next runs don't need to log in again
+    def saveSession(self):
+        if self.historyStore:
+            try:
+                self.historyStore.setState("session", self.client.jar.toState())
+            except sqlite3.Error as err:
+                Domoticz.Error("Cannot save session: " + str(err))
+
+    # Load cookies saved by a previous run
+    def loadSession(self):
+        self.client.jar.clear()
+        if self.historyStore:
+            try:
+                self.client.jar.load(self.historyStore.getState("session", []))
+            except (TypeError, ValueError):
+                Domoticz.Error("Saved session is not valid, login again")
+                self.client.jar.clear()
+
+    # Forget saved session, next run will log in again, other cookies are kept
+    def clearSession(self):
+        self.client.jar.remove("eZSESSID")
+        if self.historyStore:
+            try:
+                self.historyStore.deleteState("session")
+            except sqlite3.Error as err:
+                Domoticz.Error("Cannot clear session: " + str(err))
 
     # Store token needed for website
+    # Login page is not decoded, token is searched in raw bytes and search stops at the first match
     def setToken(self, Data):
-        strData = ""
-        if Data and ("Data" in Data):
-            strData = Data["Data"].decode();
-            regex=re.compile('"_csrf_token" value="(.*)"',re.I) #re.I permet d'ignorer la case (majuscule/minuscule)
-            match=regex.search(strData)
-            if match:
-                self.myDebug(match.group(1))
-                self.sToken = match.group(1)
-
-    # get default headers
-    def initHeaders(self):
-        return dict(HEADERS)
+        if Data and Data.get("Data"):
+            sToken = findToken(Data["Data"])
+            if sToken is not None:
+                self.sToken = sToken
+                self.logger.debug("Token found")
+
+    # Send a request through the rate limiter, Domoticz delays it when it has no token yet
+    def sendRequest(self, httpConn, sendData):
+        fDelay = self.limiter.reserve(time.monotonic())
+        if fDelay > 0.0:
+            self.logger.debug("Request delayed by %.1f s", fDelay)
+            httpConn.Send(sendData, Delay=int(math.ceil(fDelay)))
+        else:
+            httpConn.Send(sendData)
+
+    # Website is throttling requests: every request is paused, for the time asked by the website if any
+    def throttleRequests(self, Data):
+        fPause = self.limiter.throttle(time.monotonic(), retryAfter(Data))
+        Domoticz.Log("Website is throttling requests (status " + str(Data.get("Status")) + "), requests paused for " + str(int(fPause)) + " s")
 
     # get website token (Suez toutsurmoneau) through http connection
     def getToken(self):
-
-        headers = self.initHeaders()
-        headers["Host"] = LOGIN_BASE_URI + ":" + BASE_PORT
-
-        sendData = {
-                    "Verb" : "GET",
-                    "URL"  : API_ENDPOINT_LOGIN,
-                    "Headers" : headers
-        }
-        # Reset cookies to get authentication cookie later
-        self.resetCookies()
+        sendData = self.client.request("login", "GET", API_ENDPOINT_LOGIN)
         # Send data
-        self.httpConn.Send(sendData)
+        self.fStepStart = time.perf_counter()
+        self.sendRequest(self.httpConn, sendData)
 
     # send login details through http connection
     def login(self, username, password):
-        payload = {
-            '_username': username,
-            '_password': password,
-            '_csrf_token': self.sToken,
-            'signin[username]': username,
-            'signin[password]' : None,
-            'tsme_user_login[_username]': username,
-            'tsme_user_login[_password]': password
-        }
-
-        headers = self.initHeaders()
-        headers["Host"] = LOGIN_BASE_URI + ":" + BASE_PORT
-        self.setCookies(headers)
-
-        sendData = {
-                    "Verb" : "POST",
-                    "URL"  : API_ENDPOINT_LOGIN,
-                    "Headers" : headers,
-                    "Data" : dictToQuotedString(payload)
-        }
-
-        self.dumpDictToLog(sendData)
-        # Reset cookies to get authentication cookie later
-        self.resetCookies()
+        sendData = self.client.request("login", "POST", API_ENDPOINT_LOGIN, loginPayload(username, password, self.sToken))
+        self.logger.dump("Login request", sendData)
         # Send data
-        self.httpConn.Send(sendData)
+        self.fStepStart = time.perf_counter()
+        self.sendRequest(self.httpConn, sendData)
 
     # ask data to toutsurmoneau website, based on a counter_id ("counter number") and date of current month (year and month)
-    def getData(self, counter_id, year_date, month_date):
-        headers = self.initHeaders()
-        headers["Host"] = API_BASE_URI + ":" + BASE_PORT
-
-        #Copy cookies
-        self.setCookies(headers)
-        self.dumpDictToLog(headers)
-
-        sendData = {
-                    "Verb" : "GET",
-                    "URL"  : API_ENDPOINT_DATA + "/" + year_date + "/" + month_date + "/" + counter_id,
-                    "Headers" : headers
-        }
-        #self.dumpDictToLog(sendData)
-        self.httpConn.Send(sendData)
-
-    # Create Domoticz device
-    def createDevice(self):
+    # Returns the URL asked
+    def getData(self, counter_id, year_date, month_date, httpConn):
+        sendData = self.client.request("days", "GET", API_ENDPOINT_DATA + "/" + year_date + "/" + month_date + "/" + counter_id)
+        self.logger.dump("Data request", sendData)
+        self.sendRequest(httpConn, sendData)
+        return sendData["URL"]
+
+    # Ask monthly history of a counter, the website sends every month it knows, returns the URL asked
+    def getMonthsData(self, counter_id, httpConn):
+        sendData = self.client.request("months", "GET", API_ENDPOINT_MONTHS + "/" + counter_id)
+        self.logger.dump("Data request", sendData)
+        self.sendRequest(httpConn, sendData)
+        return sendData["URL"]
+
+    # Create Domoticz device of a counter
+    def createDevice(self, counter):
         # Only if not already done
-        if not self.iIndexUnit in Devices:
-            Domoticz.Device(Name=self.sDeviceName,  Unit=self.iIndexUnit, Type=self.iType, Subtype=self.iSubType, Switchtype=self.iSwitchType, Description=self.sDescription, Used=1).Create()
-            if not (self.iIndexUnit in Devices):
+        if not counter.iIndexUnit in Devices:
+            # First counter keeps the name of the single counter device
+            if counter.iIndexUnit == self.iIndexUnit:
+                sName = self.sDeviceName
+            else:
+                sName = self.sDeviceName + " " + counter.sCounter
+            Domoticz.Device(Name=sName,  Unit=counter.iIndexUnit, Type=self.iType, Subtype=self.iSubType, Switchtype=self.iSwitchType, Description=self.sDescription + " " + counter.sCounter, Used=1).Create()
+            if not (counter.iIndexUnit in Devices):
                 Domoticz.Error("Cannot add Suez device to database. Check in settings that Domoticz is set up to accept new devices")
                 return False
+            # New device has no history, every day of local history will be written again
+            counter.dWrittenDays = {}
+            if self.historyStore:
+                self.historyStore.clearWrittenDays(counter.sCounter)
+            if self.dMonthlyImport.pop(counter.sCounter, None) is not None:
+                self.saveMonthlyImport()
         return True
 
     # Create device and insert usage in Domoticz DB
-    def createAndAddToDevice(self, usage, usageTotal, Date):
-        if not self.createDevice():
+    def createAndAddToDevice(self, counter, usage, usageTotal, Date):
+        if not self.createDevice(counter):
             return False
 
         sNewValue=str(usageTotal) + ";" + str(usage) + ";" + str(Date)
-        self.myDebug("Insert this value into the DB: " + sNewValue)
-        Devices[self.iIndexUnit].Update(nValue=0, sValue=sNewValue, Type=self.iType, Subtype=self.iSubType, Switchtype=self.iSwitchType,)
+        self.logger.debug("Insert this value into the DB: %s", sNewValue)
+        Devices[counter.iIndexUnit].Update(nValue=0, sValue=sNewValue, Type=self.iType, Subtype=self.iSubType, Switchtype=self.iSwitchType,)
         return True
 
     # Update value shown on Domoticz dashboard
-    def updateDevice(self, usage, usageTotal):
-        if not self.createDevice():
+    def updateDevice(self, counter, usage, usageTotal):
+        if not self.createDevice(counter):
             return False
 
         sUpdateValue=str(usageTotal) + ";"+ str(usage)
-        self.myDebug("Update dashboard with this value: " + sUpdateValue)
-        Devices[self.iIndexUnit].Update(nValue=0, sValue=sUpdateValue, Type=self.iType, Subtype=self.iSubType, Switchtype=self.iSwitchType)
+        self.logger.debug("Update dashboard with this value: %s", sUpdateValue)
+        Devices[counter.iIndexUnit].Update(nValue=0, sValue=sUpdateValue, Type=self.iType, Subtype=self.iSubType, Switchtype=self.iSwitchType)
         return True
 
+    # Give a device unit to each counter, units already given to a counter are kept even if counters order changes
+    def assignUnits(self, lCounterIds):
+        dUnits = {}
+        if self.historyStore:
+            dUnits = self.historyStore.getState("units", {})
+        # Single counter device of previous versions
+        if not dUnits:
+            dUnits[lCounterIds[0]] = self.iIndexUnit
+        lCounters = []
+        for sCounter in lCounterIds:
+            if sCounter not in dUnits:
+                iUnit = self.iIndexUnit
+                while iUnit in dUnits.values():
+                    iUnit = iUnit + 1
+                dUnits[sCounter] = iUnit
+            lCounters.append(CounterState(sCounter, dUnits[sCounter]))
+        if self.historyStore:
+            try:
+                self.historyStore.setState("units", dUnits)
+            except sqlite3.Error as err:
+                Domoticz.Error("Cannot save devices units: " + str(err))
+        return lCounters
+
     # Show error in state machine context
-    def showStepError(self, days, logMessage):
+    def showStepError(self, days, logMessage, job):
         if days:
-            Domoticz.Error(logMessage + " during step " + self.sConnectionStep + " for days of year " + self.sYear + " and month " + self.sMonth)
+            Domoticz.Error(logMessage + " during step " + self.sConnectionStep + " for days of year " + job.sYear + " and month " + job.sMonth + " of counter " + job.counter.sCounter)
         else:
-            Domoticz.Error(logMessage + " during step " + self.sConnectionStep + " for months of year " + self.sYear)
+            Domoticz.Error(logMessage + " during step " + self.sConnectionStep + " for months of year " + job.sYear + " of counter " + job.counter.sCounter)
 
     # Grab days data inside received JSON data for history
-    def exploreDataDays(self, Data):
-        self.myDebug("Begin Data Days")
-        curDay = None
+    def exploreDataDays(self, Data, job):
+        self.logger.debug("Begin Data Days")
+        # boolean: true until the most recent day has been shown on dashboard
+        bDashboard = job.bMostRecent
         curIndexDay = None
         curTotalIndexDay = None
-        self.dumpDictToLog(Data)
+        # list: (day, usage, total) rows to save in local history
+        lHistoryDays = []
+        # list: (day, usage, total) rows new or changed, to export
+        lExportDays = []
 
         if Data and "Data" in Data:
             try:
-                dJson = json.loads(Data["Data"].decode())
-                dJson.reverse()
+                # JSON is parsed straight from bytes
+                dJson = json.loads(Data["Data"])
             except ValueError as err:
-                self.showStepError(True, "Data received are not JSON: " + str(err))
+                self.showStepError(True, "Data received are not JSON: " + str(err), job)
                 return False
             except TypeError as err:
-                self.showStepError(True, "Data type received is not JSON: " + str(err))
+                self.showStepError(True, "Data type received is not JSON: " + str(err), job)
                 return False
             except:
-                self.showStepError(True, "Error in JSON data: " + sys.exc_info()[0])
+                self.showStepError(True, "Error in JSON data: " + str(sys.exc_info()[0]), job)
+                return False
+            try:
+                aOrdinals, aUsages, aTotals = parseStatJData(dJson)
+            except ValueError as err:
+                self.showStepError(True, "Error in received JSON data: " + str(err), job)
                 return False
             else:
-                for day in range(len(dJson)):
-                    for i, value in enumerate(dJson[day]):
-                        if i == 0:
-                            try:
-                                curDay = suezDateToDatetime(value)
-                            except ValueError as err:
-                                self.showStepError(True, "Error in received JSON data time format: " + str(err))
-                                return False
-                            except:
-                                self.showStepError(True, "Error in received JSON data time: " + sys.exc_info()[0])
-                                return False
-                        if i == 1:
-                            # Convert m3 consumption to liter (DON'T FORGET TO SET DEVICE LIMITER TO 1000)
-                            curIndexDay = float(value) * 1000.0
-                        if i == 2:
-                            curTotalIndexDay = float(value) * 1000.0
+                # Statistics are updated with the new days, oldest first
+                if self.bAnalytics:
+                    for iRow in range(len(aOrdinals)):
+                        if aTotals[iRow] > 0.0:
+                            job.counter.stats.addDay(aOrdinals[iRow], aUsages[iRow])
+                # Most recent day first
+                for iRow in range(len(aOrdinals) - 1, -1, -1):
+                    # Consumption is converted from m3 to liter (DON'T FORGET TO SET DEVICE LIMITER TO 1000)
+                    curIndexDay = aUsages[iRow]
+                    curTotalIndexDay = aTotals[iRow]
+                    self.iRowsParsed = self.iRowsParsed + 1
+                    sCurDay = ordinalToSQLDateString(aOrdinals[iRow])
+                    # Keep in local history every day measured by the counter
+                    if (curTotalIndexDay > 0.0):
+                        if not lHistoryDays:
+                            dateDay = date.fromordinal(aOrdinals[iRow])
+                            if (job.counter.dateLastDay is None) or (dateDay > job.counter.dateLastDay):
+                                job.counter.dateLastDay = dateDay
+                        lHistoryDays.append((sCurDay, curIndexDay, curTotalIndexDay))
+                        if self.exporter and (job.counter.dExportedDays.get(sCurDay) != (curIndexDay, curTotalIndexDay)):
+                            lExportDays.append((sCurDay, curIndexDay, curTotalIndexDay))
                     # Update only if there is a value
                     if (curIndexDay > 0.0):
                         #Domoticz.Log("Value " + str(curIndexDay) + " with total of " + str(curTotalIndexDay) + " for " + datetimeToSQLDateString(curDay))
-                        if not self.createAndAddToDevice(curIndexDay, curTotalIndexDay, datetimeToSQLDateString(curDay)):
-                            return False
-                        # If we are on the most recent batch and end date, use the most recent data for Domoticz dashboard
-                        if self.bFirstMonths:
-                            self.bFirstMonths = False
-                            if not self.updateDevice(curIndexDay, curTotalIndexDay):
-                                return False
+                        # Don't write again a day already in the device with the same value
+                        if job.counter.dWrittenDays.get(sCurDay) == (curIndexDay, curTotalIndexDay):
+                            self.iRowsSkipped = self.iRowsSkipped + 1
                         else:
-                            if self.iDaysLeft > 0:
-                                self.iDaysLeft = self.iDaysLeft - 1
+                            self.queueWrite(job.counter, sCurDay, curIndexDay, curTotalIndexDay)
+                        # If we are on the most recent batch and end date, use the most recent data for Domoticz dashboard
+                        if bDashboard:
+                            bDashboard = False
+                            self.queueWrite(job.counter, None, curIndexDay, curTotalIndexDay)
+                if self.exporter:
+                    lExportDays.reverse()
+                    self.exportDays(job.counter, lExportDays)
+                # Next run of this counter starts after this month, months grabbed to fill gaps don't change it
+                checkpoint = None
+                if not self.bRepairRun:
+                    job.counter.dateGrabFrom = min(job.dateLast + timedelta(days=1), self.dateGrabTo)
+                    checkpoint = self.checkpoint()
+                if self.historyStore:
+                    try:
+                        # Month is over and the website sent all its days, no need to ask for it again
+                        self.historyStore.addMonth(job.counter.sCounter, lHistoryDays, int(job.sYear), int(job.sMonth), isMonthComplete(int(job.sYear), int(job.sMonth), len(aOrdinals)), checkpoint)
+                    except sqlite3.Error as err:
+                        Domoticz.Error("Cannot save local history: " + str(err))
                 return True
             #else:
-                #self.showStepError(True, "Error in received JSON data")
+                #self.showStepError(True, "Error in received JSON data", job)
         else:
-            self.showStepError(True, "Didn't received data")
+            self.showStepError(True, "Didn't received data", job)
         return False
 
-    # Calculate year and month for data pulling
-    def calculateMonthData(self):
-        self.myDebug("Number of days left: "+ str(self.iDaysLeft))
-        # Remove one day to get correct data and avoid month change issue
-        self.dateCurrentData = (datetime.now() - timedelta(days=self.iDaysLeft) - timedelta(days=1))
-        self.myDebug(str(self.dateCurrentData))
-        bNewData = False
-        # Set year and month for data request
-        if (self.sYear is None) or (self.sYear != str(self.dateCurrentData.year)):
-            self.sYear = str(self.dateCurrentData.year)
-            bNewData = True
-
-        if (self.sMonth is None) or (self.sMonth != str(self.dateCurrentData.month)):
-            self.sMonth = str(self.dateCurrentData.month)
-            bNewData = True
-
-        if (self.sMonth == self.sEndMonth) and (self.sYear == self.sEndYear):
-            self.bFirstMonths = True
-
-        if bNewData:
-            return
+    # Write monthly history received as one value per month, on the last day of the month
+    # Import failures don't stop the run, import is tried again during next runs
+    def exploreDataMonths(self, Data, job):
+        self.logger.debug("Begin Data Months")
+        counter = job.counter
+        if (not Data) or (str(Data.get("Status")) != "200") or (not Data.get("Data")):
+            self.failMonthlyImport(counter, "website answered with status " + str(Data.get("Status") if Data else None))
+            return True
+        try:
+            lRows = json.loads(Data["Data"])
+        except ValueError as err:
+            self.failMonthlyImport(counter, "data received are not JSON: " + str(err))
+            return True
+        lMonths, iRejected = parseStatMData(lRows)
+        iFirst = job.dateFirst.year * 12 + job.dateFirst.month
+        iLast = job.dateLast.year * 12 + job.dateLast.month
+        lMonths = [month for month in lMonths if iFirst <= month[0] * 12 + month[1] <= iLast]
+        if iRejected:
+            Domoticz.Log(str(iRejected) + " rows of monthly history of counter " + counter.sCounter + " not understood, ignored")
+        # Index at the end of each month, going back from the first day of daily history when the website doesn't give it
+        fNextTotal = None
+        if self.historyStore:
+            firstDay = self.historyStore.getFirstDay(counter.sCounter)
+            if firstDay:
+                fNextTotal = firstDay[2] - firstDay[1]
+        iImported = 0
+        for iYear, iMonth, fUsage, fTotal in sorted(lMonths, reverse=True):
+            if fTotal <= 0.0:
+                if fNextTotal is None:
+                    continue
+                fTotal = fNextTotal
+            fNextTotal = fTotal - fUsage
+            if fUsage > 0.0:
+                sDay = datetimeToSQLDateString(date(iYear, iMonth, calendar.monthrange(iYear, iMonth)[1]))
+                if counter.dWrittenDays.get(sDay) != (fUsage, fTotal):
+                    self.queueWrite(counter, sDay, fUsage, fTotal)
+                iImported = iImported + 1
+        Domoticz.Log("Monthly history of counter " + counter.sCounter + " from " + job.dateFirst.strftime("%Y-%m") + " to " + job.dateLast.strftime("%Y-%m") + ": " + str(iImported) + " months imported")
+        self.dMonthlyImport[counter.sCounter] = {"years": self.iMonthlyYears}
+        self.saveMonthlyImport()
+        return True
 
-        if (self.sYear == str(self.dateCurrentData.year)) and (self.sMonth == str(self.dateCurrentData.month)):
-            self.myDebug("Same year: " + self.sYear + " and month: " + self.sMonth)
-            if self.iDaysLeft > 0:
-                self.iDaysLeft = self.iDaysLeft - 1
-                self.calculateMonthData()
+    # Monthly history import failed for a counter, it is abandoned after too many failures
+    def failMonthlyImport(self, counter, sReason):
+        dState = self.dMonthlyImport.get(counter.sCounter, {})
+        if dState.get("failedYears") != self.iMonthlyYears:
+            dState["failures"] = 0
+        dState["failedYears"] = self.iMonthlyYears
+        dState["failures"] = dState.get("failures", 0) + 1
+        self.dMonthlyImport[counter.sCounter] = dState
+        if dState["failures"] >= MAX_MONTHLY_IMPORT_FAILURES:
+            Domoticz.Error("Cannot import monthly history of counter " + counter.sCounter + ", " + sReason + ", giving up")
+        else:
+            Domoticz.Error("Cannot import monthly history of counter " + counter.sCounter + ", " + sReason + ", will try again during next run")
+        self.saveMonthlyImport()
 
+    def saveMonthlyImport(self):
+        if self.historyStore:
+            try:
+                self.historyStore.setState("monthlyImport", self.dMonthlyImport)
+            except sqlite3.Error as err:
+                Domoticz.Error("Cannot save monthly history import state: " + str(err))
+
+    # Months of monthly history to import for a counter as (first day, last day), None if not needed
+    # They end just before the month where daily history starts
+    def monthlyImportSpan(self, counter):
+        if not self.iMonthlyYears:
+            return None
+        dState = self.dMonthlyImport.get(counter.sCounter, {})
+        if dState.get("years", 0) >= self.iMonthlyYears:
+            return None
+        if (dState.get("failedYears") == self.iMonthlyYears) and (dState.get("failures", 0) >= MAX_MONTHLY_IMPORT_FAILURES):
+            return None
+        dateLast = (datetime.now().date() - timedelta(days=self.iHistoryDaysForDaysView)).replace(day=1) - timedelta(days=1)
+        iFirst = dateLast.year * 12 + dateLast.month - 1 - (self.iMonthlyYears * 12 - 1)
+        return date(iFirst // 12, iFirst % 12 + 1, 1), dateLast
+
+    # Plan months to grab during this run, counter after counter
+    # Final months are never grabbed again, and the most recent month is skipped when yesterday is already known
+    def planMonths(self):
+        self.dateGrabTo = datetime.now().date() - timedelta(days=1)
+        lPlan = []
+        for counter in self.lCounters:
+            lFullPlan = buildMonthPlan(min(counter.dateGrabFrom, self.dateGrabTo), self.dateGrabTo)
+            lCounterPlan = []
+            # list: (year, month) skipped because they are final
+            lFinalMonths = []
+            # list: (year, month) skipped because their last day is already known
+            lKnownMonths = []
+            for iMonth, (iYear, iMonthOfYear, dateFirst, dateLast) in enumerate(lFullPlan):
+                bMostRecent = (iMonth == len(lFullPlan) - 1)
+                if self.historyStore and self.historyStore.isMonthFinal(counter.sCounter, iYear, iMonthOfYear):
+                    lFinalMonths.append((iYear, iMonthOfYear))
+                elif bMostRecent and (counter.dateLastDay is not None) and (counter.dateLastDay >= self.dateGrabTo):
+                    lKnownMonths.append((iYear, iMonthOfYear))
+                else:
+                    lCounterPlan.append(MonthJob(len(lPlan) + len(lCounterPlan), counter, iYear, iMonthOfYear, dateFirst, dateLast, bMostRecent))
+            counter.iMonthsPlanned = len(lCounterPlan)
+            counter.iMonthsParsed = 0
+            Domoticz.Log("Months to grab for counter " + counter.sCounter + " from " + datetimeToSQLDateString(lFullPlan[0][2]) + " to " + datetimeToSQLDateString(self.dateGrabTo) + ": " + str(len(lCounterPlan)) + " (" + str(len(lFullPlan) - len(lCounterPlan)) + " skipped)")
+            if lFinalMonths:
+                Domoticz.Log("Skipping for counter " + counter.sCounter + " " + monthRangesToString(lFinalMonths) + ": final months, all their days are in local history")
+            if lKnownMonths:
+                Domoticz.Log("Skipping for counter " + counter.sCounter + " " + monthRangesToString(lKnownMonths) + ": yesterday is already in local history")
+            if self.logger.iLevel >= LOG_DEBUG:
+                self.logger.debug("Plan: %s", ", ".join(job.sYear + "-" + job.sMonth for job in lCounterPlan))
+            lPlan.extend(lCounterPlan)
+        # Monthly history is imported once, after daily history of every counter
+        for counter in self.lCounters:
+            span = self.monthlyImportSpan(counter)
+            if span:
+                Domoticz.Log("Monthly history to import for counter " + counter.sCounter + " from " + span[0].strftime("%Y-%m") + " to " + span[1].strftime("%Y-%m"))
+                lPlan.append(MonthJob(len(lPlan), counter, span[0].year, span[0].month, span[0], span[1], False, "months"))
+        return lPlan
+
+    # Next run starts from the first month not parsed of each counter
+    def updateGrabFrom(self):
+        # Months grabbed to fill gaps don't change progress of daily history
+        if self.bRepairRun:
+            return
+        dFirstNotParsed = {}
+        for job in self.lMonthPlan[self.iNextJobToParse:]:
+            if (job.sKind == "days") and (job.counter.sCounter not in dFirstNotParsed):
+                dFirstNotParsed[job.counter.sCounter] = job.dateFirst
+        for counter in self.lCounters:
+            # Next run grabs again the last day, it may not be complete yet
+            counter.dateGrabFrom = dFirstNotParsed.get(counter.sCounter, self.dateGrabTo)
+        if self.historyStore:
+            try:
+                self.historyStore.setState("checkpoint", self.checkpoint())
+            except sqlite3.Error as err:
+                Domoticz.Error("Cannot save progress of daily history: " + str(err))
+
+    # Progress of daily history saved between runs, only valid for the same counters and days to grab
+    def checkpoint(self):
+        return {
+            "counters": [counter.sCounter for counter in self.lCounters],
+            "days": self.iHistoryDaysForDaysView,
+            "grabFrom": {counter.sCounter: datetimeToSQLDateString(counter.dateGrabFrom) for counter in self.lCounters},
+        }
 
-    # Calculate next complete grab, for tomorrow between 8 and 9 am if tomorrow is true, for next hour otherwise
-    def setNextConnection(self, tomorrow):
-        if tomorrow:
-            self.nextConnection = datetime.now() + timedelta(days=1)
-            self.nextConnection = self.nextConnection.replace(hour=8)
-            if self.iDaysLeft == 0:
-                self.iDaysLeft = 1
+    # Resume daily history from the progress saved by previous runs, or grab it from the start
+    def loadCheckpoint(self):
+        dateStart = datetime.now().date() - timedelta(days=self.iHistoryDaysForDaysView)
+        for counter in self.lCounters:
+            counter.dateGrabFrom = dateStart
+        if not self.historyStore:
+            return
+        checkpoint = self.historyStore.getState("checkpoint")
+        if not checkpoint:
+            return
+        if (checkpoint.get("counters") != [counter.sCounter for counter in self.lCounters]) or (checkpoint.get("days") != self.iHistoryDaysForDaysView):
+            Domoticz.Log("Counters or days to grab have changed, daily history is checked again from the start")
+            try:
+                self.historyStore.deleteState("checkpoint")
+            except sqlite3.Error as err:
+                Domoticz.Error("Cannot remove progress of daily history: " + str(err))
+            return
+        for counter in self.lCounters:
+            try:
+                dateGrabFrom = datetime.strptime(checkpoint["grabFrom"][counter.sCounter], "%Y-%m-%d").date()
+            except (KeyError, TypeError, ValueError):
+                continue
+            # Plugin may have been stopped for a long time, days older than the days to grab are not needed
+            if dateGrabFrom > dateStart:
+                counter.dateGrabFrom = dateGrabFrom
+                Domoticz.Log("Resuming daily history of counter " + counter.sCounter + " from " + datetimeToSQLDateString(dateGrabFrom))
+
+    # Find days missing in the device of a counter, from the start of daily history (or first day known) to the last day published
+    # Returns days known in local history but not written (days without consumption for instance), and the number of other missing days by (year, month)
+    def scanGaps(self, counter):
+        lKnownDays = []
+        dMissingMonths = {}
+        if (not self.historyStore) or (counter.dateLastDay is None):
+            return lKnownDays, dMissingMonths
+        firstDay = self.historyStore.getFirstDay(counter.sCounter)
+        if not firstDay:
+            return lKnownDays, dMissingMonths
+        dateFirst = max(datetime.now().date() - timedelta(days=self.iHistoryDaysForDaysView), datetime.strptime(firstDay[0], "%Y-%m-%d").date())
+        dDays = self.historyStore.getDays(counter.sCounter, datetimeToSQLDateString(dateFirst), datetimeToSQLDateString(counter.dateLastDay))
+        for iOrdinal in range(dateFirst.toordinal(), counter.dateLastDay.toordinal() + 1):
+            sDay = ordinalToSQLDateString(iOrdinal)
+            if sDay in counter.dWrittenDays:
+                continue
+            if sDay in dDays:
+                lKnownDays.append((sDay, dDays[sDay][0], dDays[sDay][1]))
+            else:
+                dateDay = date.fromordinal(iOrdinal)
+                dMissingMonths[(dateDay.year, dateDay.month)] = dMissingMonths.get((dateDay.year, dateDay.month), 0) + 1
+        return lKnownDays, dMissingMonths
+
+    # Look for missing days after a run: days in local history are written, months with other missing days are grabbed again later
+    def planGapRepair(self):
+        self.lRepairMonths = []
+        self.dGapsFound = {}
+        for counter in self.lCounters:
+            lKnownDays, dMissingMonths = self.scanGaps(counter)
+            iMissing = len(lKnownDays) + sum(dMissingMonths.values())
+            if not iMissing:
+                continue
+            self.dGapsFound[counter.sCounter] = iMissing
+            for sDay, usage, usageTotal in lKnownDays:
+                self.queueWrite(counter, sDay, usage, usageTotal)
+            dAttempts = self.dRepairAttempts.get(counter.sCounter, {})
+            lMonths = [month for month in sorted(dMissingMonths) if dAttempts.get("%04d-%02d" % month, 0) < MAX_GAP_REPAIR_ATTEMPTS]
+            sLog = "Gaps in device of counter " + counter.sCounter + ": " + str(iMissing) + " missing days, " + str(len(lKnownDays)) + " written from local history"
+            if lMonths:
+                sLog = sLog + ", months to grab again: " + monthRangesToString(lMonths)
+            if len(lMonths) < len(dMissingMonths):
+                sLog = sLog + ", given up after " + str(MAX_GAP_REPAIR_ATTEMPTS) + " attempts: " + monthRangesToString([month for month in sorted(dMissingMonths) if month not in lMonths])
+            Domoticz.Log(sLog)
+            self.lRepairMonths.extend((counter, iYear, iMonth) for iYear, iMonth in lMonths)
+        if self.lRepairMonths:
+            self.dateRepairAt = datetime.now() + timedelta(minutes=GAP_REPAIR_DELAY_MINUTES)
+            Domoticz.Log("Months with missing days will be grabbed again at " + datetimeToSQLDateTimeString(self.dateRepairAt))
+
+    # Plan of a run grabbing again months with missing days, each attempt is counted
+    def planRepair(self):
+        lPlan = []
+        for counter, iYear, iMonth in self.lRepairMonths:
+            dAttempts = self.dRepairAttempts.setdefault(counter.sCounter, {})
+            dAttempts["%04d-%02d" % (iYear, iMonth)] = dAttempts.get("%04d-%02d" % (iYear, iMonth), 0) + 1
+            iDaysInMonth = calendar.monthrange(iYear, iMonth)[1]
+            lPlan.append(MonthJob(len(lPlan), counter, iYear, iMonth, date(iYear, iMonth, 1), date(iYear, iMonth, iDaysInMonth), False))
+        self.lRepairMonths = []
+        for counter in self.lCounters:
+            counter.iMonthsPlanned = len([job for job in lPlan if job.counter == counter])
+            counter.iMonthsParsed = 0
+        if self.historyStore:
+            try:
+                self.historyStore.setState("gapRepair", self.dRepairAttempts)
+            except sqlite3.Error as err:
+                Domoticz.Error("Cannot save gap repair state: " + str(err))
+        Domoticz.Log("Grabbing again " + str(len(lPlan)) + " months with missing days")
+        return lPlan
+
+    # Count gaps fixed by a repair run
+    def reportGapRepair(self):
+        iFound = 0
+        iLeft = 0
+        for counter in self.lCounters:
+            if counter.sCounter in self.dGapsFound:
+                lKnownDays, dMissingMonths = self.scanGaps(counter)
+                iFound = iFound + self.dGapsFound[counter.sCounter]
+                iLeft = iLeft + len(lKnownDays) + sum(dMissingMonths.values())
+        Domoticz.Log("Gap repair: " + str(iFound) + " missing days found, " + str(iFound - iLeft) + " fixed, " + str(iLeft) + " left")
+
+    # Queue a day to write in the device (day is None for dashboard value), it will be written during next heartbeats
+    def queueWrite(self, counter, sDay, usage, usageTotal):
+        # First import of a counter is kept to be written at once in the Domoticz database
+        if (sDay is not None) and (counter in self.dBulkDays):
+            self.dBulkDays[counter].append((sDay, usage, usageTotal))
+            counter.dWrittenDays[sDay] = (usage, usageTotal)
+            self.iRowsQueued = self.iRowsQueued + 1
+            return
+        self.lWriteQueue.append((counter, sDay, usage, usageTotal))
+        if sDay is not None:
+            # Considered as written so that it is not queued twice
+            counter.dWrittenDays[sDay] = (usage, usageTotal)
+            self.iRowsQueued = self.iRowsQueued + 1
+        self.updateHeartbeat()
+
+    # Write queued days in the device, at most iMaxRows days during at most iMaxMs milliseconds (no limit if None)
+    def drainWriteQueue(self, iMaxRows, iMaxMs):
+        if not self.lWriteQueue:
+            return
+        fStart = time.perf_counter()
+        # dict: (day, usage, total) rows written, by counter
+        dWrittenDays = {}
+        iRows = 0
+        bWritten = True
+        while self.lWriteQueue and ((iMaxRows is None) or (iRows < iMaxRows)) and ((iMaxMs is None) or ((time.perf_counter() - fStart) * 1000.0 < iMaxMs)):
+            counter, sDay, usage, usageTotal = self.lWriteQueue.popleft()
+            fWriteStart = time.perf_counter()
+            if sDay is None:
+                bWritten = self.updateDevice(counter, usage, usageTotal)
+            else:
+                bWritten = self.createAndAddToDevice(counter, usage, usageTotal, sDay)
+            self.timings.add("write", fWriteStart)
+            if bWritten and (sDay is not None):
+                dWrittenDays.setdefault(counter, []).append((sDay, usage, usageTotal))
+                self.iRowsWritten = self.iRowsWritten + 1
+            if not bWritten:
+                Domoticz.Error("Cannot write in device, " + str(len(self.lWriteQueue) + 1) + " days dropped, they will be written after next restart")
+                self.lWriteQueue.clear()
+                break
+            iRows = iRows + 1
+        if self.historyStore:
+            try:
+                for counter, lWrittenDays in dWrittenDays.items():
+                    self.historyStore.addWrittenDays(counter.sCounter, lWrittenDays)
+                # Forget days dropped, they will be written again
+                if not bWritten:
+                    for counter in self.lCounters:
+                        counter.dWrittenDays = self.historyStore.getWrittenDays(counter.sCounter)
+            except sqlite3.Error as err:
+                Domoticz.Error("Cannot save written days in local history: " + str(err))
+        self.logger.debug("Wrote %d values in %d ms, write queue depth: %d", iRows, round((time.perf_counter() - fStart) * 1000.0), len(self.lWriteQueue))
+        if not self.lWriteQueue:
+            Domoticz.Log("Write queue empty, days written: " + str(self.iRowsWritten))
+            if self.bTimingsPending:
+                self.reportTimings()
+        self.updateHeartbeat()
+
+    # Write days of the first import in the Domoticz database in one transaction, they are queued to be written one by one if it fails
+    def bulkImport(self):
+        lDevices = [(counter, lDays) for counter, lDays in self.dBulkDays.items() if lDays and self.createDevice(counter)]
+        if not lDevices:
+            return
+        iDays = sum(len(lDays) for counter, lDays in lDevices)
+        fStart = time.perf_counter()
+        try:
+            self.domoticzDatabase.importDays(Parameters["HardwareID"], self.iType, self.iSubType, [(Devices[counter.iIndexUnit].ID, counter.iIndexUnit, lDays) for counter, lDays in lDevices])
+        except (sqlite3.Error, ValueError) as err:
+            Domoticz.Error("Bulk import failed, " + str(iDays) + " days will be written one by one: " + str(err))
+            self.domoticzDatabase = None
+            self.dBulkDays = {}
+            for counter, lDays in lDevices:
+                for sDay, usage, usageTotal in lDays:
+                    self.lWriteQueue.append((counter, sDay, usage, usageTotal))
+            self.updateHeartbeat()
+            return
+        self.timings.add("write", fStart)
+        self.iRowsWritten = self.iRowsWritten + iDays
+        Domoticz.Log("Bulk import: " + str(iDays) + " days of " + str(len(lDevices)) + " counters written in the Domoticz database in " + str(round((time.perf_counter() - fStart) * 1000.0)) + " ms")
+        if self.historyStore:
+            try:
+                for counter, lDays in lDevices:
+                    self.historyStore.addWrittenDays(counter.sCounter, lDays)
+            except sqlite3.Error as err:
+                Domoticz.Error("Cannot save written days in local history: " + str(err))
+        for counter, lDays in lDevices:
+            lDays.clear()
+
+    # Heartbeat is faster while days are waiting to be written
+    def updateHeartbeat(self):
+        iHeartbeat = HEARTBEAT_WRITING if self.lWriteQueue else HEARTBEAT_IDLE
+        if iHeartbeat != self.iHeartbeat:
+            self.iHeartbeat = iHeartbeat
+            Domoticz.Heartbeat(iHeartbeat)
+
+    # Program next connection after a run, the scheduler tells when and why
+    def setNextConnection(self, bFailed):
+        now = datetime.now()
+        if bFailed:
+            self.nextConnection, sReason = self.scheduler.afterFailure(now)
         else:
-            self.nextConnection = datetime.now() + timedelta(hours = 1)
-        # Randomize minutes to lower load on toutsurmoneau website
-        # We take microseconds to randomize
-        minutesRand = round(datetime.now().microsecond / 10000) % 60
-        self.nextConnection = self.nextConnection + timedelta(minutes=minutesRand)
+            dateYesterday = now.date() - timedelta(days=1)
+            bGotYesterday = all((counter.dateLastDay is not None) and (counter.dateLastDay >= dateYesterday) for counter in self.lCounters)
+            self.nextConnection, sReason = self.scheduler.afterSuccess(now, dateYesterday, bGotYesterday)
+        Domoticz.Log("Next connection: " + datetimeToSQLDateTimeString(self.nextConnection) + " (" + sReason + ")")
+        if self.historyStore:
+            try:
+                self.historyStore.setState("scheduler", self.scheduler.toState())
+            except sqlite3.Error as err:
+                Domoticz.Error("Cannot save scheduler state: " + str(err))
+
+    # Open connection to login page, first step of authentication
+    def startLogin(self):
+        self.bSessionReused = False
+        self.openConnection(LOGIN_BASE_URI)
+        self.sConnectionStep = "connecting"
+        self.fStepStart = time.perf_counter()
+        self.httpConn.Connect()
+
+    # Replace http connection by a new one to address, previous one is closed so that it is not left behind
+    def openConnection(self, sAddress):
+        self.closeConnection()
+        self.httpConn = Domoticz.Connection(Name="HTTPS connection", Transport="TCP/IP", Protocol="HTTPS", Address=sAddress, Port=BASE_PORT)
+
+    # Close http connection if still opened
+    def closeConnection(self):
+        if self.httpConn and self.httpConn.Connected():
+            self.httpConn.Disconnect()
+
+    # Get next month to grab, from the oldest to the most recent one, None if there is no more month
+    def nextMonthJob(self):
+        if self.lPendingJobs:
+            return self.lPendingJobs.pop(0)
+        if self.iJobsCount >= len(self.lMonthPlan):
+            return None
+        job = self.lMonthPlan[self.iJobsCount]
+        self.iJobsCount = self.iJobsCount + 1
+        self.dJobs[job.iSeq] = job
+        return job
+
+    # We are authenticated, start data workers, the first one reuses the login connection if still opened
+    def startDataWorkers(self):
+        self.sConnectionStep = "getdata"
+        self.lWorkers = []
+        for iWorker in range(self.iParallelRequests):
+            worker = DataWorker()
+            if (iWorker == 0) and self.httpConn and self.httpConn.Connected() and (LOGIN_BASE_URI == API_BASE_URI):
+                worker.httpConn = self.httpConn
+                self.httpConn = None
+            self.lWorkers.append(worker)
+        for worker in self.lWorkers:
+            self.dispatchJob(worker)
+        self.checkDataDone()
+
+    # Stop data workers, jobs in progress are kept to be grabbed later if keepJobs is true
+    def stopDataWorkers(self, keepJobs):
+        if self.lWorkers:
+            for worker in self.lWorkers:
+                if keepJobs and worker.job:
+                    self.lPendingJobs.append(worker.job)
+                worker.job = None
+                worker.sStep = "idle"
+                if worker.httpConn and worker.httpConn.Connected():
+                    worker.httpConn.Disconnect()
+        self.lPendingJobs.sort(key=lambda job: job.iSeq)
+        self.lWorkers = []
+
+    # Give next month to a worker, or let it close its connection if there is no more month
+    def dispatchJob(self, worker):
+        worker.job = self.nextMonthJob()
+        worker.iReconnections = 0
+        if worker.job:
+            self.requestData(worker)
+        else:
+            worker.sStep = "idle"
+            if worker.httpConn and worker.httpConn.Connected():
+                worker.httpConn.Disconnect()
+
+    # Ask data for the worker month, on the same connection if website kept it alive
+    def requestData(self, worker):
+        if worker.httpConn and worker.httpConn.Connected():
+            worker.sStep = "getdatadays"
+            worker.fStepStart = time.perf_counter()
+            if worker.job.sKind == "months":
+                Domoticz.Log("Getting monthly history of counter " + worker.job.counter.sCounter)
+                worker.sURL = self.getMonthsData(worker.job.counter.sCounter, worker.httpConn)
+            else:
+                Domoticz.Log("Getting data for year: " + worker.job.sYear + " and month: " + worker.job.sMonth + " of counter " + worker.job.counter.sCounter)
+                # Get data for specific year and month
+                worker.sURL = self.getData(worker.job.counter.sCounter, worker.job.sYear, worker.job.sMonth, worker.httpConn)
+        else:
+            if worker.httpConn and worker.httpConn.Connected():
+                worker.httpConn.Disconnect()
+            worker.httpConn = Domoticz.Connection(Name="HTTPS connection", Transport="TCP/IP", Protocol="HTTPS", Address=API_BASE_URI, Port=BASE_PORT)
+            worker.sStep = "dataconnecting"
+            worker.fStepStart = time.perf_counter()
+            worker.httpConn.Connect()
+
+    # Parse received months in date order, a month is parsed only when all older ones have been
+    def processDataResults(self):
+        while self.iNextJobToParse in self.dResults:
+            Data = self.dResults.pop(self.iNextJobToParse)
+            job = self.dJobs.pop(self.iNextJobToParse)
+            if job.sKind == "months":
+                fStart = time.perf_counter()
+                bParsed = self.exploreDataMonths(Data, job)
+                self.timings.add("parse", fStart)
+                if not bParsed:
+                    return False
+                self.iNextJobToParse = self.iNextJobToParse + 1
+                continue
+            Domoticz.Log("Parsing data for year: " + job.sYear + " and month: " + job.sMonth + " of counter " + job.counter.sCounter)
+            fStart = time.perf_counter()
+            bParsed = self.exploreDataDays(Data, job)
+            self.timings.add("parse", fStart)
+            if not bParsed:
+                return False
+            Domoticz.Log("Got data for year: " + job.sYear + " and month: " + job.sMonth + " of counter " + job.counter.sCounter)
+            job.counter.iMonthsParsed = job.counter.iMonthsParsed + 1
+            self.iNextJobToParse = self.iNextJobToParse + 1
+        return True
+
+    # End of run when all months have been grabbed and parsed
+    def checkDataDone(self):
+        if (self.sConnectionStep == "getdata") and (self.iJobsCount >= len(self.lMonthPlan)) and (not self.lPendingJobs) and (not self.dJobs):
+            self.stopDataWorkers(False)
+            self.sConnectionStep = "idle"
+            self.updateGrabFrom()
+            Domoticz.Log("Done")
+            self.scheduleNextConnection()
+
+    # Stop everything after an error, we will try again later
+    def failDataWorkers(self):
+        self.stopDataWorkers(False)
+        # Next run resumes from the first month not parsed of each counter
+        self.updateGrabFrom()
+        self.sConnectionStep = "idle"
+        self.bHasAFail = True
+        self.scheduleNextConnection()
+
+    # Abandon a run the website stopped answering, next connection is scheduled as after a failure
+    def abandonStalledRun(self):
+        Domoticz.Error("No answer from the website for " + str(RUN_STALL_MINUTES) + " minutes during step " + self.sConnectionStep + ", will try again later")
+        if self.sConnectionStep == "getdata":
+            self.failDataWorkers()
+        else:
+            self.stopDataWorkers(False)
+            self.sConnectionStep = "idle"
+            self.bHasAFail = True
+            self.scheduleNextConnection()
+
+    # Handle the state of a data worker connection
+    def handleDataWorker(self, worker, Data = None):
+        self.logger.debug(worker.sStep)
+        self.dateLastEvent = datetime.now()
+        if worker.fStepStart is not None:
+            self.timings.add(worker.sStep, worker.fStepStart)
+            worker.fStepStart = None
+        sResponse = None
+        if worker.job and worker.sURL:
+            sResponse = self.client.receive(Data, worker.job.sKind, worker.sURL)
+        # Connection opened, we ask for the worker month
+        if worker.sStep == "dataconnecting":
+            if not worker.httpConn.Connected():
+                Domoticz.Error("Login failed with cookies, will try again later")
+                self.failDataWorkers()
+            else:
+                self.requestData(worker)
+
+        # We should have received data, they will be parsed in date order
+        elif worker.sStep == "getdatadays":
+            # Website is throttling requests, the month is asked again after a pause, a page that isn't the login page is throttling too
+            # Connection may have been closed with the response, it is opened again
+            if (sResponse == "throttled") or ((sResponse == "page") and (worker.job.sKind == "days") and (findToken(Data["Data"]) is None)):
+                self.throttleRequests(Data)
+                worker.job.iThrottled = worker.job.iThrottled + 1
+                if worker.job.iThrottled >= MAX_THROTTLED_ATTEMPTS:
+                    Domoticz.Error("Website keeps throttling requests, will try again later")
+                    self.failDataWorkers()
+                else:
+                    self.requestData(worker)
+            elif not worker.httpConn.Connected():
+                Domoticz.Error("Connection failed for data")
+                self.failDataWorkers()
+            # Redirection to another page than the login page, data is not where it is expected
+            elif sResponse == "moved":
+                Domoticz.Error("Data request redirected to " + self.client.sLocation + ", will try again later")
+                self.failDataWorkers()
+            # Website redirects to login page, or sends it back, when session has expired
+            # Monthly history may not be available, only a redirection means that session has expired
+            elif (sResponse == "redirect") or ((sResponse == "page") and (worker.job.sKind == "days")):
+                self.clearSession()
+                if self.bSessionReused:
+                    Domoticz.Log("Saved session has expired, login again...")
+                    self.stopDataWorkers(True)
+                    self.startLogin()
+                else:
+                    Domoticz.Error("Login failed, got login page instead of data, will try again later")
+                    self.failDataWorkers()
+            else:
+                self.logger.dump("Data response", Data)
+                self.limiter.success()
+                self.dResults[worker.job.iSeq] = Data
+                if not self.processDataResults():
+                    self.failDataWorkers()
+                    return
+                # Session is valid, keep it for next run
+                self.saveSession()
+                self.dispatchJob(worker)
+                self.checkDataDone()
 
     # Handle the connection state machine
     def handleConnection(self, Data = None):
         # First and last step
-        self.myDebug(self.sConnectionStep)
-        if self.sConnectionStep == "idle":
-            self.myDebug("Starting connection...")
+        self.logger.debug(self.sConnectionStep)
+        self.dateLastEvent = datetime.now()
+        if self.fStepStart is not None:
+            self.timings.add(self.sConnectionStep, self.fStepStart)
+            self.fStepStart = None
+        sResponse = self.client.receive(Data, "login", API_ENDPOINT_LOGIN)
+        # Website is throttling login, we will try again later
+        if (sResponse == "throttled") and (self.sConnectionStep != "idle"):
+            self.throttleRequests(Data)
+            Domoticz.Error("Website is throttling login, will try again later")
+            self.sConnectionStep = "idle"
+            self.bHasAFail = True
+
+        elif self.sConnectionStep == "idle":
+            self.logger.debug("Starting connection...")
             # Reset failed state
             self.bHasAFail = False
-            if self.httpConn and self.httpConn.Connected():
-                self.httpConn.Disconnect()
-
-            self.httpConn = Domoticz.Connection(Name="HTTPS connection", Transport="TCP/IP", Protocol="HTTPS", Address=LOGIN_BASE_URI, Port=BASE_PORT)
-            self.sConnectionStep = "connecting"
-            self.httpConn.Connect()
+            self.closeConnection()
+            self.stopDataWorkers(False)
+            self.lPendingJobs = []
+            self.dJobs = {}
+            self.dResults = {}
+            self.iJobsCount = 0
+            self.iNextJobToParse = 0
+            self.resetRowsCounters()
+            self.timings.resetRun()
+            if self.bRepairRun:
+                self.lMonthPlan = self.planRepair()
+            else:
+                self.lMonthPlan = self.planMonths()
+
+            # Everything is already in local history, no need to connect
+            if not self.lMonthPlan:
+                Domoticz.Log("Nothing to grab")
+                self.updateGrabFrom()
+            # Saved session is used to get data directly, we will log in only if it has expired
+            elif self.hasValidSession():
+                Domoticz.Log("Using saved session...")
+                self.bSessionReused = True
+                self.startDataWorkers()
+            else:
+                self.startLogin()
 
         # We need to retrieve token
         elif self.sConnectionStep == "connecting":
@@ -389,7 +2225,7 @@ class BasePlugin:
                 self.sConnectionStep = "idle"
                 self.bHasAFail = True
             else:
-                self.myDebug("Getting token...")
+                self.logger.debug("Getting token...")
                 self.sConnectionStep = "tokenconnected"
                 self.getToken()
 
@@ -402,79 +2238,242 @@ class BasePlugin:
             else:
                 Domoticz.Log("Starting login...")
                 self.setToken(Data)
-                self.getCookies(Data)
                 self.sConnectionStep = "logconnected"
                 self.login(self.sUser, self.sPassword)
 
         # Connected, check that the authentication cookie has been received
         elif self.sConnectionStep == "logconnected":
-            self.dumpDictToLog(Data)
-            # Grab cookies from received data, if we have "eZSESSID", we're good
-            self.getCookies(Data)
-            if ("eZSESSID" in self.dCookies) and self.dCookies["eZSESSID"]:
-                # Proceed to data page
-                self.sConnectionStep = "dataconnecting"
-                self.httpConn = Domoticz.Connection(Name="HTTPS connection", Transport="TCP/IP", Protocol="HTTPS", Address=API_BASE_URI, Port=BASE_PORT)
-                self.httpConn.Connect()
+            self.logger.dump("Login response", Data)
+            # Cookies of received data have been saved, if we have "eZSESSID", we're good
+            if self.hasValidSession():
+                # Proceed to data page, on the same connection if possible
+                self.saveSession()
+                self.startDataWorkers()
             else:
                 Domoticz.Error("Login failed, will try again later")
                 self.sConnectionStep = "idle"
                 self.bHasAFail = True
 
-        # If we are connected, we must have the authentication cookie then we ask for daily data
-        elif self.sConnectionStep == "dataconnecting":
-            if not self.httpConn.Connected():
-                Domoticz.Error("Login failed with cookies, will try again later")
-                self.sConnectionStep = "idle"
-                self.bHasAFail = True
+        # Next connection time depends on success
+        if self.sConnectionStep == "idle":
+            self.scheduleNextConnection()
+
+    # Reset counters of days parsed, skipped and written, and of responses received
+    def resetRowsCounters(self):
+        self.iRowsParsed = 0
+        self.iRowsSkipped = 0
+        self.iRowsQueued = 0
+        self.iRowsWritten = 0
+        self.client.resetStats()
+        self.limiter.resetStats()
+
+    # Log timings of this run with percentiles of the last runs, save them and show them in the text device if enabled
+    def reportTimings(self):
+        self.bTimingsPending = False
+        sSummary = self.timings.summary()
+        if not sSummary:
+            return
+        Domoticz.Log("Timings: " + sSummary)
+        if self.historyStore:
+            try:
+                self.historyStore.setState("timings", self.timings.toState())
+            except sqlite3.Error as err:
+                Domoticz.Error("Cannot save timings: " + str(err))
+        if self.bTimingsDevice:
+            if not TIMINGS_DEVICE_UNIT in Devices:
+                Domoticz.Device(Name=self.sDeviceName + " timings", Unit=TIMINGS_DEVICE_UNIT, TypeName="Text", Description="Durations of the steps of the last run in milliseconds", Used=1).Create()
+            if TIMINGS_DEVICE_UNIT in Devices:
+                Devices[TIMINGS_DEVICE_UNIT].Update(nValue=0, sValue=sSummary)
             else:
-                Domoticz.Log("Getting data for year: " + self.sYear + " and month: " + self.sMonth)
-                self.getCookies(Data)
-                self.sConnectionStep = "getdatadays"
-                # Get data for specific year and month
-                self.getData(self.sCounter, self.sYear, self.sMonth)
+                Domoticz.Error("Cannot add Suez timings device to database. Check in settings that Domoticz is set up to accept new devices")
 
-        # We should have received data and we will parse them
-        elif self.sConnectionStep == "getdatadays":
-            if not self.httpConn.Connected():
-                Domoticz.Error("Connection failed for data")
-                self.sConnectionStep = "idle"
-                self.bHasAFail = True
+    # Start export of parsed days if it is enabled
+    def startExporter(self):
+        sFormat = self.dOptions.get("export", "").lower()
+        if not sFormat:
+            return
+        if not sFormat in EXPORT_FILES:
+            Domoticz.Error("Unknown export format " + sFormat + ", use influx or csv")
+            return
+        sTarget = self.dOptions.get("exportto") or EXPORT_FILES[sFormat]
+        if not (sTarget.startswith(("http://", "https://")) or os.path.isabs(sTarget)):
+            sTarget = Parameters["HomeFolder"] + sTarget
+        iBatchRows = self.getIntOption("exportbatch", DEFAULT_EXPORT_BATCH_ROWS, 1, MAX_EXPORT_BATCH_ROWS)
+        iBatchSeconds = self.getIntOption("exportdelay", DEFAULT_EXPORT_DELAY_SECONDS, 1, MAX_EXPORT_DELAY_SECONDS)
+        self.exporter = Exporter(sFormat, sTarget, Parameters["HomeFolder"] + EXPORT_SPOOL_FILES[sFormat], self.dOptions.get("exporttoken"), iBatchRows, iBatchSeconds)
+        Domoticz.Log("Export of days set to " + sFormat + " in " + urllib.parse.urlsplit(sTarget)._replace(query="").geturl() + ", by " + str(iBatchRows) + " days or every " + str(iBatchSeconds) + " s")
+        if os.path.exists(self.exporter.sSpoolPath):
+            Domoticz.Log("Days not exported before last stop will be sent with the next ones")
+        # Days of local history not exported yet, when export has just been enabled for instance
+        if self.historyStore:
+            for counter in self.lCounters:
+                counter.dExportedDays = self.historyStore.getExportedDays(counter.sCounter)
+                lDays = self.historyStore.getUnexportedDays(counter.sCounter)
+                if lDays:
+                    Domoticz.Log(str(len(lDays)) + " days of local history of counter " + counter.sCounter + " are exported")
+                    self.exportDays(counter, lDays)
+
+    # Give (day, usage, total) rows of a counter, oldest first, to the export, they are kept as exported
+    # The spool makes sure they are sent even if the sink is down
+    def exportDays(self, counter, lDays):
+        if not lDays:
+            return
+        self.exporter.add(counter.sCounter, lDays)
+        for sDay, usage, usageTotal in lDays:
+            counter.dExportedDays[sDay] = (usage, usageTotal)
+        if self.historyStore:
+            try:
+                self.historyStore.addExportedDays(counter.sCounter, lDays)
+            except sqlite3.Error as err:
+                Domoticz.Error("Cannot save exported days in local history: " + str(err))
+
+    # Write the first import of counters without written days straight in the Domoticz database, if it is enabled and its schema is known
+    def startBulkImport(self):
+        if not self.getIntOption("bulkimport", 0, 0, 1):
+            return
+        lCounters = [counter for counter in self.lCounters if not counter.dWrittenDays]
+        if not lCounters:
+            Domoticz.Log("Bulk import not needed, every counter has days in its device")
+            return
+        sPath = self.dOptions.get("domoticzdb") or Parameters.get("Database")
+        if not sPath:
+            Domoticz.Error("Bulk import disabled, path of the Domoticz database is unknown (option domoticzdb)")
+            return
+        domoticzDatabase = DomoticzDatabase(sPath)
+        try:
+            domoticzDatabase.checkSchema()
+        except (sqlite3.Error, ValueError) as err:
+            Domoticz.Error("Bulk import disabled, days will be written one by one: " + str(err))
+            return
+        self.domoticzDatabase = domoticzDatabase
+        for counter in lCounters:
+            self.dBulkDays[counter] = []
+        Domoticz.Log("Bulk import set to " + sPath + " (schema version " + str(domoticzDatabase.iVersion) + ") for counters " + ", ".join(counter.sCounter for counter in lCounters))
+
+    # Log what the export thread has done
+    def logExportResults(self):
+        while self.exporter.lResults:
+            iSent, iSpooled, sError = self.exporter.lResults.popleft()
+            if sError:
+                Domoticz.Error("Export failed, " + str(iSpooled) + " days kept to send them again later: " + sError)
             else:
-                Domoticz.Log("Parsing data for year: " + self.sYear + " and month: " + self.sMonth)
-                self.getCookies(Data)
-                self.dumpDictToLog(Data)
-                if not self.exploreDataDays(Data):
-                    self.bHasAFail = True
-                    self.sConnectionStep = "idle"
-                else:
-                    Domoticz.Log("Got data for year: " + self.sYear + " and month: " + self.sMonth)
-                    if self.iDaysLeft > 0:
-                        #self.bFirstMonths = False
-                        self.nextConnection = datetime.now()
-                        self.sConnectionStep = "logconnected"
-                    # We have parsed everything
-                    else:
-                        self.sConnectionStep = "idle"
-                        Domoticz.Log("Done")
+                self.logger.debug("Exported %d days", iSent)
 
-        # Next connection time depends on success
-        if self.sConnectionStep == "idle":
+    # Load statistics of each counter, a counter without statistics starts from the last days of local history, only once
+    def loadAnalytics(self):
+        if not self.bAnalytics:
+            return
+        dStates = self.historyStore.getState("analytics", {}) if self.historyStore else {}
+        for counter in self.lCounters:
+            if counter.sCounter in dStates:
+                counter.stats = ConsumptionStats(dStates[counter.sCounter])
+            counter.stats.setLeakFloor(self.fLeakLiters)
+            if (counter.sCounter not in dStates) and self.historyStore:
+                dateFirst = datetime.now().date() - timedelta(days=ANALYTICS_SEED_DAYS)
+                dDays = self.historyStore.getDays(counter.sCounter, datetimeToSQLDateString(dateFirst), datetimeToSQLDateString(datetime.now().date()))
+                for sDay in sorted(dDays):
+                    counter.stats.addDay(datetime.strptime(sDay, "%Y-%m-%d").toordinal(), dDays[sDay][0])
+                if dDays:
+                    Domoticz.Log("Consumption statistics of counter " + counter.sCounter + " started from " + str(len(dDays)) + " days of local history")
+
+    # Show statistics of counters that got new days in their devices, and save them
+    def publishAnalytics(self):
+        if not self.bAnalytics:
+            return
+        bChanged = False
+        for counter in self.lCounters:
+            stats = counter.stats
+            if not stats.bChanged:
+                continue
+            stats.bChanged = False
+            bChanged = True
+            iUnit = ANALYTICS_FIRST_UNIT + (counter.iIndexUnit - self.iIndexUnit) * ANALYTICS_UNITS_PER_COUNTER
+            if iUnit + ANALYTICS_UNITS_PER_COUNTER > TIMINGS_DEVICE_UNIT:
+                Domoticz.Error("No device unit left for consumption statistics of counter " + counter.sCounter)
+                continue
+            sName = self.sDeviceName + " " + counter.sCounter
+            if self.fLeakLiters is None:
+                iAlertLevel = ALERT_LEVEL_OFF
+                sAlert = "Leak detection off (option leakliters)"
+            elif stats.iFlowDays >= self.iLeakDays:
+                iAlertLevel = ALERT_LEVEL_LEAK
+                sAlert = "Possible leak: consumption above " + str(int(self.fLeakLiters)) + " L for " + str(stats.iFlowDays) + " days, lowest of last " + str(ANALYTICS_SHORT_DAYS) + " days " + str(round(min(stats.lastDays(ANALYTICS_SHORT_DAYS)))) + " L"
+            else:
+                iAlertLevel = ALERT_LEVEL_OK
+                sAlert = "No continuous flow (" + str(stats.iFlowDays) + " days above " + str(int(self.fLeakLiters)) + " L)"
+            if iAlertLevel != stats.iAlertLevel:
+                if iAlertLevel == ALERT_LEVEL_LEAK:
+                    Domoticz.Log("Counter " + counter.sCounter + ": " + sAlert)
+                elif stats.iAlertLevel == ALERT_LEVEL_LEAK:
+                    Domoticz.Log("Counter " + counter.sCounter + ": consumption dropped to " + str(int(self.fLeakLiters)) + " L, leak alert cleared")
+                stats.iAlertLevel = iAlertLevel
+            fDeviation = stats.deviation()
+            for iOffset, sSuffix, sTypeName, dOptions, iValue, sValue in (
+                (0, "mean " + str(ANALYTICS_SHORT_DAYS) + " days", "Custom", {"Custom": "1;L"}, 0, str(round(stats.meanShort(), 1))),
+                (1, "mean " + str(ANALYTICS_LONG_DAYS) + " days", "Custom", {"Custom": "1;L"}, 0, str(round(stats.meanLong(), 1))),
+                (2, "deviation", "Percentage", None, 0, str(round(fDeviation, 1)) if fDeviation is not None else "0"),
+                (3, "leak", "Alert", None, iAlertLevel, sAlert)):
+                if not (iUnit + iOffset) in Devices:
+                    Domoticz.Device(Name=sName + " " + sSuffix, Unit=iUnit + iOffset, TypeName=sTypeName, Options=dOptions, Description="Consumption statistics of counter " + counter.sCounter, Used=1).Create()
+                if (iUnit + iOffset) in Devices:
+                    Devices[iUnit + iOffset].Update(nValue=iValue, sValue=sValue)
+                else:
+                    Domoticz.Error("Cannot add Suez statistics device to database. Check in settings that Domoticz is set up to accept new devices")
+                    break
+            Domoticz.Log("Counter " + counter.sCounter + ": mean " + str(round(stats.meanShort())) + " L over " + str(ANALYTICS_SHORT_DAYS) + " days, " + str(round(stats.meanLong())) + " L over " + str(ANALYTICS_LONG_DAYS) + " days, baseline " + str(round(stats.fBaseline)) + " L")
+        if bChanged and self.historyStore:
+            try:
+                self.historyStore.setState("analytics", {counter.sCounter: counter.stats.toState() for counter in self.lCounters})
+            except sqlite3.Error as err:
+                Domoticz.Error("Cannot save consumption statistics: " + str(err))
+
+    # Program next connection at the end of a run, sooner if it failed
+    def scheduleNextConnection(self):
+        self.closeConnection()
+        if self.dBulkDays:
+            self.bulkImport()
+            # First import is over once a run has succeeded, next days are written in the devices
+            if not self.bHasAFail:
+                self.dBulkDays = {}
+        for counter in self.lCounters:
+            if counter.iMonthsPlanned:
+                Domoticz.Log("Counter " + counter.sCounter + ": " + str(counter.iMonthsParsed) + " of " + str(counter.iMonthsPlanned) + " months parsed")
+        Domoticz.Log("Days parsed: " + str(self.iRowsParsed) + ", skipped (unchanged): " + str(self.iRowsSkipped) + ", queued for writing: " + str(self.iRowsQueued) + ", write queue depth: " + str(len(self.lWriteQueue)))
+        if self.limiter.iMade:
+            Domoticz.Log("Requests: " + str(self.limiter.iMade) + " made, " + str(self.limiter.iDelayed) + " delayed by rate limit, " + str(self.limiter.iRejected) + " rejected by the website")
+        if self.client.iResponses:
+            Domoticz.Log("Responses: " + str(self.client.iResponses) + ", bytes processed: " + str(self.client.iResponseBytes) + " (" + str(self.client.iResponseBytes // self.client.iResponses) + " per response, largest " + str(self.client.iLargestResponse) + "), bytes on the wire: " + str(self.client.iWireBytes) + ", revalidated: " + str(self.client.iRevalidated))
+            for sURL, iWireBytes, iBytes, sEncoding in self.client.lTransfers:
+                self.logger.debug("%s: %d bytes on the wire, %d processed (%s)", sURL, iWireBytes, iBytes, sEncoding)
+        self.publishAnalytics()
+        # Timings include days writing, they are reported once the queue is empty
+        self.bTimingsPending = True
+        if not self.lWriteQueue:
+            self.reportTimings()
+        # Repair run doesn't change next connection
+        if self.bRepairRun:
+            self.bRepairRun = False
             if self.bHasAFail:
-                self.setNextConnection(False)
-            Domoticz.Log("Next connection: " + datetimeToSQLDateTimeString(self.nextConnection))
+                Domoticz.Log("Gap repair failed, missing days will be looked for again after next run")
+            else:
+                self.reportGapRepair()
+            return
+        self.setNextConnection(self.bHasAFail)
+        if not self.bHasAFail:
+            self.planGapRepair()
 
     def onStart(self):
-        Domoticz.Heartbeat(20)
-        self.myDebug("onStart called")
+        Domoticz.Heartbeat(HEARTBEAT_IDLE)
+        self.iHeartbeat = HEARTBEAT_IDLE
+        self.logger.debug("onStart called")
         
         self.sUser = Parameters["Username"]
         self.sPassword = Parameters["Password"]
+        # Several counters can be set, separated by commas
         try:
-            self.sCounter = Parameters["Mode6"]
+            lCounterIds = parseCounterIds(Parameters["Mode6"])
         except:
-            self.sConnectionStep = "idle"
-            self.bHasAFail = True
+            lCounterIds = []
         # History for short log is 1000 days max (default to 365)
         try:
             self.iHistoryDaysForDaysView = int(Parameters["Mode1"])
@@ -484,6 +2483,35 @@ class BasePlugin:
             self.iHistoryDaysForDaysView = 30
         elif self.iHistoryDaysForDaysView > 1000:
             self.iHistoryDaysForDaysView = 1000
+        # Number of months grabbed at the same time (default to 2)
+        try:
+            self.iParallelRequests = int(Parameters["Mode2"])
+        except:
+            self.iParallelRequests = DEFAULT_PARALLEL_REQUESTS
+        if self.iParallelRequests < 1:
+            self.iParallelRequests = 1
+        elif self.iParallelRequests > MAX_PARALLEL_REQUESTS:
+            self.iParallelRequests = MAX_PARALLEL_REQUESTS
+
+        # Advanced options
+        try:
+            self.dOptions = parseOptions(Parameters["Mode5"])
+        except:
+            self.dOptions = {}
+        self.iMonthlyYears = self.getIntOption("years", 0, 0, MAX_MONTHLY_YEARS)
+        self.iRequestsPerMinute = self.getIntOption("rate", DEFAULT_REQUESTS_PER_MINUTE, 1, MAX_REQUESTS_PER_MINUTE)
+        self.iRequestsBurst = self.getIntOption("burst", DEFAULT_REQUESTS_BURST, 1, MAX_REQUESTS_BURST)
+        self.bCompress = self.getIntOption("compress", 0, 0, 1) > 0
+        self.bAnalytics = self.getIntOption("analytics", 0, 0, 1) > 0
+        self.iLeakDays = self.getIntOption("leakdays", DEFAULT_LEAK_DAYS, 1, MAX_LEAK_DAYS)
+        iLeakLiters = self.getIntOption("leakliters", None, 0, MAX_LEAK_LITERS)
+        self.fLeakLiters = float(iLeakLiters) if iLeakLiters is not None else None
+
+        # Timings device (default to no)
+        try:
+            self.bTimingsDevice = int(Parameters["Mode4"]) > 0
+        except:
+            self.bTimingsDevice = False
 
         # enable debug if required
         try:
@@ -492,28 +2520,72 @@ class BasePlugin:
             self.iDebugLevel = 0
 
         if self.iDebugLevel > 1:
-            Domoticz.Debugging(1)
+            Domoticz.Debugging(DOMOTICZ_DEBUG_PYTHON)
 
         Domoticz.Log("Username set to " + self.sUser)
-        Domoticz.Log("Counter ID set to " + self.sCounter)
+        Domoticz.Log("Counter ID set to " + ", ".join(lCounterIds))
         if Parameters["Password"]:
             Domoticz.Log("Password is set")
         else:
             Domoticz.Log("Password is not set")
         Domoticz.Log("Days to grab for daily view set to " + str(self.iHistoryDaysForDaysView))
+        Domoticz.Log("Simultaneous requests for history set to " + str(self.iParallelRequests))
+        Domoticz.Log("Timings device set to " + str(self.bTimingsDevice))
+        Domoticz.Log("Advanced options set to " + (redactSecrets(dictToQuotedString(self.dOptions)) if self.dOptions else "none"))
+        Domoticz.Log("Years of monthly history to import set to " + str(self.iMonthlyYears))
+        Domoticz.Log("Requests to the website set to " + str(self.iRequestsPerMinute) + " per minute, " + str(self.iRequestsBurst) + " at once")
+        Domoticz.Log("Compressed mode set to " + str(self.bCompress))
+        if self.fLeakLiters is None:
+            Domoticz.Log("Consumption statistics set to " + str(self.bAnalytics) + ", leak detection off")
+        else:
+            Domoticz.Log("Consumption statistics set to " + str(self.bAnalytics) + ", possible leak after " + str(self.iLeakDays) + " days above " + str(int(self.fLeakLiters)) + " liters")
         Domoticz.Log("Debug set to " + str(self.iDebugLevel))
 
         # most init
         self.__init__()
 
-        if self.createDevice():
-            self.nextConnection = datetime.now()
-        else:
-            self.setNextConnection(False)
+        # Open local history, the plugin still works without it but grabs everything after each restart
+        try:
+            self.historyStore = HistoryStore(Parameters["HomeFolder"] + HISTORY_DB_NAME)
+        except sqlite3.Error as err:
+            Domoticz.Error("Cannot open local history, all days will be grabbed again: " + str(err))
+            self.historyStore = None
+        self.loadSession()
+        if self.historyStore:
+            self.timings = Timings(self.historyStore.getState("timings", {}))
+            self.scheduler = Scheduler(self.historyStore.getState("scheduler", {}))
+            self.dMonthlyImport = self.historyStore.getState("monthlyImport", {})
+            self.dRepairAttempts = self.historyStore.getState("gapRepair", {})
+
+        if not lCounterIds:
+            Domoticz.Error("Counter ID is not set")
+            return
 
-        self.sEndYear = str(datetime.now().year)
-        self.sEndMonth = str(datetime.now().month)
-        self.iDaysLeft = self.iHistoryDaysForDaysView
+        self.lCounters = self.assignUnits(lCounterIds)
+        self.nextConnection = datetime.now()
+        bDeviceFailed = False
+        for counter in self.lCounters:
+            Domoticz.Log("Counter " + counter.sCounter + " uses device unit " + str(counter.iIndexUnit))
+            if self.historyStore:
+                counter.dWrittenDays = self.historyStore.getWrittenDays(counter.sCounter)
+                counter.dateLastDay = self.historyStore.getLastDay(counter.sCounter)
+            if not self.createDevice(counter):
+                bDeviceFailed = True
+        self.startBulkImport()
+        # Days grabbed but not written before last stop are written first
+        if self.historyStore:
+            for counter in self.lCounters:
+                for sDay, usage, usageTotal in self.historyStore.getUnwrittenDays(counter.sCounter):
+                    self.queueWrite(counter, sDay, usage, usageTotal)
+            self.bulkImport()
+        # First run grabs the whole history for daily view until yesterday, unless a previous run has already grabbed a part of it
+        self.loadCheckpoint()
+        self.loadAnalytics()
+        self.startExporter()
+        if self.lWriteQueue:
+            Domoticz.Log(str(len(self.lWriteQueue)) + " days grabbed before last stop are waiting to be written")
+        if bDeviceFailed:
+            self.setNextConnection(True)
 
         # Now we can enabling the plugin
         self.isStarted = True
@@ -522,47 +2594,90 @@ class BasePlugin:
         Domoticz.Debug("onStop called")
         # prevent error messages during disabling plugin
         self.isStarted = False
+        self.stopDataWorkers(False)
+        self.closeConnection()
+        # Write everything still queued before leaving
+        self.bulkImport()
+        self.drainWriteQueue(None, None)
+        if self.exporter:
+            self.exporter.stop()
+            self.logExportResults()
+            self.exporter = None
+        if self.historyStore:
+            self.historyStore.close()
+            self.historyStore = None
+
+    # Find the data worker using a connection
+    def findDataWorker(self, Connection):
+        if self.lWorkers:
+            for worker in self.lWorkers:
+                if Connection == worker.httpConn:
+                    return worker
+        return None
 
     def onConnect(self, Connection, Status, Description):
         Domoticz.Debug("onConnect called")
-        if self.isStarted and (Connection == self.httpConn):
-            self.handleConnection()
+        if self.isStarted:
+            if Connection == self.httpConn:
+                self.handleConnection()
+            else:
+                worker = self.findDataWorker(Connection)
+                if worker:
+                    self.handleDataWorker(worker)
 
     def onMessage(self, Connection, Data):
         Domoticz.Debug("onMessage called")
 
         # if started and not stopping
-        if self.isStarted and (Connection == self.httpConn):
-            self.handleConnection(Data)
+        if self.isStarted:
+            if Connection == self.httpConn:
+                self.handleConnection(Data)
+            else:
+                worker = self.findDataWorker(Connection)
+                if worker:
+                    self.handleDataWorker(worker, Data)
 
     def onDisconnect(self, Connection):
         Domoticz.Debug("onDisconnect called")
+        if not self.isStarted:
+            return
+        # Website closed connection while we were waiting for data, ask again on a new connection
+        worker = self.findDataWorker(Connection)
+        if worker and worker.job and (worker.sStep == "getdatadays"):
+            if worker.iReconnections < MAX_DATA_RECONNECTIONS:
+                worker.iReconnections = worker.iReconnections + 1
+                self.logger.debug("Connection closed by website, reconnecting")
+                self.requestData(worker)
+            else:
+                Domoticz.Error("Connection closed by website too many times for year: " + worker.job.sYear + " and month: " + worker.job.sMonth)
+                self.failDataWorkers()
 
     def onHeartbeat(self):
         Domoticz.Debug("onHeartbeat() called")
-        if datetime.now() > self.nextConnection:
-            # We immediatly program next connection for tomorrow, if there is a problem, we will reprogram it sooner
-            self.setNextConnection(True)
-            self.calculateMonthData()
+        self.drainWriteQueue(WRITE_QUEUE_ROWS_PER_TICK, WRITE_QUEUE_MS_PER_TICK)
+        if self.exporter:
+            self.exporter.tick()
+            self.logExportResults()
+        if not self.isStarted:
+            return
+        # A run the website stopped answering is abandoned, it would block next runs
+        if (self.sConnectionStep != "idle") and (datetime.now() - self.dateLastEvent > timedelta(minutes=RUN_STALL_MINUTES)):
+            self.abandonStalledRun()
+        # Daily grab waits for the end of the run in progress, repair run included
+        if (datetime.now() > self.nextConnection) and (self.sConnectionStep == "idle"):
+            # We immediatly program next connection for tomorrow, it is programmed again at the end of the run
+            self.nextConnection = self.scheduler.dailyConnection(datetime.now().date() + timedelta(days=1))
+            self.lRepairMonths = []
+            self.bRepairRun = False
             self.handleConnection()
-
-    def dumpDictToLog(self, dictToLog):
-        if self.iDebugLevel > 1:
-            if isinstance(dictToLog, dict):
-                self.myDebug("Dict details ("+str(len(dictToLog))+"):")
-                for x in dictToLog:
-                    if isinstance(dictToLog[x], dict):
-                        self.myDebug("--->'"+x+" ("+str(len(dictToLog[x]))+"):")
-                        for y in dictToLog[x]:
-                            if isinstance(dictToLog[x][y], dict):
-                                for z in dictToLog[x][y]:
-                                    self.myDebug("----------->'" + z + "':'" + str(dictToLog[x][y][z]) + "'")
-                            else:
-                                self.myDebug("------->'" + y + "':'" + str(dictToLog[x][y]) + "'")
-                    else:
-                        self.myDebug("--->'" + x + "':'" + str(dictToLog[x]) + "'")
+        # Months with missing days are grabbed again at low priority: when everything is written, and not just before next connection
+        elif self.lRepairMonths and (self.sConnectionStep == "idle") and (not self.lWriteQueue) and (datetime.now() > self.dateRepairAt):
+            if self.nextConnection - datetime.now() > timedelta(minutes=GAP_REPAIR_MARGIN_MINUTES):
+                self.bRepairRun = True
+                self.handleConnection()
             else:
-                self.myDebug("Received no dict: " + str(dictToLog))
+                Domoticz.Log("Next connection is too close, missing days will be looked for again after it")
+                self.lRepairMonths = []
 
 global _plugin
 _plugin = BasePlugin()
@@ -620,20 +2735,285 @@ def dictToQuotedString(dParams):
             result += sKey
     return result
 
+# Login form posted to the website
+def loginPayload(sUser, sPassword, sToken):
+    payload = {
+        '_username': sUser,
+        '_password': sPassword,
+        '_csrf_token': sToken,
+        'signin[username]': sUser,
+        'signin[password]' : None,
+        'tsme_user_login[_username]': sUser,
+        'tsme_user_login[_password]': sPassword
+    }
+    return dictToQuotedString(payload)
+
+# CSRF token of the login page, searched in raw bytes, None if not found
+def findToken(body):
+    match = TOKEN_PATTERN.search(body)
+    if match:
+        return match.group(1).decode()
+    return None
+
+# True if a month is over and iRows days have been received for it, it won't change anymore on the website
+def isMonthComplete(iYear, iMonth, iRows):
+    iDaysInMonth = calendar.monthrange(iYear, iMonth)[1]
+    return (iRows >= iDaysInMonth) and (date(iYear, iMonth, iDaysInMonth) < datetime.now().date())
+
 def DumpConfigToLog():
-    for x in Parameters:
-        if Parameters[x] != "":
-            self.myDebug( "'" + x + "':'" + str(Parameters[x]) + "'")
-    self.myDebug("Device count: " + str(len(Devices)))
+    _plugin.logger.dump("Parameters", Parameters)
+    _plugin.logger.debug("Device count: %d", len(Devices))
     for x in Devices:
-        self.myDebug("Device:           " + str(x) + " - " + str(Devices[x]))
-        self.myDebug("Device ID:       '" + str(Devices[x].ID) + "'")
-        self.myDebug("Device Name:     '" + Devices[x].Name + "'")
-        self.myDebug("Device iValue:    " + str(Devices[x].iValue))
-        self.myDebug("Device sValue:   '" + Devices[x].sValue + "'")
-        self.myDebug("Device LastLevel: " + str(Devices[x].LastLevel))
+        _plugin.logger.debug("Device:           %s - %s", x, Devices[x])
+        _plugin.logger.debug("Device ID:       '%s'", Devices[x].ID)
+        _plugin.logger.debug("Device Name:     '%s'", Devices[x].Name)
+        _plugin.logger.debug("Device iValue:    %s", Devices[x].iValue)
+        _plugin.logger.debug("Device sValue:   '%s'", Devices[x].sValue)
+        _plugin.logger.debug("Device LastLevel: %s", Devices[x].LastLevel)
     return
 
+# Split counter IDs separated by commas, semicolons or spaces, duplicates are removed
+def parseCounterIds(sCounterIds):
+    lCounterIds = []
+    for sCounter in re.split("[,;\\s]+", sCounterIds.strip()):
+        if sCounter and (sCounter not in lCounterIds):
+            lCounterIds.append(sCounter)
+    return lCounterIds
+
+# Build the ordered list of months to grab between two dates included, from the oldest to the most recent one
+# Each month is a (year, month, first day, last day) tuple, days being limited to the given dates
+def buildMonthPlan(dateFirst, dateLast):
+    lPlan = []
+    iYear = dateFirst.year
+    iMonth = dateFirst.month
+    while (iYear, iMonth) <= (dateLast.year, dateLast.month):
+        dateMonthFirst = max(date(iYear, iMonth, 1), dateFirst)
+        dateMonthLast = min(date(iYear, iMonth, calendar.monthrange(iYear, iMonth)[1]), dateLast)
+        lPlan.append((iYear, iMonth, dateMonthFirst, dateMonthLast))
+        iMonth = iMonth + 1
+        if iMonth > 12:
+            iMonth = 1
+            iYear = iYear + 1
+    return lPlan
+
+# "YYYY-MM to YYYY-MM" ranges of a sorted list of (year, month), separated by commas
+def monthRangesToString(lMonths):
+    lRanges = []
+    for iYear, iMonth in lMonths:
+        sMonth = "%04d-%02d" % (iYear, iMonth)
+        if lRanges and (lRanges[-1][2] == iYear * 12 + iMonth - 1):
+            lRanges[-1] = (lRanges[-1][0], sMonth, iYear * 12 + iMonth)
+        else:
+            lRanges.append((sMonth, sMonth, iYear * 12 + iMonth))
+    return ", ".join(sFirst if sFirst == sLast else sFirst + " to " + sLast for sFirst, sLast, iLast in lRanges)
+
+# Minutes since midnight of a datetime
+def minuteOfDay(dateTime):
+    return dateTime.hour * 60 + dateTime.minute
+
+# "HH:MM" string of minutes since midnight
+def minuteToString(iMinute):
+    return "%02d:%02d" % (iMinute // 60, iMinute % 60)
+
+# Percentile (nearest rank) of a list of values, 0 if empty
+def percentile(lValues, fPercent):
+    if not lValues:
+        return 0.0
+    lSorted = sorted(lValues)
+    iRank = max(int(round(fPercent / 100.0 * len(lSorted) + 0.5)) - 1, 0)
+    return lSorted[min(iRank, len(lSorted) - 1)]
+
+# Default path of a cookie set by a response to a request of sPath (RFC 6265 5.1.4)
+def defaultCookiePath(sPath):
+    if (not sPath.startswith("/")) or (sPath.count("/") == 1):
+        return "/"
+    return sPath[:sPath.rindex("/")]
+
+# True if a cookie of sDomain is sent to sHost
+def domainMatch(sHost, sDomain):
+    return (sHost == sDomain) or sHost.endswith("." + sDomain)
+
+# True if a cookie of sCookiePath is sent with a request of sPath
+def pathMatch(sPath, sCookiePath):
+    if sPath == sCookiePath:
+        return True
+    return sPath.startswith(sCookiePath) and (sCookiePath.endswith("/") or (sPath[len(sCookiePath)] == "/"))
+
+# Get expiry timestamp of a Set-Cookie line, None for a session cookie
+def cookieExpiry(sCookiesLine):
+    for sAttribute in sCookiesLine.split(";")[1:]:
+        sName, _, sValue = sAttribute.strip().partition("=")
+        sName = sName.lower()
+        try:
+            # Max-Age has precedence over Expires
+            if sName == "max-age":
+                return time.time() + int(sValue)
+        except ValueError:
+            pass
+    for sAttribute in sCookiesLine.split(";")[1:]:
+        sName, _, sValue = sAttribute.strip().partition("=")
+        if sName.lower() == "expires":
+            try:
+                return parsedate_to_datetime(sValue).timestamp()
+            except (TypeError, ValueError, IndexError):
+                return None
+    return None
+
+# Pause asked by a throttling response in its Retry-After header (seconds or HTTP date), None if not given
+def retryAfter(Data):
+    sRetryAfter = Data.get("Headers", {}).get("Retry-After")
+    if not sRetryAfter:
+        return None
+    try:
+        return max(0.0, float(sRetryAfter))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(sRetryAfter).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+# Line of a day in export format: InfluxDB line protocol with a nanosecond timestamp at local midnight, or CSV
+def exportLine(sFormat, sCounter, sDay, fUsage, fTotal):
+    if sFormat == "csv":
+        return sCounter + "," + sDay + "," + repr(fUsage) + "," + repr(fTotal)
+    iTimestamp = int(time.mktime(datetime.strptime(sDay, "%Y-%m-%d").timetuple())) * 1000000000
+    return EXPORT_MEASUREMENT + ",counter=" + re.sub(r"([ ,=])", r"\\\1", sCounter) + " usage=" + repr(fUsage) + ",total=" + repr(fTotal) + " " + str(iTimestamp)
+
+# Replace passwords, CSRF token and session cookies of a text by "***"
+def redactSecrets(sText):
+    for pattern in SECRET_PATTERNS:
+        sText = pattern.sub("\\1***", sText)
+    return sText
+
+# Text of a value dumped in the log: dicts and lists as Python literals, bytes decoded as text
+def dumpToString(value):
+    if isinstance(value, dict):
+        return "{" + ", ".join(repr(key) + ": " + dumpToString(item) for key, item in value.items()) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(dumpToString(item) for item in value) + "]"
+    if isinstance(value, (bytes, bytearray)):
+        return repr(bytes(value).decode("utf-8", "replace"))
+    return repr(value)
+
+# Value of a response header whatever its case, None if not found
+def headerValue(Data, sName):
+    dHeaders = Data.get("Headers") or {}
+    if sName in dHeaders:
+        return dHeaders[sName]
+    sName = sName.lower()
+    for sKey, value in dHeaders.items():
+        if sKey.lower() == sName:
+            return value
+    return None
+
+# Body of a gzip or deflate response, kept as is if it is not compressed (already decompressed by Domoticz for instance)
+def decompressBody(body, sEncoding):
+    try:
+        if sEncoding == "gzip":
+            return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # Raw deflate, without zlib header
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    except zlib.error:
+        return body
+
+# True if the website redirects the request
+def isRedirect(Data):
+    return bool(Data) and ("Status" in Data) and (str(Data["Status"]) in ("301", "302", "303", "307", "308"))
+
+# Month names used by the website in monthly history labels ("janv. 2019", "Février 2019"...), by their first 3 letters
+FRENCH_MONTHS = {"jan": 1, "fév": 2, "fev": 2, "mar": 3, "avr": 4, "mai": 5, "jui": 6, "jul": 7, "aoû": 8, "aou": 8, "sep": 9, "oct": 10, "nov": 11, "déc": 12, "dec": 12}
+
+# Year and month of a monthly history key or label: "201902", "2019-02", "02/2019" or "févr. 2019", None if not understood
+def parseMonthKey(value):
+    sValue = str(value).strip().lower()
+    match = MONTH_KEY_PATTERN.fullmatch(sValue)
+    if match:
+        iYear, iMonth = int(match.group(1)), int(match.group(2))
+    else:
+        match = MONTH_SLASH_PATTERN.fullmatch(sValue)
+        if match:
+            iYear, iMonth = int(match.group(2)), int(match.group(1))
+        else:
+            match = MONTH_LABEL_PATTERN.fullmatch(sValue)
+            if not match:
+                return None
+            sName = match.group(1)[:3]
+            # "juin" and "juillet" share their first 3 letters
+            if sName == "jui":
+                sName = "jul" if match.group(1).startswith("juil") else "jui"
+            if sName not in FRENCH_MONTHS:
+                return None
+            iYear, iMonth = int(match.group(2)), FRENCH_MONTHS[sName]
+    if not 1 <= iMonth <= 12:
+        return None
+    return iYear, iMonth
+
+# Parse monthly history rows ([label, usage in m3, index in m3, key] as sent by the website, index and key may be missing)
+# Returns (year, month, usage in liters, index in liters or 0) tuples and the number of rows not understood
+def parseStatMData(lRows):
+    lMonths = []
+    iRejected = 0
+    if not isinstance(lRows, list):
+        return lMonths, 1
+    for row in lRows:
+        try:
+            month = None
+            if len(row) > 3:
+                month = parseMonthKey(row[3])
+            if month is None:
+                month = parseMonthKey(row[0])
+            fUsage = float(row[1]) * 1000.0
+            fTotal = float(row[2]) * 1000.0 if (len(row) > 2) and (row[2] not in (None, "")) else 0.0
+        except (TypeError, ValueError, IndexError, KeyError):
+            month = None
+        if month is None:
+            iRejected = iRejected + 1
+        else:
+            lMonths.append((month[0], month[1], fUsage, fTotal))
+    return lMonths, iRejected
+
+# Advanced options from a "key=value; key=value" string, keys in lower case
+def parseOptions(sOptions):
+    dOptions = {}
+    for sOption in (sOptions or "").split(";"):
+        sKey, sSep, sValue = sOption.partition("=")
+        if sKey.strip():
+            dOptions[sKey.strip().lower()] = sValue.strip()
+    return dOptions
+
+# Parse statJData rows ([day as "dd/mm/YYYY", usage in m3, index in m3]) into compact columns, in the order received:
+# day ordinals, usage and index in liters. Raise ValueError if data don't have the expected shape
+def parseStatJData(lRows):
+    if not isinstance(lRows, list):
+        raise ValueError("rows are not a list")
+    aOrdinals = array("l")
+    aUsages = array("d")
+    aTotals = array("d")
+    try:
+        for row in lRows:
+            aOrdinals.append(suezDateToOrdinal(row[0]))
+            aUsages.append(float(row[1]) * 1000.0)
+            aTotals.append(float(row[2]) * 1000.0)
+    except (IndexError, KeyError, TypeError, ValueError) as err:
+        raise ValueError("unexpected row " + repr(row)[:50] + " (" + str(err) + ")")
+    return aOrdinals, aUsages, aTotals
+
+# Convert Suez date string ("dd/mm/YYYY") to day ordinal, without going through strptime
+@lru_cache(maxsize=4096)
+def suezDateToOrdinal(sDate):
+    if (len(sDate) != 10) or (sDate[2] != "/") or (sDate[5] != "/"):
+        raise ValueError("unexpected date format " + sDate)
+    return date(int(sDate[6:10]), int(sDate[3:5]), int(sDate[0:2])).toordinal()
+
+# Convert day ordinal to Domoticz date string
+@lru_cache(maxsize=4096)
+def ordinalToSQLDateString(iOrdinal):
+    return date.fromordinal(iOrdinal).isoformat()
+
 # Convert Suez date string to datetime object
 def suezDateToDatetime(datetimeStr):
     return datetime(*(time.strptime(datetimeStr, "%d/%m/%Y")[0:6]))
@@ -0,0 +1,378 @@
+#           Suez Plugin (toutsurmoneau)
+#
+#           Headless backfill of many accounts, outside of Domoticz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Grabs daily history of several accounts and counters at the same time on an asyncio event
+# loop, with the login, requests and parsing of plugin.py, and saves it in the local history
+# of the plugin (suez_history.db) or in a CSV file. Once the local history is in the plugin
+# folder, the plugin writes these days in its devices without grabbing them again.
+#
+#   python suezBackfill.py --accounts accounts.json [--days 1000] [--parallel 2] [--per-host 4] [--rate 60] [--burst 5] [--compress] [--store suez_history.db | --csv days.csv]
+#   python suezBackfill.py --user me@example.com --password secret --counter 123456789 --store suez_history.db
+#
+# accounts.json is a list of {"user": ..., "password": ..., "counters": [...], "store": local history of this account (optional)}
+#
+import argparse
+import asyncio
+import csv
+import json
+import sqlite3
+import ssl
+import sys
+import time
+from datetime import datetime
+from datetime import timedelta
+
+import plugin
+
+# Number of times a month is asked again when the website closes the connection or the session expires
+MAX_MONTH_ATTEMPTS = 3
+# Errors of a request: connection failed or closed, or response not understood (bad chunk size or Content-Length, header line too long)
+REQUEST_ERRORS = (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError)
+
+# Keep-alive HTTP/1.1 connection to the website on the asyncio event loop
+# Responses are given as Domoticz does: {"Status": "200", "Headers": {...}, "Data": bytes}, Set-Cookie as a list
+class AsyncConnection:
+    # string: host to connect to
+    sHost = None
+    # integer: port
+    iPort = None
+    # object: ssl context, None for plain HTTP
+    sslContext = None
+    # objects: asyncio streams, None when not connected
+    reader = None
+    writer = None
+
+    def __init__(self, sHost, iPort, sslContext):
+        self.sHost = sHost
+        self.iPort = iPort
+        self.sslContext = sslContext
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.sHost, self.iPort, ssl=self.sslContext)
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+    # Send a message built by plugin.HttpClient.request(), connection is opened again if the website closed it
+    async def send(self, sendData):
+        for iAttempt in range(2):
+            if not self.writer:
+                await self.connect()
+            try:
+                return await self.exchange(sendData)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                if iAttempt:
+                    raise
+
+    async def exchange(self, sendData):
+        body = sendData.get("Data")
+        if isinstance(body, str):
+            body = body.encode()
+        lLines = [sendData["Verb"] + " " + sendData["URL"] + " HTTP/1.1"]
+        for sKey, sValue in sendData["Headers"].items():
+            lLines.append(sKey + ": " + sValue)
+        if body is not None:
+            lLines.append("Content-Length: " + str(len(body)))
+        self.writer.write(("\r\n".join(lLines) + "\r\n\r\n").encode("latin-1") + (body or b""))
+        await self.writer.drain()
+
+        lStatus = (await self.reader.readuntil(b"\r\n")).decode("latin-1").split(" ", 2)
+        if len(lStatus) < 2:
+            raise ConnectionError("Bad status line")
+        dHeaders = {}
+        lCookies = []
+        while True:
+            sLine = (await self.reader.readuntil(b"\r\n")).decode("latin-1").rstrip("\r\n")
+            if not sLine:
+                break
+            sKey, _, sValue = sLine.partition(":")
+            if sKey.lower() == "set-cookie":
+                lCookies.append(sValue.strip())
+            else:
+                dHeaders[sKey.strip()] = sValue.strip()
+        dLowerHeaders = {sKey.lower(): sValue for sKey, sValue in dHeaders.items()}
+        if dLowerHeaders.get("transfer-encoding", "").lower() == "chunked":
+            data = b""
+            while True:
+                iSize = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if iSize == 0:
+                    # Trailers until empty line
+                    while (await self.reader.readuntil(b"\r\n")) != b"\r\n":
+                        pass
+                    break
+                data = data + await self.reader.readexactly(iSize)
+                await self.reader.readexactly(2)
+        elif "content-length" in dLowerHeaders:
+            data = await self.reader.readexactly(int(dLowerHeaders["content-length"]))
+        else:
+            data = await self.reader.read()
+            self.close()
+        if dLowerHeaders.get("connection", "").lower() == "close":
+            self.close()
+        if lCookies:
+            dHeaders["Set-Cookie"] = lCookies
+        return {"Status": lStatus[1], "Headers": dHeaders, "Data": data}
+
+# Backfill of the counters of an account, months are grabbed at the same time on a few connections sharing the session
+class AccountBackfill:
+    # dict: account from accounts file
+    dAccount = None
+    # object: command line arguments
+    args = None
+    # object: requests, cookies and responses of plugin.py
+    client = None
+    # object: local history where days are saved, None if they are written in CSV
+    historyStore = None
+    # object: CSV writer, None if days are saved in local history
+    csvWriter = None
+    # object: semaphore shared by every account grabbing from the same host
+    hostLimiter = None
+    # object: semaphore limiting requests of this account
+    accountLimiter = None
+    # object: plugin.RateLimiter shared by every account, spacing requests to the website
+    rateLimiter = None
+    # list: idle connections
+    lConnections = None
+    # object: lock so that only one login is done when the session expires
+    loginLock = None
+    # integer: login counter, to know if another task already logged in again
+    iLogins = None
+    # dict: statistics of the account
+    dStats = None
+
+    def __init__(self, dAccount, args, hostLimiter, rateLimiter, historyStore, csvWriter):
+        self.dAccount = dAccount
+        self.args = args
+        self.client = plugin.HttpClient(args.compress)
+        self.historyStore = historyStore
+        self.csvWriter = csvWriter
+        self.hostLimiter = hostLimiter
+        self.accountLimiter = asyncio.Semaphore(args.parallel)
+        self.rateLimiter = rateLimiter
+        self.lConnections = []
+        self.loginLock = asyncio.Lock()
+        self.iLogins = 0
+        self.dStats = {"months": 0, "skipped": 0, "days": 0, "requests": 0, "throttled": 0, "errors": 0}
+
+    def log(self, sMessage):
+        if not self.args.quiet:
+            print(self.dAccount["user"] + ": " + sMessage)
+
+    def newConnection(self):
+        if self.lConnections:
+            return self.lConnections.pop()
+        return AsyncConnection(self.args.host, self.args.port, self.args.sslContext)
+
+    # Send a request to an endpoint on an idle connection, returns the response and what it is (see plugin.HttpClient.receive())
+    async def send(self, sEndpoint, sVerb, sURL, data=None):
+        fDelay = self.rateLimiter.reserve(time.monotonic())
+        if fDelay > 0.0:
+            await asyncio.sleep(fDelay)
+        async with self.hostLimiter:
+            connection = self.newConnection()
+            try:
+                Data = await connection.send(self.client.request(sEndpoint, sVerb, sURL, data))
+            except Exception:
+                connection.close()
+                raise
+            self.lConnections.append(connection)
+        self.dStats["requests"] = self.dStats["requests"] + 1
+        sResponse = self.client.receive(Data, sEndpoint, sURL)
+        # Every account waits when the website throttles one of them
+        if sResponse == "throttled":
+            self.dStats["throttled"] = self.dStats["throttled"] + 1
+            self.rateLimiter.throttle(time.monotonic(), plugin.retryAfter(Data))
+        return Data, sResponse
+
+    # Log in if iLogin is still the last login, another task may already have done it
+    async def login(self, iLogin):
+        async with self.loginLock:
+            if iLogin != self.iLogins:
+                return
+            self.client.jar.remove("eZSESSID")
+            Data, sResponse = await self.send("login", "GET", plugin.API_ENDPOINT_LOGIN)
+            sToken = plugin.findToken(Data["Data"]) if Data and Data["Data"] else None
+            if sToken is None:
+                raise RuntimeError("no token in login page")
+            await self.send("login", "POST", plugin.API_ENDPOINT_LOGIN, plugin.loginPayload(self.dAccount["user"], self.dAccount["password"], sToken))
+            if self.client.jar.find("eZSESSID", plugin.API_BASE_URI, plugin.API_ENDPOINT_DATA + "/") is None:
+                raise RuntimeError("login failed")
+            self.iLogins = self.iLogins + 1
+            self.log("logged in")
+
+    # Grab and save a month of a counter
+    async def grabMonth(self, sCounter, iYear, iMonth):
+        sURL = plugin.API_ENDPOINT_DATA + "/" + str(iYear) + "/" + str(iMonth) + "/" + sCounter
+        async with self.accountLimiter:
+            for iAttempt in range(MAX_MONTH_ATTEMPTS):
+                iLogin = self.iLogins
+                try:
+                    Data, sResponse = await self.send("days", "GET", sURL)
+                except REQUEST_ERRORS as err:
+                    self.log("request failed for " + sCounter + " " + str(iYear) + "-" + str(iMonth) + ": " + str(err))
+                    continue
+                # Website is throttling requests, ask again after the pause
+                if sResponse == "throttled":
+                    continue
+                # Session expired, login again and ask again
+                if sResponse in ("redirect", "page"):
+                    await self.login(iLogin)
+                    continue
+                try:
+                    aOrdinals, aUsages, aTotals = plugin.parseStatJData(json.loads(Data["Data"]))
+                except ValueError as err:
+                    self.log("bad data for " + sCounter + " " + str(iYear) + "-" + str(iMonth) + ": " + str(err))
+                    break
+                try:
+                    self.saveMonth(sCounter, iYear, iMonth, aOrdinals, aUsages, aTotals)
+                except sqlite3.Error as err:
+                    self.log("cannot save " + sCounter + " " + str(iYear) + "-" + str(iMonth) + ": " + str(err))
+                    break
+                return
+        self.dStats["errors"] = self.dStats["errors"] + 1
+
+    # Save days of a month as the plugin does: every day measured by the counter, month marked final when it is complete
+    def saveMonth(self, sCounter, iYear, iMonth, aOrdinals, aUsages, aTotals):
+        lDays = [(plugin.ordinalToSQLDateString(aOrdinals[iRow]), aUsages[iRow], aTotals[iRow]) for iRow in range(len(aOrdinals)) if aTotals[iRow] > 0.0]
+        if self.historyStore:
+            self.historyStore.addMonth(sCounter, lDays, iYear, iMonth, plugin.isMonthComplete(iYear, iMonth, len(aOrdinals)))
+        else:
+            for sDay, fUsage, fTotal in lDays:
+                self.csvWriter.writerow([self.dAccount["user"], sCounter, sDay, fUsage, fTotal])
+        self.dStats["months"] = self.dStats["months"] + 1
+        self.dStats["days"] = self.dStats["days"] + len(lDays)
+
+    async def run(self):
+        dateLast = datetime.now().date() - timedelta(days=1)
+        dateFirst = datetime.now().date() - timedelta(days=self.args.days)
+        lMonths = []
+        for sCounter in plugin.parseCounterIds(",".join(str(counter) for counter in self.dAccount.get("counters", []))):
+            for iYear, iMonth, dateMonthFirst, dateMonthLast in plugin.buildMonthPlan(dateFirst, dateLast):
+                if self.historyStore and self.historyStore.isMonthFinal(sCounter, iYear, iMonth):
+                    self.dStats["skipped"] = self.dStats["skipped"] + 1
+                else:
+                    lMonths.append((sCounter, iYear, iMonth))
+        self.log(str(len(lMonths)) + " months to grab, " + str(self.dStats["skipped"]) + " already in local history")
+        if not lMonths:
+            return
+        try:
+            await self.login(self.iLogins)
+            # A month failing doesn't stop the others, connections are closed once every month is over
+            lResults = await asyncio.gather(*(self.grabMonth(sCounter, iYear, iMonth) for sCounter, iYear, iMonth in lMonths), return_exceptions=True)
+            for result in lResults:
+                if isinstance(result, Exception):
+                    self.log("month failed: " + repr(result))
+                    self.dStats["errors"] = self.dStats["errors"] + 1
+        except REQUEST_ERRORS + (RuntimeError,) as err:
+            self.log("failed: " + str(err))
+            self.dStats["errors"] = self.dStats["errors"] + 1
+        finally:
+            for connection in self.lConnections:
+                connection.close()
+
+# Accounts from the accounts file, or the account given on command line
+def loadAccounts(args):
+    if args.accounts:
+        with open(args.accounts) as accountsFile:
+            return json.load(accountsFile)
+    if not (args.user and args.password and args.counter):
+        sys.exit("Give --accounts, or --user, --password and --counter")
+    return [{"user": args.user, "password": args.password, "counters": args.counter}]
+
+async def backfill(args, lAccounts, csvWriter):
+    # Local histories are opened once, several accounts may share one
+    dStores = {}
+    lBackfills = []
+    # Every account shares the limit of requests to the website
+    hostLimiter = asyncio.Semaphore(args.per_host)
+    rateLimiter = plugin.RateLimiter(args.rate / 60.0, args.burst)
+    for dAccount in lAccounts:
+        historyStore = None
+        sStore = dAccount.get("store", args.store)
+        if sStore:
+            if sStore not in dStores:
+                dStores[sStore] = plugin.HistoryStore(sStore)
+            historyStore = dStores[sStore]
+        lBackfills.append(AccountBackfill(dAccount, args, hostLimiter, rateLimiter, historyStore, csvWriter))
+    # An account failing doesn't stop the others, local histories are closed once every account is over
+    try:
+        lResults = await asyncio.gather(*(accountBackfill.run() for accountBackfill in lBackfills), return_exceptions=True)
+        for accountBackfill, result in zip(lBackfills, lResults):
+            if isinstance(result, Exception):
+                accountBackfill.log("failed: " + repr(result))
+                accountBackfill.dStats["errors"] = accountBackfill.dStats["errors"] + 1
+    finally:
+        for historyStore in dStores.values():
+            historyStore.close()
+    return lBackfills
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill of Suez daily history of several accounts, outside of Domoticz")
+    parser.add_argument("--accounts", help="JSON file with a list of accounts")
+    parser.add_argument("--user", help="e-mail of a single account")
+    parser.add_argument("--password", help="password of a single account")
+    parser.add_argument("--counter", action="append", help="counter ID of a single account, can be repeated")
+    parser.add_argument("--days", type=int, default=1000, help="days of history to grab")
+    parser.add_argument("--parallel", type=int, default=plugin.DEFAULT_PARALLEL_REQUESTS, help="simultaneous requests of each account")
+    parser.add_argument("--per-host", type=int, default=plugin.MAX_PARALLEL_REQUESTS, help="simultaneous requests to the website, all accounts included")
+    parser.add_argument("--rate", type=int, default=plugin.DEFAULT_REQUESTS_PER_MINUTE, help="requests per minute to the website, all accounts included")
+    parser.add_argument("--burst", type=int, default=plugin.DEFAULT_REQUESTS_BURST, help="requests sent at once before being spaced by the rate")
+    parser.add_argument("--compress", action="store_true", help="ask compressed responses to the website")
+    parser.add_argument("--store", help="local history of the plugin where days are saved (default " + plugin.HISTORY_DB_NAME + ")")
+    parser.add_argument("--csv", help="CSV file where days are written instead of local history")
+    parser.add_argument("--server", help="host:port of a plain HTTP server to use instead of the website (local stand-in of fakeSuez.py)")
+    parser.add_argument("--quiet", action="store_true", help="only show the summary")
+    args = parser.parse_args()
+
+    if args.server:
+        args.host, _, sPort = args.server.partition(":")
+        args.port = int(sPort or 80)
+        args.sslContext = None
+    else:
+        args.host = plugin.API_BASE_URI
+        args.port = int(plugin.BASE_PORT)
+        args.sslContext = ssl.create_default_context()
+    if not (args.csv or args.store):
+        args.store = plugin.HISTORY_DB_NAME
+    lAccounts = loadAccounts(args)
+
+    fStart = time.perf_counter()
+    if args.csv:
+        with open(args.csv, "w", newline="") as csvFile:
+            csvWriter = csv.writer(csvFile)
+            csvWriter.writerow(["user", "counter", "day", "usage", "total"])
+            lBackfills = asyncio.run(backfill(args, lAccounts, csvWriter))
+    else:
+        lBackfills = asyncio.run(backfill(args, lAccounts, None))
+    fWallTime = time.perf_counter() - fStart
+
+    print("%-30s %7s %8s %7s %9s %9s %7s" % ("account", "months", "skipped", "days", "requests", "throttled", "errors"))
+    for accountBackfill in lBackfills:
+        dStats = accountBackfill.dStats
+        print("%-30s %7d %8d %7d %9d %9d %7d" % (accountBackfill.dAccount["user"], dStats["months"], dStats["skipped"], dStats["days"], dStats["requests"], dStats["throttled"], dStats["errors"]))
+    print("Done in %.3f s" % fWallTime)
+    if any(accountBackfill.dStats["errors"] for accountBackfill in lBackfills):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()